@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+#
+# Decodes a capture once and writes the outputs of all the tools out of it,
+# see lib/pipeline.py:
+#   phases  rule-install-rate: fl_change.dat, fl_replace.dat, fl_delete.dat,
+#           fl_churn.dat and their gnuplot scripts
+#   calls   rate-monitor: fl_change-rate*.dat, fl_change-call_duration*.dat
+#   dumps   rate-monitor: fl_change-stats*.dat, fl_change-dumps*.dat
+#   tree    rate-monitor: calltree.dat, calltree-windows.dat and
+#           calltree.folded, the self time of each probed function per call
+#           path
+#   ct      ct-monitor: events*.dat, or events.col with -b
+#   offcpu  offcpu.dat, where the time of the calls goes: on CPU, runnable
+#           or blocked, if the capture has the sched:* events
+# By default, all of those whose events are in the capture. With --plot, the
+# graphs are drawn too, with gnuplot and the perf-plot.sh scripts.
+#
+# Usage:
+#   # ./analyze.py [-i perf.data | -t perf-script.txt] [-a phases,calls,...]
+#         [-o dir] [-b] [-F] [--probe-set name] [--no-cache] [--plot]
+#         [title notes]
+#
+# The decoded samples of perf.data are kept in perf.data.cache, next to it,
+# for the next runs, see lib/eventcache.py.
+#
+# License: GPLv3
+#
+
+import argparse
+import os
+import subprocess
+import sys
+
+TOP = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(TOP, 'lib'))
+import downsample
+import eventcache
+import probeset
+from perfdata import PerfDataError
+from pipeline import Pipeline, ANALYZERS, FlowerPhases, CallAnalysis, \
+    CTLatency, OffCPU
+
+
+def plot(analyzers, args):
+    full = ['-F'] if args.full else []
+    for analyzer in analyzers:
+        if isinstance(analyzer, (FlowerPhases, OffCPU)):
+            for name in analyzer.plots:
+                subprocess.call(['gnuplot', name])
+        elif isinstance(analyzer, CallAnalysis):
+            subprocess.call([os.path.join(TOP, 'rate-monitor', 'perf-plot.sh'),
+                             '-s'] + args.notes)
+        elif isinstance(analyzer, CTLatency):
+            subprocess.call([os.path.join(TOP, 'ct-monitor', 'perf-plot.sh')] +
+                            full + args.notes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Decode a capture once and run all the analyzers on it')
+    parser.add_argument('-i', '--input', default='perf.data',
+                        help='perf.data file to read')
+    parser.add_argument('-t', '--text',
+                        help='use this perf script --ns output instead, - for stdin')
+    parser.add_argument('-a', '--analyzers', default=','.join(ANALYZERS),
+                        help='comma separated list out of: %s' %
+                             ', '.join(ANALYZERS))
+    parser.add_argument('-o', '--output', default='.',
+                        help='directory to write the outputs to')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='write the columnar files where supported')
+    parser.add_argument('-F', '--full', action='store_true',
+                        help='plot all points, instead of a reduced set')
+    parser.add_argument('--points', type=int, default=downsample.POINTS,
+                        help='x buckets per curve, when reducing them')
+    parser.add_argument('--simple', action='store_true',
+                        help='phases: only the fl_change() call rate')
+    parser.add_argument('--rate-window', type=float, default=1.0,
+                        help='phases, calls: call rate window (s)')
+    parser.add_argument('--rate-ewma', type=float, default=5.0,
+                        help='phases, calls: time constant of the rate '
+                             'EWMA (s)')
+    parser.add_argument('--stall-threshold', type=float, default=0.5,
+                        help='phases, calls: fraction of the median rate '
+                             'below which a window is a stall')
+    parser.add_argument('--dump-window', type=float, default=0.1,
+                        help='dumps: window for the dump cost, in seconds')
+    parser.add_argument('--size-buckets', type=int, default=10,
+                        help='dumps: table size buckets for the dump cost')
+    parser.add_argument('--probe-set', default=probeset.DEFAULT,
+                        help='calls, offcpu: driver probe set, as '
+                             'perf-probes.sh -s was given')
+    parser.add_argument('--tree-window', type=float, default=1.0,
+                        help='tree: self time window (s)')
+    parser.add_argument('-w', '--window', type=float, default=1.0,
+                        help='ct: latency percentiles and throughput window '
+                             '(s)')
+    parser.add_argument('--ttl', type=float, default=60.0,
+                        help='ct: how long a request may stay pending (s)')
+    parser.add_argument('--burst', type=int, default=10,
+                        help='ct: workqueue backlog that makes a burst')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='decode perf.data again, without its cache')
+    parser.add_argument('--plot', action='store_true',
+                        help='draw the graphs too')
+    parser.add_argument('notes', nargs='*',
+                        help='title notes for the graphs')
+    args = parser.parse_args()
+
+    names = args.analyzers.split(',')
+    for name in names:
+        if name not in ANALYZERS:
+            parser.error('unknown analyzer %s' % name)
+
+    try:
+        probeset.load(args.probe_set)
+    except probeset.ProbeSetError as err:
+        parser.error(err)
+
+    if args.text:
+        fp = sys.stdin if args.text == '-' else open(args.text)
+    else:
+        samples, meta = eventcache.samples(os.path.abspath(args.input),
+                                           not args.no_cache)
+
+    os.makedirs(args.output, exist_ok=True)
+    os.chdir(args.output)
+    pipeline = Pipeline(names, args)
+    if args.text:
+        pipeline.feed(fp)
+    else:
+        try:
+            pipeline.feed_samples(samples, meta)
+        except PerfDataError as err:
+            sys.exit(str(err))
+    used = pipeline.finish()
+    if not used:
+        sys.exit('None of the analyzers had events to work on')
+
+    if args.plot:
+        plot(used, args)
+
+
+if __name__ == '__main__':
+    main()
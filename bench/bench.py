@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+#
+# Throughput and memory benchmark of the analyzers, on synthetic events from
+# gen-events.py. Needs neither perf, nor a NIC, nor root.
+#
+# Each analyzer runs in its own process, on its own scratch directory, and
+# is measured for events/s (wall clock, best of --repeat runs) and peak RSS.
+# The startup of an empty interpreter, measured the same way, is taken off the
+# wall clock. Generated fixtures are kept in --dir and reused.
+#
+# Usage:
+#   # ./bench.py [-s 10k,1M,10M] [-a analyzer,...] [--save baseline.json]
+#   # ./bench.py --compare baseline.json [--threshold 10] [--compare-min 1M]
+# With --compare, the exit code is 1 if any analyzer got slower, or needed
+# more memory, than the baseline by more than the threshold (%). Runs of less
+# than --compare-min events are too short to tell, and are not compared.
+#
+# License: GPLv3
+#
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH = os.path.dirname(os.path.realpath(__file__))
+TOP = os.path.dirname(BENCH)
+
+# name -> workload, command line, with FILE replaced by the text fixture and
+# DATA by the perf.data one. perf.data is decoded each time, caching the
+# samples as lib/eventcache.py does, but for the -cached analyzers, which get
+# the cache built beforehand.
+ANALYZERS = {
+    'rule-install-rate': ('flower',
+        [os.path.join(TOP, 'rule-install-rate', 'rule-install-rate.py'),
+         'parse', '-N', '-t', 'FILE']),
+    'rule-install-rate-live': ('flower',
+        [os.path.join(TOP, 'rule-install-rate', 'rule-install-rate.py'),
+         'live', '-i', 'FILE']),
+    'rate-monitor': ('flower',
+        [os.path.join(TOP, 'rate-monitor', 'perf-analyze.py'),
+         '-t', 'FILE', '-j', '1']),
+    'ct-monitor': ('ct',
+        [os.path.join(TOP, 'lib', 'ctoffload.py'), '-t', 'FILE']),
+    'analyze': ('flower',
+        [os.path.join(TOP, 'analyze.py'), '-t', 'FILE']),
+    'rule-install-rate-native': ('flower',
+        [os.path.join(TOP, 'rule-install-rate', 'rule-install-rate.py'),
+         'parse', '-N', '-i', 'DATA']),
+    'rate-monitor-native': ('flower',
+        [os.path.join(TOP, 'rate-monitor', 'perf-analyze.py'),
+         '-i', 'DATA', '-j', '1']),
+    'ct-monitor-native': ('ct',
+        [os.path.join(TOP, 'lib', 'ctoffload.py'), '-i', 'DATA']),
+    'analyze-native': ('flower',
+        [os.path.join(TOP, 'analyze.py'), '-i', 'DATA']),
+    'rate-monitor-cached': ('flower',
+        [os.path.join(TOP, 'rate-monitor', 'perf-analyze.py'),
+         '-i', 'DATA', '-j', '1']),
+    'analyze-cached': ('flower',
+        [os.path.join(TOP, 'analyze.py'), '-i', 'DATA']),
+    'offcpu': ('flower-sched',
+        [os.path.join(TOP, 'lib', 'offcpu.py'), '-t', 'FILE']),
+    'calltree': ('flower',
+        [os.path.join(TOP, 'lib', 'calltree.py'), '-t', 'FILE']),
+}
+
+SIZES = '10k,1M'
+COMPARE_MIN = '1M'
+
+
+def count(text):
+    mult = {'k': 1000, 'm': 1000000}.get(text[-1:].lower(), 1)
+    return int(float(text[:-1] if mult != 1 else text) * mult)
+
+
+def fixture(args, workload, size, fmt='text'):
+    path = os.path.join(args.dir, '%s-%s-s%d.%s' %
+                        (workload, size, args.seed,
+                         'txt' if fmt == 'text' else 'data'))
+    if not os.path.exists(path):
+        print('Generating %s...' % path, file=sys.stderr)
+        tmp = path + '.tmp'
+        subprocess.check_call([os.path.join(BENCH, 'gen-events.py'),
+                               '-w', workload, '-n', size, '-f', fmt,
+                               '-s', str(args.seed), '-o', tmp])
+        os.rename(tmp, path)
+    return path
+
+
+def run(cmd, cwd):
+    """Returns the wall time and the peak RSS, in KiB, of cmd."""
+    start = time.monotonic()
+    proc = subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # Read stderr as it comes, so the child never blocks on it
+    err = proc.stderr.read()
+    pid, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.monotonic() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        sys.stderr.write(err.decode(errors='replace'))
+        raise RuntimeError('%s failed with %d' % (cmd[0], proc.returncode))
+    return elapsed, usage.ru_maxrss
+
+
+def startup(args):
+    """Returns the wall time of an empty interpreter, best of --repeat."""
+    return min([run([sys.executable, '-c', 'pass'], args.dir)[0]
+                for i in range(args.repeat)])
+
+
+def measure(args, name, size, overhead=0.0):
+    workload, cmd = ANALYZERS[name]
+    cache = None
+    if 'DATA' in cmd:
+        path = fixture(args, workload, size, 'perf.data')
+        cmd = [path if arg == 'DATA' else arg for arg in cmd]
+        cache = path + '.cache'
+        if name.endswith('-cached'):
+            subprocess.check_call([sys.executable,
+                                   os.path.join(TOP, 'lib', 'eventcache.py'),
+                                   '-i', path], stdout=subprocess.DEVNULL)
+            cache = None
+    else:
+        path = fixture(args, workload, size)
+        cmd = [path if arg == 'FILE' else arg for arg in cmd]
+    best = None
+    rss = 0
+    for i in range(args.repeat):
+        if cache is not None:
+            shutil.rmtree(cache, ignore_errors=True)
+        scratch = tempfile.mkdtemp(prefix='bench-', dir=args.dir)
+        try:
+            elapsed, maxrss = run([sys.executable] + cmd, scratch)
+        finally:
+            shutil.rmtree(scratch)
+        best = elapsed if best is None else min(best, elapsed)
+        rss = max(rss, maxrss)
+    best = max(best - overhead, 1e-6)
+    return {'events': count(size), 'seconds': best,
+            'events_per_sec': count(size) / best, 'peak_rss_kb': rss}
+
+
+def compare(results, baseline, threshold, min_events=0):
+    """Returns the lines describing the regressions, out of the runs of
+    min_events or more."""
+    regressions = []
+    for key, r in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None or r['events'] < min_events:
+            continue
+        speed = r['events_per_sec'] / base['events_per_sec'] - 1.0
+        memory = r['peak_rss_kb'] / base['peak_rss_kb'] - 1.0
+        if speed < -threshold:
+            regressions.append('%s: %.1f%% slower (%.0f events/s, was %.0f)' %
+                               (key, -speed * 100, r['events_per_sec'],
+                                base['events_per_sec']))
+        if memory > threshold:
+            regressions.append('%s: %.1f%% more memory (%d KiB, was %d)' %
+                               (key, memory * 100, r['peak_rss_kb'],
+                                base['peak_rss_kb']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the analyzers on synthetic events')
+    parser.add_argument('-s', '--sizes', default=SIZES,
+                        help='events per run, like 10k,1M,10M')
+    parser.add_argument('-a', '--analyzers', default=','.join(ANALYZERS),
+                        help='comma separated list out of: %s' %
+                             ', '.join(ANALYZERS))
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs of each, the fastest one counts')
+    parser.add_argument('-d', '--dir',
+                        default=os.path.join(tempfile.gettempdir(),
+                                             'perf-flower-bench'),
+                        help='where fixtures are kept')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a baseline')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='regression threshold, in %% (default 10)')
+    parser.add_argument('--compare-min', type=count, default=COMPARE_MIN,
+                        help='events below which runs are not compared '
+                             '(default %s)' % COMPARE_MIN)
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    names = args.analyzers.split(',')
+    for name in names:
+        if name not in ANALYZERS:
+            parser.error('unknown analyzer %s' % name)
+
+    baseline = None
+    if args.compare:
+        baseline = json.load(open(args.compare))
+
+    overhead = startup(args)
+    print('Interpreter startup: %.3fs, taken off each run' % overhead)
+    results = {}
+    print('%-24s %8s %12s %10s %10s' %
+          ('analyzer', 'events', 'events/s', 'seconds', 'peak MiB'))
+    for size in args.sizes.split(','):
+        for name in names:
+            r = measure(args, name, size, overhead)
+            results['%s/%s' % (name, size)] = r
+            print('%-24s %8s %12.0f %10.3f %10.1f' %
+                  (name, size, r['events_per_sec'], r['seconds'],
+                   r['peak_rss_kb'] / 1024.0), flush=True)
+
+    if args.save:
+        fp = open(args.save, 'w')
+        json.dump(results, fp, indent=1, sort_keys=True)
+        fp.write('\n')
+        fp.close()
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold / 100.0,
+                              args.compare_min)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against %s.' % args.compare)
+
+
+if __name__ == '__main__':
+    main()
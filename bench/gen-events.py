@@ -0,0 +1,506 @@
+#!/usr/bin/python3
+#
+# Generate synthetic 'perf script --ns' output, to benchmark the parsers
+# without perf, a NIC or root.
+#
+# Workloads:
+#   flower: tc -b workers inserting rules, each call with the flower:* code
+#           line probes from rule-install-rate.py and the probe:* ones from
+#           rate-monitor (tc_new_tfilter, fl_change, mlx5e_configure_flower
+#           and the mlx5_cmd_exec calls in it),
+#           some replaces and fl_delete calls, and a revalidator dumping stats
+#           meanwhile.
+#   ct:     conntrack entries being offloaded, with the nf_flow_table probes
+#           from ct-monitor: add, stats and del requests from softirq on any
+#           CPU, executed later on by kworkers.
+# Each worker runs on its own pid and moves between CPUs from time to time,
+# and the streams of all of them are merged in time order, as perf does.
+# flower-sched is flower with the workers also blocking on rtnl_lock and on
+# the driver, and getting preempted, with the sched:sched_switch and
+# sched:sched_wakeup events of that, as for lib/offcpu.py.
+#
+# With -f perf.data, the same events are written as a perf.data file instead,
+# as 'perf record -e probe:* -aR' would: one tracepoint attr per event, with
+# its format in the tracing data, and samples with their raw probe fields.
+# That's enough for perf script and for lib/perfdata.py to read it.
+#
+# Usage:
+#   # ./gen-events.py -w flower|flower-sched|ct -n 1M [-s seed] \
+#         [-f text|perf.data] [-o file]
+#
+# License: GPLv3
+#
+
+import argparse
+import heapq
+import random
+import struct
+import sys
+
+LINE = '%16s %6d [%03d] %.9f: %s: (%016x)%s\n'
+# Tracepoints have no address
+TP_LINE = '%16s %6d [%03d] %.9f: %s:%s\n'
+START = 16126.0
+
+# Addresses, just so that lines look like perf's
+IP = {
+    'fl_change': 0xffffffffc0a14e70,
+    'mlx5e_configure_flower': 0xffffffffc0d3a2b0,
+    'mlx5_cmd_exec': 0xffffffffc0c81e40,
+    'tc_new_tfilter': 0xffffffff8c553f20,
+    'tc_dump_tfilter': 0xffffffff8c554490,
+    'fl_delete': 0xffffffffc0a13b60,
+    'nf_flow_table': 0xffffffffc09e1000,
+}
+
+
+def count(text):
+    """Parses 10k, 1M or 10M."""
+    mult = {'k': 1000, 'm': 1000000}.get(text[-1:].lower(), 1)
+    if mult != 1:
+        text = text[:-1]
+    return int(float(text) * mult)
+
+
+class Task():
+    def __init__(self, comm, pid, ncpus, rng, cpu=None):
+        self.comm = comm
+        self.pid = pid
+        self.ncpus = ncpus
+        self.rng = rng
+        self.pinned = cpu is not None
+        self.cpu = rng.randrange(ncpus) if cpu is None else cpu
+
+    def line(self, ts, event, ip, args=''):
+        # Every now and then the task gets migrated
+        if not self.pinned and self.rng.random() < 0.01:
+            self.cpu = self.rng.randrange(self.ncpus)
+        return (ts, self.comm, self.pid, self.cpu, event, ip, args)
+
+
+class TextWriter():
+    def __init__(self, fp):
+        self.fp = fp
+
+    def add(self, events):
+        self.fp.write(''.join([LINE % (comm, pid, cpu, ts, event, ip, args)
+                               if ip is not None else
+                               TP_LINE % (comm, pid, cpu, ts, event, args)
+                               for ts, comm, pid, cpu, event, ip, args
+                               in events]))
+
+    def close(self):
+        self.fp.close()
+
+
+# perf.data bits, see lib/perfdata.py. Samples have the identifier, ip, tid,
+# time, cpu, period and raw data.
+SAMPLE_TYPE = (1 << 16) | (1 << 0) | (1 << 1) | (1 << 2) | (1 << 7) | \
+              (1 << 8) | (1 << 10)
+ATTR_SIZE = 128
+FEATURES = (1, 4, 7, 8, 12)     # tracing data, osrelease, nrcpus, cpudesc,
+                                # event desc
+# Tracepoint systems, the others are probes
+TRACEPOINTS = ('sched',)
+# prev_state letters -> value
+TASK_STATES = {'R': 0, 'S': 1, 'D': 2, 'R+': 0x100}
+COMMON_FIELDS = (
+    '\tfield:unsigned short common_type;\toffset:0;\tsize:2;\tsigned:0;\n'
+    '\tfield:unsigned char common_flags;\toffset:2;\tsize:1;\tsigned:0;\n'
+    '\tfield:unsigned char common_preempt_count;\toffset:3;\tsize:1;\t'
+    'signed:0;\n'
+    '\tfield:int common_pid;\toffset:4;\tsize:4;\tsigned:1;\n\n')
+
+
+def parse_args(args):
+    """Returns the fields out of the args of an event, as (name, declaration,
+    struct format, value): hex numbers as u64, decimal ones as s64, task
+    states as long and anything else as a char[16]."""
+    fields = []
+    for arg in args.split():
+        name, sep, value = arg.partition('=')
+        if not name or not sep:
+            continue
+        if name.endswith('_state'):
+            fields.append((name, 'long', 'q', TASK_STATES[value]))
+        elif value.startswith('0x'):
+            fields.append((name, 'u64', 'Q', int(value, 16)))
+        elif value.isdigit():
+            fields.append((name, 's64', 'q', int(value)))
+        else:
+            fields.append((name, 'char', '16s', value.encode()))
+    return fields
+
+
+def perf_string(text):
+    data = text.encode() + b'\0'
+    data += b'\0' * (-len(data) % 64)
+    return struct.pack('<I', len(data)) + data
+
+
+class PerfDataWriter():
+    """Writes the events as a perf.data file: the header, the samples, the
+    features, and then the attrs, as their number is only known at the
+    end."""
+
+    def __init__(self, fp, ncpus):
+        self.fp = fp
+        self.ncpus = ncpus
+        # event name -> [ attr index, tracepoint id, probe fields,
+        #                 (name, declaration) of the args, raw data struct ]
+        self.events = { }
+        self.comms = set()
+        self.fp.write(b'\0' * 104)
+        self.data_off = 104
+
+    def event(self, name, args):
+        try:
+            return self.events[name]
+        except KeyError:
+            pass
+        # kprobes have the probe address, kretprobes the function and the
+        # return address, and then the fetched args
+        fields = parse_args(args)
+        if name.split(':', 1)[0] in TRACEPOINTS:
+            probe = []
+        elif name.endswith('__return'):
+            probe = ['__probe_func', '__probe_ret_ip']
+        else:
+            probe = ['__probe_ip']
+        layout = struct.Struct('<HBBi' + 'Q' * len(probe) +
+                               ''.join([f[2] for f in fields]))
+        fields = [(f[0], f[1]) for f in fields]
+        event = self.events[name] = [len(self.events),
+                                     2000 + len(self.events), probe, fields,
+                                     layout]
+        return event
+
+    def add(self, events):
+        out = []
+        for ts, comm, pid, cpu, name, ip, args in events:
+            if pid not in self.comms:
+                self.comms.add(pid)
+                text = comm.encode()[:15] + b'\0'
+                text += b'\0' * (-len(text) % 8)
+                out.append(struct.pack('<IHHII', 3, 0, 16 + len(text), pid,
+                                       pid) + text)
+
+            ip = ip or 0
+            index, tp, probe, fields, layout = self.event(name, args)
+            values = [f[3] for f in parse_args(args)]
+            raw = layout.pack(tp, 0, 0, pid, *([ip] * len(probe) + values))
+            raw += b'\0' * (-(len(raw) + 4) % 8)
+            size = 8 + 8 * 6 + 4 + len(raw)
+            # In ns, as the text has them
+            time = int(('%.9f' % ts).replace('.', ''))
+            out.append(struct.pack('<IHHQQIIQIIQI', 9, 1, size, index + 1, ip,
+                                   pid, pid, time, cpu, 0, 1, len(raw)) + raw)
+        # Each batch is a round, as perf would flush them
+        out.append(struct.pack('<IHH', 68, 0, 8))
+        self.fp.write(b''.join(out))
+
+    def tracing_data(self):
+        systems = { }
+        for name, (index, tp, probe, fields, layout) in self.events.items():
+            system, event = name.split(':', 1)
+            text = 'name: %s\nID: %d\nformat:\n' % (event, tp) + COMMON_FIELDS
+            offset = 8
+            for field in probe:
+                text += '\tfield:unsigned long %s;\toffset:%d;\tsize:8;\t' \
+                        'signed:0;\n' % (field, offset)
+                offset += 8
+            for field, decl in fields:
+                if decl == 'char':
+                    text += '\tfield:char %s[16];\toffset:%d;\tsize:16;\t' \
+                            'signed:0;\n' % (field, offset)
+                    offset += 16
+                else:
+                    text += '\tfield:%s %s;\toffset:%d;\tsize:8;\t' \
+                            'signed:%d;\n' % (decl, field, offset,
+                                              decl != 'u64')
+                    offset += 8
+            text += '\nprint fmt: ""\n'
+            systems.setdefault(system, []).append(text.encode())
+
+        data = b'\x17\x08\x44tracing0.6\0' + struct.pack('<BBI', 0, 8, 4096)
+        for section in (b'header_page', b'header_event'):
+            data += section + b'\0' + struct.pack('<Q', 0)
+        data += struct.pack('<I', 0)
+        data += struct.pack('<I', len(systems))
+        for system, formats in systems.items():
+            data += system.encode() + b'\0' + struct.pack('<I', len(formats))
+            for text in formats:
+                data += struct.pack('<Q', len(text)) + text
+        data += struct.pack('<I', 0) + struct.pack('<I', 0) + \
+            struct.pack('<Q', 0)
+        return data
+
+    def attr(self, tp):
+        attr = struct.pack('<IIQQQQQ', 2, ATTR_SIZE, tp, 1, SAMPLE_TYPE, 0,
+                           1 << 18)
+        return attr + b'\0' * (ATTR_SIZE - len(attr))
+
+    def close(self):
+        fp = self.fp
+        data_size = fp.tell() - self.data_off
+        events = sorted(self.events.items(), key=lambda e: e[1][0])
+
+        desc = struct.pack('<II', len(events), ATTR_SIZE)
+        for name, (index, tp, probe, fields, layout) in events:
+            desc += self.attr(tp) + struct.pack('<I', 1) + \
+                perf_string(name) + struct.pack('<Q', index + 1)
+        features = {
+            1: self.tracing_data(),
+            4: perf_string('5.14.0-synthetic'),
+            7: struct.pack('<II', self.ncpus, self.ncpus),
+            8: perf_string('Synthetic CPU @ 2.00GHz'),
+            12: desc,
+        }
+
+        # The feature sections table, right after the data, then each one
+        pos = fp.tell() + 16 * len(FEATURES)
+        table = b''
+        for bit in FEATURES:
+            table += struct.pack('<QQ', pos, len(features[bit]))
+            pos += len(features[bit])
+        fp.write(table)
+        for bit in FEATURES:
+            fp.write(features[bit])
+
+        # attrs, each one followed by its ids section, and the ids
+        attrs_off = fp.tell()
+        ids_off = attrs_off + (ATTR_SIZE + 16) * len(events)
+        for name, (index, tp, probe, fields, layout) in events:
+            fp.write(self.attr(tp) +
+                     struct.pack('<QQ', ids_off + 8 * index, 8))
+        for name, (index, tp, probe, fields, layout) in events:
+            fp.write(struct.pack('<Q', index + 1))
+
+        bitmap = 0
+        for bit in FEATURES:
+            bitmap |= 1 << bit
+        fp.seek(0)
+        fp.write(b'PERFILE2' + struct.pack('<QQQQQQQQ', 104, ATTR_SIZE + 16,
+                                           attrs_off, ids_off - attrs_off,
+                                           self.data_off, data_size, 0, 0) +
+                 struct.pack('<4Q', bitmap, 0, 0, 0))
+        fp.close()
+
+
+def off_cpu(task, rng, ts, state, sleep, wait):
+    """Switches the task out with prev_state 'state', wakes it up after
+    'sleep', unless it was preempted, and switches it back in after 'wait',
+    sometimes on another CPU. Yields the events, and returns when the task
+    is back."""
+    yield (ts, task.comm, task.pid, task.cpu, 'sched:sched_switch', None,
+           ' prev_comm=%s prev_pid=%d prev_prio=120 prev_state=%s ==> '
+           'next_comm=swapper/%d next_pid=0 next_prio=120' %
+           (task.comm, task.pid, state, task.cpu))
+    if state != 'R+':
+        ts += sleep
+        cpu = rng.randrange(task.ncpus)
+        yield (ts, 'swapper/%d' % cpu, 0, cpu, 'sched:sched_wakeup', None,
+               ' comm=%s pid=%d prio=120 target_cpu=%03d' %
+               (task.comm, task.pid, task.cpu))
+    ts += wait
+    if not task.pinned and rng.random() < 0.3:
+        task.cpu = rng.randrange(task.ncpus)
+    yield (ts, 'swapper/%d' % task.cpu, 0, task.cpu, 'sched:sched_switch',
+           None, ' prev_comm=swapper/%d prev_pid=0 prev_prio=120 '
+           'prev_state=R ==> next_comm=%s next_pid=%d next_prio=120' %
+           (task.cpu, task.comm, task.pid))
+    return ts
+
+
+def tc_worker(task, rng, rate, sched=False):
+    """One tc -b process, inserting rules back to back. With sched, it also
+    waits for rtnl_lock and for the driver, and gets preempted."""
+    ts = START + rng.random() * 1e-3
+    gap = 1.0 / rate
+    fl = IP['fl_change']
+    drv = IP['mlx5e_configure_flower']
+    cmd = IP['mlx5_cmd_exec']
+    tc = IP['tc_new_tfilter']
+    while True:
+        d = rng.expovariate(1.0 / gap)
+        # Events 1ns apart below must stay in order, as in perf's ns stamps
+        step = max(d / 10, 2e-9)
+        if sched and rng.random() < 0.1:
+            # rtnl_lock is taken by someone else
+            ts = yield from off_cpu(task, rng, ts + step, 'D',
+                                    rng.expovariate(0.5 / gap),
+                                    rng.expovariate(5.0 / gap))
+        yield task.line(ts, 'probe:tc_new_tfilter', tc)
+        ts += step
+        yield task.line(ts, 'flower:fl_change_entry', fl)
+        yield task.line(ts + 1e-9, 'probe:fl_change', fl)
+        ts += step
+        yield task.line(ts, 'flower:fl_change_sw', fl + 0x1a3)
+        if sched and rng.random() < 0.02:
+            ts = yield from off_cpu(task, rng, ts + step, 'R+', 0,
+                                    rng.expovariate(2.0 / gap))
+        ts += step * 2
+        yield task.line(ts, 'flower:fl_change_hw', fl + 0x2b7)
+        ts += step
+        yield task.line(ts, 'probe:mlx5e_configure_flower', drv)
+        if sched and rng.random() < 0.05:
+            # Waiting for the firmware
+            ts = yield from off_cpu(task, rng, ts + step, 'D',
+                                    rng.expovariate(1.0 / gap),
+                                    rng.expovariate(10.0 / gap))
+        # A firmware command, in the time the driver takes anyway
+        yield task.line(ts + step, 'probe:mlx5_cmd_exec', cmd)
+        yield task.line(ts + step * 2, 'probe:mlx5_cmd_exec__return',
+                        drv + 0x5e4, ' <- mlx5e_configure_flower')
+        # The driver is slow now and then
+        ts += step * (50 if rng.random() < 0.001 else 3)
+        yield task.line(ts, 'probe:mlx5e_configure_flower__return',
+                        fl + 0x2c0, ' <- fl_change')
+        ts += step
+        # Some calls replace an existing filter
+        fold = 0xffff888123450000 + rng.randrange(1 << 16) * 0x100 \
+            if rng.random() < 0.05 else 0
+        yield task.line(ts, 'flower:fl_change_fold', fl + 0x3d1,
+                        ' fold=0x%x' % fold)
+        ts += step
+        yield task.line(ts, 'flower:fl_change_ret', fl + 0x412)
+        yield task.line(ts + 1e-9, 'probe:fl_change__return', tc + 0x1f0,
+                        ' <- tc_new_tfilter')
+        ts += step
+        yield task.line(ts, 'probe:tc_new_tfilter__return', 0xffffffff8c55e000,
+                        ' <- rtnetlink_rcv_msg')
+        ts += step
+
+        if rng.random() < 0.05:
+            yield task.line(ts, 'flower:fl_delete_entry', IP['fl_delete'])
+            yield task.line(ts + 1e-9, 'probe:fl_delete', IP['fl_delete'])
+            ts += step
+            yield task.line(ts, 'flower:fl_hw_destroy_entry', IP['fl_delete'] + 0x900)
+            ts += step * 2
+            yield task.line(ts, 'flower:fl_hw_destroy_ret', IP['fl_delete'] + 0x80)
+            ts += step
+            yield task.line(ts, 'flower:fl_delete_ret', tc + 0x2a0)
+            yield task.line(ts + 1e-9, 'probe:fl_delete__return', tc + 0x2a0,
+                            ' <- tc_del_tfilter')
+            ts += step
+
+
+def revalidator(task, rng):
+    """Stats dumps, as OVS would do."""
+    ts = START
+    dump = IP['tc_dump_tfilter']
+    while True:
+        ts += rng.expovariate(1000.0)
+        yield task.line(ts, 'probe:tc_dump_tfilter', dump)
+        ts += rng.expovariate(20000.0)
+        yield task.line(ts, 'probe:tc_dump_tfilter__return', 0xffffffff8c5a1c40,
+                        ' <- netlink_dump')
+
+
+def flower(args, rng, sched=False):
+    streams = []
+    for w in range(args.workers):
+        task = Task('tc', 5000 + w, args.cpus, rng)
+        streams.append(tc_worker(task, rng, args.rate, sched))
+    streams.append(revalidator(Task('revalidator12', 4900, args.cpus, rng),
+                               rng))
+    return heapq.merge(*streams)
+
+
+def ct(args, rng):
+    """Flows come and go, each one with its add, some stats and its del
+    requests, executed on a kworker after a while."""
+    base = IP['nf_flow_table']
+    kworkers = [Task('kworker/u%d:%d' % (args.cpus * 2, i), 300 + i,
+                     args.cpus, rng) for i in range(args.workers)]
+    softirq = [Task('ksoftirqd/%d' % cpu, 10 + cpu * 6, args.cpus, rng, cpu)
+               for cpu in range(args.cpus)]
+
+    pending = []
+    ts = START
+    serial = 0
+    while True:
+        ts += rng.expovariate(args.rate)
+        while pending and pending[0][0] <= ts:
+            yield heapq.heappop(pending)
+
+        serial += 1
+        offload = 0xffff888100000000 + serial * 0x100
+        life = rng.uniform(0.5, 5.0)
+        ops = [('add', 0.0)]
+        t = 1.0
+        while t < life:
+            ops.append(('stats', t))
+            t += 1.0
+        ops.append(('del', life))
+
+        for op, when in ops:
+            req = ts + when
+            req_task = softirq[rng.randrange(args.cpus)]
+            line = 'nf_flow_offload_%s_L%d' % (op, 11 if op == 'stats' else 6)
+            heapq.heappush(pending, req_task.line(req, 'probe:' + line, base,
+                                                  ' offload=0x%x' % offload))
+            # Mostly quick, with a long tail when the workqueue backs up
+            delay = rng.expovariate(5000.0)
+            if rng.random() < 0.01:
+                delay += rng.expovariate(20.0)
+            kw = kworkers[rng.randrange(len(kworkers))]
+            done = req + delay
+            heapq.heappush(pending, kw.line(done, 'probe:flow_offload_work_handler',
+                                            base + 0x400))
+            heapq.heappush(pending, kw.line(done + 1e-7,
+                                            'probe:flow_offload_work_' + op,
+                                            base + 0x500,
+                                            ' offload=0x%x' % offload))
+
+
+def flower_sched(args, rng):
+    return flower(args, rng, sched=True)
+
+
+WORKLOADS = {'flower': flower, 'flower-sched': flower_sched, 'ct': ct}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic perf script --ns output')
+    parser.add_argument('-w', '--workload', required=True,
+                        choices=sorted(WORKLOADS))
+    parser.add_argument('-n', '--events', type=count, default=count('1M'),
+                        help='number of events, like 10k, 1M or 10M')
+    parser.add_argument('-o', '--output', default='-',
+                        help='output file, - for stdout')
+    parser.add_argument('-f', '--format', default='text',
+                        choices=('text', 'perf.data'))
+    parser.add_argument('-s', '--seed', type=int, default=1)
+    parser.add_argument('-j', '--workers', type=int, default=4,
+                        help='tc processes or kworkers')
+    parser.add_argument('-c', '--cpus', type=int, default=16)
+    parser.add_argument('-r', '--rate', type=float, default=20000.0,
+                        help='rules per second per tc process, or new flows '
+                             'per second')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.format == 'text':
+        out = TextWriter(sys.stdout if args.output == '-'
+                         else open(args.output, 'w'))
+    else:
+        if args.output == '-':
+            parser.error('perf.data needs an output file')
+        out = PerfDataWriter(open(args.output, 'wb'), args.cpus)
+    events = WORKLOADS[args.workload](args, rng)
+    left = args.events
+    while left:
+        batch = []
+        for event in events:
+            batch.append(event)
+            if len(batch) == min(left, 65536):
+                break
+        out.add(batch)
+        left -= len(batch)
+    out.close()
+
+
+if __name__ == '__main__':
+    main()
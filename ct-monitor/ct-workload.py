@@ -0,0 +1,464 @@
+#!/usr/bin/python3
+#
+# Conntrack offload workload, for ct-monitor, that needs no NIC.
+#
+# Three network namespaces, client, forwarder and server, are connected by
+# veth pairs:
+#   <name>-cli  10.99.1.2 --- 10.99.1.1  <name>-fwd  10.99.2.1 --- 10.99.2.2
+#                                                                <name>-srv
+# and the forwarder has tc act_ct on the ingress of both of its veths, which
+# puts the connections in a flowtable once they are established. act_ct
+# always asks for the hardware offload of its flowtables, so every connection
+# still goes through nf_flow_offload_add/del/stats and their workqueues,
+# there's just no driver behind them.
+#
+# TCP or UDP connections are then opened from the client to the server, at a
+# given rate, in three phases:
+#   setup     until there are --concurrency connections
+#   steady    for --duration seconds, with --churn connections per second
+#             closed, oldest first, and opened again
+#   teardown  closing all of them, at the same rate as they were opened
+# Each connection sends a byte every --interval seconds, which the server
+# echoes, so that conntrack sees it both ways and keeps it established. UDP
+# connections are only removed from conntrack when they time out, 30s after
+# being closed by default.
+#
+# Outputs, in the current directory:
+#   ct-workload.dat          per --log-interval: open and established
+#                            connections, and the ones opened, closed and
+#                            failed so far
+#   ct-workload-phases.dat   when each phase started and ended
+# Timestamps are CLOCK_MONOTONIC, the clock that perf record -k
+# CLOCK_MONOTONIC uses, so that perf-plot.sh can mark the phases in the
+# graphs.
+#
+# Usage:
+#   # ./ct-workload.py setup [-n name] [-z zone]
+#   # ./ct-workload.py run [-n name] [-p tcp|udp] [-r rate] [-c concurrency]
+#         [-d duration] [--churn rate] [-i interval] [--ports count] [-R]
+#   # ./ct-workload.py teardown [-n name]
+# With -R, run captures the probes of perf-probes.sh meanwhile, as
+#   # perf record -e probe:* -aR -k CLOCK_MONOTONIC -- <the client>
+# would.
+#
+# License: GPLv3
+#
+
+import argparse
+import errno
+import heapq
+import os
+import resource
+import selectors
+import socket
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+CLIENT_ADDR = '10.99.1.2'
+SERVER_ADDR = '10.99.2.2'
+PREFIX = 24
+
+# Addresses of the forwarder, on the client and server sides
+FWD_CLIENT_ADDR = '10.99.1.1'
+FWD_SERVER_ADDR = '10.99.2.1'
+
+BASE_PORT = 5201
+
+PING = b'.'
+
+# Pacing can't catch up more than this many seconds of delay at once
+MAX_LAG = 1.0
+
+
+def namespaces(name):
+    return name + '-cli', name + '-fwd', name + '-srv'
+
+
+def run(*cmd):
+    print(' '.join(cmd))
+    subprocess.check_call(cmd)
+
+
+def raise_nofile():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+#
+# Namespaces
+#
+
+def ct_rules(ns, dev, zone):
+    """act_ct on the ingress of dev: untracked packets go through conntrack,
+    new connections are committed and the established ones go on, which is
+    when act_ct adds them to its flowtable."""
+    run('tc', '-n', ns, 'qdisc', 'add', 'dev', dev, 'ingress')
+    flower = ['tc', '-n', ns, 'filter', 'add', 'dev', dev, 'ingress',
+              'prio', '1']
+    run(*flower + ['chain', '0', 'proto', 'ip', 'flower', 'ct_state', '-trk',
+                   'action', 'ct', 'zone', str(zone), 'pipe',
+                   'action', 'goto', 'chain', '1'])
+    run(*flower + ['chain', '1', 'proto', 'ip', 'flower',
+                   'ct_state', '+trk+new',
+                   'action', 'ct', 'zone', str(zone), 'commit', 'pipe',
+                   'action', 'pass'])
+    run(*flower + ['chain', '1', 'proto', 'ip', 'flower',
+                   'ct_state', '+trk+est', 'action', 'pass'])
+
+
+def setup(args):
+    teardown(args, quiet=True)
+    cli, fwd, srv = namespaces(args.name)
+    for ns in (cli, fwd, srv):
+        run('ip', 'netns', 'add', ns)
+        run('ip', '-n', ns, 'link', 'set', 'lo', 'up')
+
+    for ns, addr, gw in ((cli, CLIENT_ADDR, FWD_CLIENT_ADDR),
+                         (srv, SERVER_ADDR, FWD_SERVER_ADDR)):
+        peer = 'fwd-' + ns[-3:]
+        run('ip', 'link', 'add', 'eth0', 'netns', ns,
+            'type', 'veth', 'peer', 'name', peer, 'netns', fwd)
+        run('ip', '-n', ns, 'addr', 'add', '%s/%d' % (addr, PREFIX),
+            'dev', 'eth0')
+        run('ip', '-n', ns, 'link', 'set', 'eth0', 'up')
+        run('ip', '-n', ns, 'route', 'add', 'default', 'via', gw)
+        run('ip', '-n', fwd, 'addr', 'add', '%s/%d' % (gw, PREFIX),
+            'dev', peer)
+        run('ip', '-n', fwd, 'link', 'set', peer, 'up')
+        ct_rules(fwd, peer, args.zone)
+
+    run('ip', 'netns', 'exec', fwd, 'sysctl', '-qw', 'net.ipv4.ip_forward=1')
+    # Connections closed by the client wait in TIME_WAIT on its side
+    run('ip', 'netns', 'exec', cli, 'sysctl', '-qw',
+        'net.ipv4.ip_local_port_range=1024 65535')
+    run('ip', 'netns', 'exec', cli, 'sysctl', '-qw', 'net.ipv4.tcp_tw_reuse=1')
+    run('ip', 'netns', 'exec', srv, 'sysctl', '-qw', 'net.core.somaxconn=4096')
+
+
+def teardown(args, quiet=False):
+    for ns in namespaces(args.name):
+        if os.path.exists(os.path.join('/run/netns', ns)):
+            run('ip', 'netns', 'del', ns)
+        elif not quiet:
+            print('No namespace %s.' % ns)
+
+
+#
+# Server: echoes whatever comes in, on --ports ports from BASE_PORT
+#
+
+def server(args):
+    raise_nofile()
+    sel = selectors.DefaultSelector()
+    udp = args.proto == 'udp'
+    for port in range(BASE_PORT, BASE_PORT + args.ports):
+        sock = socket.socket(socket.AF_INET,
+                             socket.SOCK_DGRAM if udp else socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((SERVER_ADDR, port))
+        if not udp:
+            sock.listen(4096)
+        sock.setblocking(False)
+        sel.register(sock, selectors.EVENT_READ, 'udp' if udp else 'listen')
+    print('ready', flush=True)
+
+    while True:
+        for key, mask in sel.select():
+            sock = key.fileobj
+            try:
+                if key.data == 'listen':
+                    conn, addr = sock.accept()
+                    conn.setblocking(False)
+                    sel.register(conn, selectors.EVENT_READ, 'tcp')
+                elif key.data == 'udp':
+                    data, addr = sock.recvfrom(2048)
+                    sock.sendto(data, addr)
+                else:
+                    data = sock.recv(2048)
+                    if not data:
+                        sel.unregister(sock)
+                        sock.close()
+                    else:
+                        sock.send(data)
+            except BlockingIOError:
+                pass
+            except OSError:
+                if key.data == 'tcp':
+                    sel.unregister(sock)
+                    sock.close()
+
+
+#
+# Client
+#
+
+class Client():
+    def __init__(self, args):
+        self.args = args
+        self.udp = args.proto == 'udp'
+        self.sel = selectors.DefaultSelector()
+        # id -> socket, oldest first
+        self.conns = OrderedDict()
+        self.established = set()
+        self.next_id = 0
+        # (when, id) of the next ping of each connection
+        self.pings = []
+        self.opened = 0
+        self.closed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.log = open('ct-workload.dat', 'w')
+        self.log.write('#tstamp\tphase\topen\testablished\topened\tclosed'
+                       '\tfailed\tdropped\n')
+        self.phases = open('ct-workload-phases.dat', 'w')
+        self.phases.write('#phase\tstart\tend\n')
+        self.phase = None
+        self.phase_start = 0.0
+        self.next_log = 0.0
+
+    def open(self, now):
+        sock = socket.socket(socket.AF_INET,
+                             socket.SOCK_DGRAM if self.udp
+                             else socket.SOCK_STREAM)
+        sock.setblocking(False)
+        port = BASE_PORT + self.opened % self.args.ports
+        self.opened += 1
+        err = sock.connect_ex((SERVER_ADDR, port))
+        if err not in (0, errno.EINPROGRESS):
+            sock.close()
+            self.failed += 1
+            return
+        cid = self.next_id
+        self.next_id += 1
+        self.conns[cid] = sock
+        if self.udp:
+            self.connected(cid, now)
+        else:
+            self.sel.register(sock, selectors.EVENT_WRITE, cid)
+
+    def connected(self, cid, now):
+        sock = self.conns[cid]
+        if self.udp:
+            self.sel.register(sock, selectors.EVENT_READ, cid)
+        else:
+            self.sel.modify(sock, selectors.EVENT_READ, cid)
+        self.established.add(cid)
+        heapq.heappush(self.pings, (now, cid))
+
+    def drop(self, cid):
+        sock = self.conns.pop(cid)
+        self.established.discard(cid)
+        self.sel.unregister(sock)
+        sock.close()
+
+    def close_oldest(self):
+        if self.conns:
+            self.drop(next(iter(self.conns)))
+            self.closed += 1
+
+    def ping(self, now):
+        interval = self.args.interval
+        pings = self.pings
+        while pings and pings[0][0] <= now:
+            when, cid = heapq.heappop(pings)
+            if cid not in self.established:
+                continue
+            try:
+                self.conns[cid].send(PING)
+            except BlockingIOError:
+                pass
+            except OSError:
+                self.drop(cid)
+                self.dropped += 1
+                continue
+            heapq.heappush(pings, (when + interval, cid))
+
+    def poll(self, timeout, now):
+        for key, mask in self.sel.select(max(timeout, 0)):
+            cid = key.data
+            sock = key.fileobj
+            if cid not in self.established:
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    self.drop(cid)
+                    self.failed += 1
+                else:
+                    self.connected(cid, now)
+                continue
+            try:
+                while sock.recv(2048):
+                    pass
+            except BlockingIOError:
+                continue
+            except OSError:
+                pass
+            # Closed by the server, or refused
+            self.drop(cid)
+            self.dropped += 1
+
+    def write_log(self, now):
+        self.log.write('%f\t%s\t%d\t%d\t%d\t%d\t%d\t%d\n' %
+                       (now, self.phase, len(self.conns),
+                        len(self.established), self.opened, self.closed,
+                        self.failed, self.dropped))
+
+    def start_phase(self, phase, now):
+        if self.phase is not None:
+            self.write_log(now)
+            self.phases.write('%s\t%f\t%f\n' % (self.phase, self.phase_start,
+                                                now))
+            print('%s: %fs, %d open, %d opened, %d closed, %d failed, '
+                  '%d dropped' % (self.phase, now - self.phase_start,
+                                  len(self.conns), self.opened, self.closed,
+                                  self.failed, self.dropped), flush=True)
+        self.phase = phase
+        self.phase_start = now
+
+    def paced(self, now, next_time, rate):
+        """How many things are due at rate, and when the next one is."""
+        if rate <= 0:
+            return 0, now + MAX_LAG
+        next_time = max(next_time, now - MAX_LAG)
+        due = 0
+        while next_time <= now:
+            due += 1
+            next_time += 1.0 / rate
+        return due, next_time
+
+    def loop(self, phase, done, rate, step, until=None):
+        """Runs step() at rate, until done() or time is up."""
+        now = time.monotonic()
+        self.start_phase(phase, now)
+        next_step = now
+        while not done() and (until is None or now < until):
+            if self.failed > self.args.concurrency:
+                sys.exit('%d connections failed, is the server up?' %
+                         self.failed)
+            due, next_step = self.paced(now, next_step, rate)
+            while due and not done():
+                step(now)
+                due -= 1
+            self.ping(now)
+            if now >= self.next_log:
+                self.write_log(now)
+                self.next_log = now + self.args.log_interval
+            wake = min(next_step, self.next_log)
+            if self.pings:
+                wake = min(wake, self.pings[0][0])
+            if until is not None:
+                wake = min(wake, until)
+            self.poll(wake - time.monotonic(), now)
+            now = time.monotonic()
+
+    def churn(self, now):
+        self.close_oldest()
+        self.open(now)
+
+    def run(self):
+        args = self.args
+        self.loop('setup', lambda: len(self.conns) >= args.concurrency,
+                  args.rate, self.open)
+        self.loop('steady', lambda: False, args.churn, self.churn,
+                  time.monotonic() + args.duration)
+        self.loop('teardown', lambda: not self.conns, args.rate,
+                  lambda now: self.close_oldest())
+        self.start_phase(None, time.monotonic())
+        self.log.close()
+        self.phases.close()
+
+
+def client(args):
+    raise_nofile()
+    Client(args).run()
+
+
+def workload(args):
+    cli, fwd, srv = namespaces(args.name)
+    for ns in (cli, fwd, srv):
+        if not os.path.exists(os.path.join('/run/netns', ns)):
+            sys.exit('No namespace %s, see %s setup.' % (ns, sys.argv[0]))
+
+    me = [sys.executable, os.path.realpath(__file__)]
+    opts = ['-n', args.name, '-p', args.proto, '--ports', str(args.ports)]
+    proc = subprocess.Popen(['ip', 'netns', 'exec', srv] + me +
+                            ['server'] + opts,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        if proc.stdout.readline().strip() != 'ready':
+            sys.exit('The server failed to start.')
+        cmd = ['ip', 'netns', 'exec', cli] + me + ['client'] + opts + [
+            '-r', str(args.rate), '-c', str(args.concurrency),
+            '-d', str(args.duration), '--churn', str(args.churn),
+            '-i', str(args.interval), '--log-interval',
+            str(args.log_interval)]
+        if args.record:
+            cmd = ['perf', 'record', '-e', 'probe:*', '-aR',
+                   '-k', 'CLOCK_MONOTONIC', '--'] + cmd
+        print(' '.join(cmd), flush=True)
+        subprocess.check_call(cmd)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Conntrack offload workload over network namespaces')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-n', '--name', default='ctw',
+                        help='prefix of the namespaces (default ctw)')
+
+    p = sub.add_parser('setup', parents=[common],
+                       help='create the namespaces and the act_ct rules')
+    p.add_argument('-z', '--zone', type=int, default=1,
+                   help='conntrack zone (default 1)')
+    p.set_defaults(func=setup)
+
+    p = sub.add_parser('teardown', parents=[common],
+                       help='remove the namespaces')
+    p.set_defaults(func=teardown)
+
+    traffic = argparse.ArgumentParser(add_help=False, parents=[common])
+    traffic.add_argument('-p', '--proto', choices=('tcp', 'udp'),
+                         default='tcp')
+    traffic.add_argument('--ports', type=int, default=8,
+                         help='server ports the connections are spread over')
+
+    for name, func, text in (('run', workload, 'run the workload'),
+                             ('client', client,
+                              'the client side of run, in its namespace'),
+                             ('server', server,
+                              'the server side of run, in its namespace')):
+        p = sub.add_parser(name, parents=[traffic], help=text)
+        p.set_defaults(func=func)
+        if name == 'server':
+            continue
+        p.add_argument('-r', '--rate', type=float, default=500.0,
+                       help='connections opened and closed per second, in '
+                            'the setup and teardown phases (default 500)')
+        p.add_argument('-c', '--concurrency', type=int, default=1000,
+                       help='connections open in the steady phase '
+                            '(default 1000)')
+        p.add_argument('-d', '--duration', type=float, default=30.0,
+                       help='steady phase length (s, default 30)')
+        p.add_argument('--churn', type=float, default=0.0,
+                       help='connections closed and opened again per second '
+                            'in the steady phase (default 0)')
+        p.add_argument('-i', '--interval', type=float, default=1.0,
+                       help='time between the pings of a connection (s)')
+        p.add_argument('--log-interval', type=float, default=0.1,
+                       help='time between ct-workload.dat lines (s)')
+        if name == 'run':
+            p.add_argument('-R', '--record', action='store_true',
+                           help='perf record the probes meanwhile')
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,25 @@
 #   events-del.png
 #   events-stats.png
 #   events-acc.png
+#   events-{add,del,stats}-pct.png
+#   events-backlog.png
+#
+# Latency percentiles (p50/p90/p99/p99.9/max) are printed for the whole capture
+# and plotted per time window, 1s by default, which can be changed with:
+#    # perf script -s perf-script.py [-b] <window in seconds> [request ttl in seconds]
+# Requests not executed within the ttl (60s by default) are dropped, and
+# perf-script.py reports how many requests were matched, unmatched (executed
+# without a request), overwritten by a new request, evicted or still pending.
+# With -b, the data is kept in a binary columnar file, events.col, and the text
+# .dat files are exported out of it when plotting.
+#
+# Each event has its own workqueue, whose backlog is the requests issued and
+# not executed yet. events-backlog.png has its depth over time, and the
+# arrival and service rates per window, requests and executions per second.
+# The peak and mean backlog, the service rate while the queue was busy and the
+# bursts, when the queue got 10 or more deep before draining, are printed
+# along with the latencies, see lib/backlog.py. The probe on
+# flow_offload_work_handler() also tells how many kworkers ran the items.
 #
 # Ideally, the test should have a clear connection setup phase, then stable, and then
 # the teardown. The graphs will get unreadable if the add/del sections are too wide.
@@ -36,22 +55,102 @@
 #    # perf record -e probe:* -aR -- sleep 300
 #    # <start the test>
 #    # <stop perf record when the test finishes>
+#    or, with the workload of ct-workload.py, over network namespaces and
+#    without a NIC:
+#    # ./ct-workload.py setup
+#    # ./ct-workload.py run -R [-p tcp|udp] [-r rate] [-c concurrency]
+#    # ./ct-workload.py teardown
+#    whose setup, steady and teardown phases are then marked in the graphs
 # 3. plot it and get stats
 #    # perf script -s perf-script.py
-#    # ./perf-plot.sh
+#    or, reading perf.data without perf:
+#    # ../lib/ctoffload.py -i perf.data
+#    or out of a perf script --ns output:
+#    # ../lib/ctoffload.py -t perf-script.txt
+#    or along with the outputs of the other tools, decoding perf.data once:
+#    # ../analyze.py
+#    # ./perf-plot.sh [-F] [title notes]
+#    -F plots all points, instead of a few thousand per curve
 # 4. check output at events-*.png
 #
 # Author: Marcelo Ricardo Leitner  2021
 # License: GPLv3
 
-kernel=$(perf script --header-only | sed -n 's/.*os release : //p')
-ncpu=$(perf script --header-only | sed -n 's/.*nrcpus avail : //p')
-cpumodel=$(perf script --header-only | sed -n 's/.*cpudesc : //p')
+mydir=$(dirname "$(readlink -f "$0")")
+
+full=
+if [ "$1" = "-F" ]; then
+	full=1
+	shift
+fi
+
+if [ -e events.col -a ! -e events.dat ]; then
+	"$mydir/../lib/columnar.py" --split events.col || exit 1
+fi
+
+# The header of the capture, as ../analyze.py wrote it, or out of perf.data
+if [ -f perf-header.env -a ! perf.data -nt perf-header.env ]; then
+	. ./perf-header.env
+else
+	header=$("$mydir/../lib/perfdata.py" --header-only 2> /dev/null ||
+		perf script --header-only)
+	kernel=$(sed -n 's/.*os release : //p' <<< "$header")
+	ncpu=$(sed -n 's/.*nrcpus avail : //p' <<< "$header")
+	cpumodel=$(sed -n 's/.*cpudesc : //p' <<< "$header")
+fi
 
 # Common title across the graphs
 title="${kernel//_/\\\\_} - $cpumodel - $ncpu CPUs${@:+\\n}${@//_/\\\\_}"
 
 
+#
+# Unless -F is given, curves are plotted out of <file>-lod.dat, reduced to a
+# few thousand points that keep the spikes. Everything else is computed out
+# of the full data.
+#
+lod()
+{
+	file=$1
+	columns=$2
+
+	if [ -z "$full" ]; then
+		"$mydir/../lib/downsample.py" -x 1 -y $columns $file.dat \
+			-o $file-lod.dat
+	fi
+}
+
+#
+# gnuplot commands marking the phases of ct-workload.py, if it ran, with $1
+# as the time origin. Its timestamps are CLOCK_MONOTONIC, as perf record -k
+# CLOCK_MONOTONIC gets, which ct-workload.py run -R does.
+#
+phase_marks()
+{
+	[ -f ct-workload-phases.dat ] || return 0
+	awk -v first=$1 '!/^#/ {
+		x = $2 - first
+		printf "set arrow from %f, graph 0 to %f, graph 1 nohead dt 3 lc rgb \"gray\"\n", x, x
+		printf "set label \"%s\" at %f, graph 0.97 font \",8\"\n", $1, x
+	}' ct-workload-phases.dat
+}
+
+plotfile()
+{
+	if [ -z "$full" ]; then
+		echo $1-lod.dat
+	else
+		echo $1.dat
+	fi
+}
+
+lod events 2-4
+lod events-req 2-4
+for event in add del stats; do
+	lod events-latency-$event 2
+done
+lod events-backlog 2-4
+
+
 #
 # Calls
 #
@@ -87,11 +186,12 @@ calls()
 	set y2tics
 	set xrange [0:$delta]
 	$left_subtitle
+	$(phase_marks $first_req)
 
 	plot \\
-	     '$file.dat' using (\$1-$first_req):$column title "$event exec" with lines, \\
-	     '$file-req.dat' using (\$1-$first_req):$column title "$event request" with lines, \\
-	     '$file-latency-$event.dat' using (\$1-$first_req):2 title "$event latency" axes x1y2 with lines
+	     '$(plotfile $file)' using (\$1-$first_req):$column title "$event exec" with lines, \\
+	     '$(plotfile $file-req)' using (\$1-$first_req):$column title "$event request" with lines, \\
+	     '$(plotfile $file-latency-$event)' using (\$1-$first_req):2 title "$event latency" axes x1y2 with lines
 	_EOF_
 
 	gnuplot $file-$event.plt
@@ -126,13 +226,89 @@ acc()
 	set ytics nomirror
 
 	plot \\
-	     [0:$delta] '$file.dat' using (\$1-$first_req):(\$2-\$3) title "$event exec" with lines, \\
-	     [0:$delta] '$file-req.dat' using (\$1-$first_req):(\$2-\$3) title "$event request" with lines
+	     [0:$delta] '$(plotfile $file)' using (\$1-$first_req):(\$2-\$3) title "$event exec" with lines, \\
+	     [0:$delta] '$(plotfile $file-req)' using (\$1-$first_req):(\$2-\$3) title "$event request" with lines
 	_EOF_
 
 	gnuplot $file-$event.plt
 }
 
+#
+# Latency percentiles per time window
+#
+percentiles()
+{
+	event=$1
+
+	file="events-latency-$event-pct"
+
+	if ! grep -qv '^#' $file.dat; then
+		return
+	fi
+	first=$(sed -n '2{s/	.*//;p;q}' $file.dat)
+
+	cat > events-$event-pct.plt <<-_EOF_
+	set terminal pngcairo size 1024,768 dashed
+	set output "events-$event-pct.png"
+	set title "Conntrack SW x HW offload control path performance\\n$event latency percentiles per window\\n$title"
+	set xlabel "Time (s)"
+	set ylabel "Offload latency (s)"
+	set logscale y
+	set key left
+
+	plot \\
+	     '$file.dat' using (\$1-$first):3 title "p50" with steps, \\
+	     '$file.dat' using (\$1-$first):4 title "p90" with steps, \\
+	     '$file.dat' using (\$1-$first):5 title "p99" with steps, \\
+	     '$file.dat' using (\$1-$first):6 title "p99.9" with steps, \\
+	     '$file.dat' using (\$1-$first):7 title "max" with steps
+	_EOF_
+
+	gnuplot events-$event-pct.plt
+}
+
+#
+# Workqueue backlog, and arrival x service rate per window
+#
+backlog()
+{
+	file="events-backlog"
+
+	if [ ! -f $file.dat ] || ! grep -qv '^#' $file.dat; then
+		return
+	fi
+	first=$(sed -n '2{s/	.*//;p;q}' $file.dat)
+
+	cat > $file.plt <<-_EOF_
+	set terminal pngcairo size 1024,1024 dashed
+	set output "$file.png"
+	set multiplot layout 2,1 title "Conntrack SW x HW offload control path performance\nWorkqueue backlog\n$title"
+	set xlabel "Time (s)"
+	set ylabel "Requests not executed yet"
+	set key left
+	$(phase_marks $first)
+
+	plot \
+	     '$(plotfile $file)' using (\$1-$first):2 title "add" with steps, \
+	     '$(plotfile $file)' using (\$1-$first):3 title "del" with steps, \
+	     '$(plotfile $file)' using (\$1-$first):4 title "stats" with steps
+
+	set ylabel "Rate per window (1/s)"
+
+	plot \
+	     'events-throughput.dat' using (\$1-$first):2 title "add requests" with steps lc 1, \
+	     'events-throughput.dat' using (\$1-$first):3 title "add executions" with steps lc 1 dt 2, \
+	     'events-throughput.dat' using (\$1-$first):5 title "del requests" with steps lc 2, \
+	     'events-throughput.dat' using (\$1-$first):6 title "del executions" with steps lc 2 dt 2, \
+	     'events-throughput.dat' using (\$1-$first):8 title "stats requests" with steps lc 3, \
+	     'events-throughput.dat' using (\$1-$first):9 title "stats executions" with steps lc 3 dt 2
+
+	unset multiplot
+	_EOF_
+
+	gnuplot $file.plt
+}
+
 _stats()
 {
 	echo
@@ -140,6 +316,8 @@ _stats()
 	cat events-latency-$1.dat | \
 		LC_ALL=C datamash -H -W mean 2 pstdev 2 min 2 max 2 | \
 		column -t
+	sed -n "1s/^#event	//p;/^$1	/s/^$1	//p" events-latency-pct.dat | \
+		column -t
 }
 
 stats()
@@ -150,6 +328,13 @@ stats()
 	_stats del
 	_stats stats
 
+	if [ -f events-workqueue.dat ]; then
+		echo
+		echo "Workqueues:"
+		sed '1s/^#//' events-workqueue.dat | column -t -s '	'
+		echo "Bursts: $(sed 1d events-bursts.dat | wc -l)"
+	fi
+
 	first_req=$(sed 1d $file-req.dat | cut -f 1,2 -d ' ' | sed '/	0$/d;/	.*/{s///;q}')
 	last_req=$(sed 1d $file-req.dat | cut -f 1,3 -d ' ' | uniq -u -s 14 | tail -n1 | sed 's/	.*//')
 	count_req=$(sed 1d $file-req.dat | cut -f 1,3 -d ' ' | uniq -u -s 14 | tail -n1 | sed 's/.*	//')
@@ -178,6 +363,10 @@ calls add 2
 calls del 3 
 calls stats 4 
 acc
+percentiles add
+percentiles del
+percentiles stats
+backlog
 
 stats
 
@@ -18,72 +18,39 @@ sys.path.append(os.environ['PERF_EXEC_PATH'] + \
 from perf_trace_context import *
 from Core import *
 
-# Each offload request
-# The inner hash has key = offload addr, value = [ timestamp1, timestamp2, .. ]
-requests = {'add': {},
-            'del': {},
-            'stats': {}
-            }
-events = []
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'lib'))
+from ctoffload import CTOffload
+
+# Matches offload requests with their executions, and writes the outputs as
+# it goes. Optional arguments, as in perf script -s perf-script.py -b 0.5 30:
+#   -b: write events.col, see lib/columnar.py, instead of the text files
+#   latency percentiles window (s), default 1
+#   how long a request may stay pending before being dropped (s), default 60
+args = sys.argv[1:]
+binary = '-b' in args
+if binary:
+    args.remove('-b')
+offloads = CTOffload(*[float(arg) for arg in args[:2]], binary=binary)
 
 
 def trace_begin():
     print("in trace_begin")
+    offloads.open()
 
 def trace_end():
     print("in trace_end")
-    #for (event, offload, ts_req, ts_exec) in events:
-    #    print("%s(%x, %s, %s, %s)" % (event, offload, ts_req, ts_exec, ts_exec - ts_req))
-
-    fp = open('events.dat', 'w')
-    hits = {'add': 0, 'del': 0, 'stats': 0}
-    fp.write('#exec tstamp\tadd\tdel\tstats\n')
-    for (event, offload, ts_req, ts_exec) in events:
-       hits[event] += 1
-       fp.write("%f\t%d\t%d\t%d\n" % (ts_exec, *hits.values()))
-    fp.close()
-
-    fp = open('events-latency-add.dat', 'w')
-    fp.write('#exec tstamp\tlatency\n')
-    fp2 = open('events-latency-del.dat', 'w')
-    fp2.write('#exec tstamp\tlatency\n')
-    fp3 = open('events-latency-stats.dat', 'w')
-    fp3.write('#exec tstamp\tlatency\n')
-    for (event, offload, ts_req, ts_exec) in events:
-        if event == 'add':
-            fp.write("%f\t%f\n" % (ts_exec, ts_exec - ts_req))
-        elif event == 'del':
-            fp2.write("%f\t%f\n" % (ts_exec, ts_exec - ts_req))
-        elif event == 'stats':
-            fp3.write("%f\t%f\n" % (ts_exec, ts_exec - ts_req))
-    fp.close()
-    fp2.close()
-    fp3.close()
-
-    events.sort(key=lambda x: x[2])
-    fp = open('events-req.dat', 'w')
-    hits = {'add': 0, 'del': 0, 'stats': 0}
-    fp.write('#req tstamp\tadd\tdel\tstats\n')
-    for (event, offload, ts_req, ts_exec) in events:
-       hits[event] += 1
-       fp.write("%f\t%d\t%d\t%d\n" % (ts_req, *hits.values()))
-    fp.close()
+    offloads.finish()
 
 
 def build_ns(sec, nsec):
     return sec + nsec / 1000000000.0
 
 def add_request(event, offload, sec, nsec):
-    requests[event][offload] = build_ns(sec, nsec)
+    offloads.request(event, offload, build_ns(sec, nsec))
 
-def add_event(event, offload, sec, nsec):
-    if not offload in requests[event].keys():
-        print("failed to match %s(%x)" % (event, offload))
-        return
-
-    ts = build_ns(sec, nsec)
-    events.append((event, offload, requests[event][offload], ts))
-    del requests[event][offload]
+def add_event(event, offload, sec, nsec, tid):
+    offloads.execute(event, offload, build_ns(sec, nsec), tid)
 
 
 def probe__nf_flow_offload_add_L6(event_name, context, common_cpu,
@@ -110,25 +77,25 @@ def probe__nf_flow_offload_stats_L11(event_name, context, common_cpu,
 def probe__flow_offload_work_handler(event_name, context, common_cpu,
     common_secs, common_nsecs, common_pid, common_comm,
     common_callchain, __probe_ip, perf_sample_dict):
+    offloads.backlog.handler(common_pid, build_ns(common_secs, common_nsecs))
 
-    return
 
 def probe__flow_offload_work_add(event_name, context, common_cpu,
     common_secs, common_nsecs, common_pid, common_comm,
     common_callchain, __probe_ip, offload, perf_sample_dict):
-    add_event('add', offload, common_secs, common_nsecs)
+    add_event('add', offload, common_secs, common_nsecs, common_pid)
 
 
 def probe__flow_offload_work_del(event_name, context, common_cpu,
     common_secs, common_nsecs, common_pid, common_comm,
     common_callchain, __probe_ip, offload, perf_sample_dict):
-    add_event('del', offload, common_secs, common_nsecs)
+    add_event('del', offload, common_secs, common_nsecs, common_pid)
 
 
 def probe__flow_offload_work_stats(event_name, context, common_cpu,
     common_secs, common_nsecs, common_pid, common_comm,
     common_callchain, __probe_ip, offload, perf_sample_dict):
-    add_event('stats', offload, common_secs, common_nsecs)
+    add_event('stats', offload, common_secs, common_nsecs, common_pid)
 
 
 def trace_unhandled(event_name, context, event_fields_dict, perf_sample_dict):
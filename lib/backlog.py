@@ -0,0 +1,244 @@
+#
+# Workqueue backlog of the conntrack offloads, for ct-monitor.
+#
+# Since 2ed37183abb7 ("netfilter: flowtable: separate replace, destroy and
+# stats to different workqueues"), add, del and stats requests each go to
+# their own workqueue. The depth of each one is the requests issued minus the
+# ones executed, whether they match a request or not, so it doesn't depend on
+# the request ttl. Executions of requests issued before the capture started
+# are not taken off the depth, which never goes below 0.
+#
+# Out of the depth over time:
+#   - the peak backlog, and the mean over time
+#   - the arrival and the service rate per window: requests and executions
+#     per second, with the peak depth in each window
+#   - the busy time, when the queue is not empty, and the service rate over
+#     it, which is what the queue can take, as opposed to what it was given
+#   - the bursts: each time the queue fills, its peak and how long it took to
+#     drain from there, if it got at least burst_min deep
+# flow_offload_work_handler() runs every work item, of any of the queues,
+# before it is told apart by the flow_offload_work_<event> probe on the same
+# kworker. The delay between both, and how many kworkers ran items, come out
+# of it.
+#
+# License: GPLv3
+#
+
+# Where things are in a burst
+BURST_START = 0
+BURST_PEAK = 1
+BURST_PEAK_TS = 2
+BURST_END = 3
+
+
+class Queue():
+    def __init__(self, name):
+        self.name = name
+        self.depth = 0
+        self.peak = 0
+        self.peak_ts = 0.0
+        self.requests = 0
+        self.executions = 0
+        # Executions that found the queue empty
+        self.untracked = 0
+        # Time with the queue not empty, and the integral of the depth
+        self.busy = 0.0
+        self.area = 0.0
+        self.since = None
+        self.burst = None
+        self.bursts = []
+        # Current window: requests, executions, peak depth
+        self.win = [0, 0, 0]
+
+    def advance(self, ts):
+        if self.since is not None and ts > self.since:
+            dt = ts - self.since
+            self.area += self.depth * dt
+            if self.depth:
+                self.busy += dt
+        self.since = ts
+
+    def change(self, ts, delta, burst_min):
+        self.advance(ts)
+        if delta > 0:
+            self.requests += 1
+            self.win[0] += 1
+            if not self.depth:
+                self.burst = [ts, 0, ts, None]
+        else:
+            self.executions += 1
+            self.win[1] += 1
+            if not self.depth:
+                self.untracked += 1
+                return False
+        self.depth += delta
+
+        if self.depth > self.win[2]:
+            self.win[2] = self.depth
+        if self.depth > self.peak:
+            self.peak = self.depth
+            self.peak_ts = ts
+        burst = self.burst
+        if self.depth > burst[BURST_PEAK]:
+            burst[BURST_PEAK] = self.depth
+            burst[BURST_PEAK_TS] = ts
+        if not self.depth:
+            burst[BURST_END] = ts
+            if burst[BURST_PEAK] >= burst_min:
+                self.bursts.append(burst)
+            self.burst = None
+        return True
+
+
+class Backlog():
+    def __init__(self, names, window=1.0, burst_min=10, table=None):
+        """table, if any, gets a (ts, depth of each queue) row each time a
+        depth changes."""
+        self.queues = [Queue(name) for name in names]
+        self.window = window
+        self.burst_min = burst_min
+        self.table = table
+        self.start = None
+        self.win_start = None
+        self.rows = []
+        # tid -> when flow_offload_work_handler() was called on it
+        self.running = { }
+        self.workers = set()
+        self.handled = 0
+        self.unknown = 0
+        self.dispatched = 0
+        self.dispatch_total = 0.0
+        self.dispatch_max = 0.0
+
+    def roll(self, ts):
+        """Closes the windows that end before ts."""
+        if self.start is None:
+            self.start = ts
+            self.win_start = ts - ts % self.window
+        while ts >= self.win_start + self.window:
+            self.rows.append((self.win_start,
+                              [list(q.win) for q in self.queues]))
+            for q in self.queues:
+                q.win = [0, 0, q.depth]
+            self.win_start += self.window
+
+    def request(self, i, ts):
+        self.roll(ts)
+        self.queues[i].change(ts, 1, self.burst_min)
+        self.write(ts)
+
+    def execute(self, i, ts, tid=None):
+        self.roll(ts)
+        if self.queues[i].change(ts, -1, self.burst_min):
+            self.write(ts)
+        started = self.running.pop(tid, None)
+        if started is not None:
+            delay = ts - started
+            self.dispatched += 1
+            self.dispatch_total += delay
+            if delay > self.dispatch_max:
+                self.dispatch_max = delay
+
+    def handler(self, tid, ts):
+        """flow_offload_work_handler() was called on a kworker."""
+        if tid in self.running:
+            # The previous item was none of the ones probed
+            self.unknown += 1
+        self.running[tid] = ts
+        self.workers.add(tid)
+        self.handled += 1
+
+    def write(self, ts):
+        if self.table is not None:
+            self.table.append(ts, *[q.depth for q in self.queues])
+
+    def finish(self):
+        if self.start is None:
+            return
+        end = max([q.since for q in self.queues if q.since is not None])
+        for q in self.queues:
+            q.advance(end)
+        self.roll(self.win_start + self.window)
+
+    def span(self):
+        if self.start is None:
+            return 0.0
+        return max([q.since or 0.0 for q in self.queues]) - self.start
+
+    def write_throughput(self, path):
+        """Per window: its start, and the arrival and service rates and the
+        peak depth of each queue."""
+        fp = open(path, 'w')
+        fp.write('#window start\t%s\n' % '\t'.join(
+            ['%s req/s\t%s exec/s\t%s peak' % (q.name, q.name, q.name)
+             for q in self.queues]))
+        for start, wins in self.rows:
+            fp.write('%f\t%s\n' % (start, '\t'.join(
+                ['%f\t%f\t%d' % (req / self.window, exe / self.window, peak)
+                 for req, exe, peak in wins])))
+        fp.close()
+
+    def write_bursts(self, path):
+        fp = open(path, 'w')
+        fp.write('#queue\tstart\tpeak time\tpeak\tend\tdrain time'
+                 '\tdrain rate\n')
+        for q in self.queues:
+            for b in q.bursts:
+                drain = b[BURST_END] - b[BURST_PEAK_TS]
+                fp.write('%s\t%f\t%f\t%d\t%f\t%f\t%f\n' %
+                         (q.name, b[BURST_START], b[BURST_PEAK_TS],
+                          b[BURST_PEAK], b[BURST_END], drain,
+                          b[BURST_PEAK] / drain if drain > 0 else 0.0))
+        fp.close()
+
+    def summary(self):
+        """Per queue: name, requests, executions, peak depth and when, mean
+        depth, busy time, arrival rate, service rate while busy, the
+        utilization that makes, the bursts and the longest drain."""
+        span = self.span()
+        rows = []
+        for q in self.queues:
+            arrival = q.requests / span if span else 0.0
+            service = q.executions / q.busy if q.busy else 0.0
+            drains = [b[BURST_END] - b[BURST_PEAK_TS] for b in q.bursts]
+            rows.append((q.name, q.requests, q.executions, q.peak,
+                         q.peak_ts, q.area / span if span else 0.0, q.busy,
+                         arrival, service,
+                         arrival / service if service else 0.0,
+                         len(q.bursts), max(drains) if drains else 0.0))
+        return rows
+
+    def write_summary(self, path):
+        fp = open(path, 'w')
+        fp.write('#queue\trequests\texecutions\tpeak\tpeak time\tmean depth'
+                 '\tbusy time\tarrival/s\tservice/s\tutilization\tbursts'
+                 '\tmax drain\n')
+        for row in self.summary():
+            fp.write('%s\t%d\t%d\t%d\t%f\t%f\t%f\t%f\t%f\t%f\t%d\t%f\n' % row)
+        fp.close()
+
+    def report(self):
+        lines = []
+        for q, (name, requests, executions, peak, peak_ts, mean, busy,
+                arrival, service, util, bursts, drain) in zip(self.queues,
+                                                              self.summary()):
+            if not requests and not executions:
+                continue
+            depth = q.depth
+            line = ('%s workqueue: peak backlog %d at %f, mean %.2f, '
+                    '%d left, %.1f req/s, %.1f exec/s while busy (%.1f%% '
+                    'utilization), %d bursts of %d or more' %
+                    (name, peak, peak_ts, mean, depth, arrival, service,
+                     util * 100, bursts, self.burst_min))
+            if bursts:
+                line += ', drained in %fs at most' % drain
+            lines.append(line)
+        if self.handled:
+            lines.append('flow_offload_work_handler: %d items on %d kworkers, '
+                         '%d of them not add, del nor stats, %.3f us mean '
+                         'and %.3f us max until the item was told apart' %
+                         (self.handled, len(self.workers), self.unknown,
+                          (self.dispatch_total / self.dispatched
+                           if self.dispatched else 0.0) * 1e6,
+                          self.dispatch_max * 1e6))
+        return lines
@@ -0,0 +1,400 @@
+#
+# Call rates, durations and stats dumps, for rate-monitor.
+#
+# Works on the events of the probe:* probes set up by
+# rate-monitor/perf-probes.sh, in a perfscript.Events, and writes the data
+# files that rate-monitor/perf-plot.sh plots. See rate-monitor/perf-analyze.py
+# for what each file has. The events are either parsed all at once out of
+# perf script output, or appended one by one by lib/pipeline.py.
+#
+# License: GPLv2
+#
+
+import sys
+
+import downsample
+import probeset
+from calltree import CallTree
+from intervals import Matcher, add_counters, report, split_probe, \
+    FRAME_FUNC, FRAME_ENTRY
+from perfscript import Events, header_vars
+from rates import Rates
+
+# Matching calls of more than this many events is split among processes
+PARALLEL_MIN_EVENTS = 1000000
+
+# Functions whose calls are looked at, besides the ones of the probe set
+FUNCS = ('fl_change', 'fl_delete', 'tc_new_tfilter', 'tc_ctl_tfilter',
+         'tc_dump_tfilter')
+
+
+def test_window(events, tc_new):
+    """Returns the first and last positions of the test, that is, from the
+    first tc_new call up to the last return from it, or None if there were
+    no calls."""
+    entry = events.find(tc_new)
+    ret = events.find(tc_new + '__return')
+    if entry is None or ret is None:
+        return None
+
+    first = events.event.index(entry)
+    last = len(events) - 1 - events.event[::-1].index(ret)
+    return first, last
+
+
+def _pair_shard(job):
+    # Matches the calls of one set of threads
+    tid, ts, event, kinds = job
+    pairs = { }
+
+    def matched(t, frame, ret, stack):
+        pairs[frame[FRAME_FUNC]].append((frame[FRAME_ENTRY], ret))
+
+    matcher = Matcher(matched)
+    for func, is_ret in kinds.values():
+        pairs[func] = []
+    for i in range(len(event)):
+        func, is_ret = kinds[event[i]]
+        if is_ret:
+            matcher.exit(tid[i], func, ts[i])
+        else:
+            matcher.entry(tid[i], func, ts[i])
+    matcher.finish()
+    return pairs, matcher.counters
+
+
+def pair_calls(events, first, last, funcs, jobs):
+    """Returns, for each function in funcs, the list of (entry ts, return ts)
+    of its calls within [first, last], sorted, and the matching counters."""
+    kinds = { }
+    for i, name in enumerate(events.names):
+        func, is_ret = split_probe(name)
+        if func in funcs:
+            kinds[i] = (func, is_ret)
+    event = events.event
+    idx = [i for i in range(first, last + 1) if event[i] in kinds]
+
+    if jobs < 2 or len(idx) < PARALLEL_MIN_EVENTS:
+        shards = [idx]
+    else:
+        shards = [[] for i in range(jobs)]
+        for i in idx:
+            shards[events.tid[i] % jobs].append(i)
+
+    work = []
+    for shard in shards:
+        sub = events.select(shard)
+        work.append((sub.tid, sub.ts, sub.event, kinds))
+
+    if len(work) == 1:
+        results = [_pair_shard(work[0])]
+    else:
+        from multiprocessing import Pool
+        with Pool(jobs) as pool:
+            results = pool.map(_pair_shard, work)
+
+    pairs = [[] for f in funcs]
+    counters = { }
+    for result, shard_counters in results:
+        for i, func in enumerate(funcs):
+            pairs[i].extend(result.get(func, []))
+        add_counters(counters, shard_counters)
+    for p in pairs:
+        p.sort()
+    return pairs, counters
+
+
+def write_pairs(fp, pairs):
+    fp.write(''.join(['%.9f %.9f\n' % p for p in pairs]))
+
+
+def plot_rows(x, ys, full=False, points=downsample.POINTS):
+    if full:
+        return range(len(x))
+    return downsample.reduce(x, ys, points)
+
+
+def write_plot(fp, columns, keep):
+    fmt = '\t'.join(['%.9f'] * len(columns)) + '\n'
+    fp.write(''.join([fmt % tuple([c[i] for c in columns]) for i in keep]))
+
+
+def write_durations(fp, pairs, start, full=False, points=downsample.POINTS):
+    """x is the call number, or the time since start if given."""
+    durations = [ret - entry for entry, ret in pairs]
+    cumulative = []
+    total = 0.0
+    for d in durations:
+        total += d
+        cumulative.append(total)
+    if start is None:
+        x = list(range(len(pairs)))
+    else:
+        x = [entry - start for entry, ret in pairs]
+    write_plot(fp, (x, durations, cumulative),
+               plot_rows(x, [durations], full, points))
+
+
+def pearson(x, y):
+    """Correlation coefficient of x and y, nan if either is constant."""
+    n = len(x)
+    if n < 2:
+        return float('nan')
+    mx = sum(x) / n
+    my = sum(y) / n
+    sxy = sum([(a - mx) * (b - my) for a, b in zip(x, y)])
+    sxx = sum([(a - mx) ** 2 for a in x])
+    syy = sum([(b - my) ** 2 for b in y])
+    if not sxx or not syy:
+        return float('nan')
+    return sxy / (sxx * syy) ** 0.5
+
+
+def linear_fit(x, y):
+    """Least squares slope and intercept of y = a * x + b."""
+    n = len(x)
+    if n < 2:
+        return float('nan'), float('nan')
+    mx = sum(x) / n
+    my = sum(y) / n
+    sxx = sum([(a - mx) ** 2 for a in x])
+    if not sxx:
+        return float('nan'), my
+    slope = sum([(a - mx) * (b - my) for a, b in zip(x, y)]) / sxx
+    return slope, my - slope * mx
+
+
+def dump_windows(inserts, deletes, dumps, start, end, window):
+    """Splits [start, end] in windows and returns, for each one, the time
+    since start, the rules in the table at its end, the insert rate, the dump
+    rate, the dump busy time per second and the average dump duration."""
+    n = max(int((end - start) / window) + 1, 1)
+    ins = [0] * n
+    dels = [0] * n
+    started = [0] * n
+    duration = [0.0] * n
+    busy = [0.0] * n
+
+    def slot(ts):
+        return min(max(int((ts - start) / window), 0), n - 1)
+
+    for ts in inserts:
+        ins[slot(ts)] += 1
+    for ts in deletes:
+        dels[slot(ts)] += 1
+    for entry, ret in dumps:
+        k = slot(entry)
+        started[k] += 1
+        duration[k] += ret - entry
+        # Dumps may span several windows
+        while k < n:
+            ws = start + k * window
+            overlap = min(ret, ws + window) - max(entry, ws)
+            if overlap <= 0:
+                break
+            busy[k] += overlap
+            k += 1
+
+    rows = []
+    rules = 0
+    for k in range(n):
+        rules += ins[k] - dels[k]
+        rows.append((k * window, rules, ins[k] / window, started[k] / window,
+                     busy[k] / window,
+                     duration[k] / started[k] if started[k] else 0.0))
+    return rows
+
+
+def dump_cost(rows, buckets):
+    """Groups the windows by table size and returns, for each group, the
+    average rules, the windows in it, the correlation of the insert rate
+    with the dump busy time and with the dump rate, the inserts/s lost per
+    dump/s and the insert rate without dumps."""
+    top = max([r[1] for r in rows]) if rows else 0
+    width = top / buckets or 1.0
+    groups = [[] for i in range(buckets)]
+    for r in rows:
+        groups[min(int(r[1] / width), buckets - 1)].append(r)
+
+    cost = []
+    for group in groups:
+        if not group:
+            continue
+        rules, rate, dumps, busy = [[r[i] for r in group] for i in range(1, 5)]
+        slope, intercept = linear_fit(dumps, rate)
+        cost.append((sum(rules) / len(group), len(group), pearson(busy, rate),
+                     pearson(dumps, rate), -slope, intercept))
+    return cost
+
+
+class Calls():
+    def __init__(self, events=None, jobs=1, full=False,
+                 points=downsample.POINTS, dump_window=0.1, size_buckets=10,
+                 probes=None, tree_window=1.0, rate_window=1.0,
+                 rate_ewma=5.0, stall_threshold=0.5):
+        self.events = Events() if events is None else events
+        self.probes = probeset.load() if probes is None else probes
+        self.driver = self.probes.driver
+        self.funcs = FUNCS + self.probes.funcs
+        self.tree_window = tree_window
+        self.rates = Rates(rate_window, rate_ewma, stall_threshold)
+        self.jobs = jobs
+        self.full = full
+        self.points = points
+        self.dump_window = dump_window
+        self.size_buckets = size_buckets
+        self.window = None
+        self.rows = []
+
+    def wants(self, name):
+        """For lib/pipeline.py: where the events called 'name' go."""
+        func, is_ret = split_probe(name)
+        if name.startswith('probe:') and func in self.funcs:
+            return self.events.append
+        return None
+
+    def analyze(self):
+        """Matches the calls, and returns False if there was no test."""
+        events = self.events
+        if events.find('tc_new_tfilter') is not None:
+            self.tc_new = 'tc_new_tfilter'
+        else:
+            self.tc_new = 'tc_ctl_tfilter'
+
+        self.window = test_window(events, self.tc_new)
+        if self.window is None:
+            return False
+        first, last = self.window
+
+        change = events.find('fl_change')
+        self.rate = [events.ts[i] for i in range(first, last + 1)
+                     if events.event[i] == change]
+        self.rate.sort()
+        delete = events.find('fl_delete')
+        self.deletes = [events.ts[i] for i in range(first, last + 1)
+                        if events.event[i] == delete]
+
+        funcs = ['fl_change', self.tc_new, self.driver, 'tc_dump_tfilter']
+        self.pairs, counters = pair_calls(events, first, last, funcs,
+                                          self.jobs)
+        for line in report(counters):
+            print(line, file=sys.stderr)
+        return True
+
+    def write_calls(self):
+        rate = self.rate
+        pairs = self.pairs
+        fp = open('fl_change-rate.dat', 'w')
+        fp.write(''.join(['%.9f\n' % ts for ts in rate]))
+        fp.close()
+
+        calls = list(range(len(rate)))
+        elapsed = [ts - rate[0] for ts in rate]
+        avg = [n / t if t else 0.0 for n, t in zip(calls, elapsed)]
+        fp = open('fl_change-rate-plot.dat', 'w')
+        write_plot(fp, (calls, elapsed, avg),
+                   plot_rows(calls, [elapsed, avg], self.full, self.points))
+        fp.close()
+
+        fp = open('fl_change-call_duration.dat', 'w')
+        write_pairs(fp, pairs[0])
+        fp.write('\n\n')
+        write_pairs(fp, pairs[1])
+        fp.write('\n\n')
+        write_pairs(fp, pairs[2])
+        fp.close()
+
+        fp = open('fl_change-call_duration-plot.dat', 'w')
+        for i in range(3):
+            if i:
+                fp.write('\n\n')
+            write_durations(fp, pairs[i], None, self.full, self.points)
+        fp.close()
+
+        self.write_rates()
+
+    def write_rates(self):
+        """Insert, delete and driver call rates per window, see
+        lib/rates.py."""
+        events = self.events
+        first, last = self.window
+        rates = self.rates
+        rates.add('insert', self.rate)
+        rates.add('delete', self.deletes)
+        rates.add('driver', [entry for entry, ret in self.pairs[2]])
+        rates.compute(events.ts[first], events.ts[last])
+        rates.write('fl_change-rates.dat')
+        rates.write_stalls('fl_change-stalls.dat')
+        for line in rates.report():
+            print(line, file=sys.stderr)
+
+    def write_dumps(self):
+        events = self.events
+        first, last = self.window
+        dumps = self.pairs[3]
+
+        fp = open('fl_change-stats.dat', 'w')
+        write_pairs(fp, dumps)
+        fp.close()
+
+        fp = open('fl_change-stats-plot.dat', 'w')
+        write_durations(fp, dumps, events.ts[first], self.full, self.points)
+        fp.close()
+
+        self.rows = []
+        if dumps:
+            self.rows = dump_windows(self.rate, self.deletes, dumps,
+                                     events.ts[first], events.ts[last],
+                                     self.dump_window)
+        fp = open('fl_change-dumps.dat', 'w')
+        fp.write('#time\trules\tinserts/s\tdumps/s\tdump busy\tavg dump\n')
+        fp.write(''.join(['%.9f\t%d\t%f\t%f\t%f\t%.9f\n' % r
+                          for r in self.rows]))
+        fp.close()
+
+        fp = open('fl_change-dumps-cost.dat', 'w')
+        fp.write('#rules\twindows\tr busy\tr dumps\tinserts/s per dump/s'
+                 '\tinserts/s without dumps\n')
+        fp.write(''.join(['%f\t%d\t%f\t%f\t%f\t%f\n' % c
+                          for c in dump_cost(self.rows, self.size_buckets)]))
+        fp.close()
+
+    def write_tree(self):
+        """Writes the call tree of the test, see lib/calltree.py."""
+        events = self.events
+        first, last = self.window
+        tree = CallTree(window=self.tree_window)
+        handlers = [tree.handler(name) for name in events.names]
+        tid, cpu, ts, event = events.tid, events.cpu, events.ts, events.event
+        names = events.names
+        for i in range(first, last + 1):
+            handle = handlers[event[i]]
+            if handle is not None:
+                handle(tid[i], cpu[i], ts[i], names[event[i]], None)
+        return tree.finish()
+
+    def summary(self):
+        """What perf-plot.sh needs, as (name, value)."""
+        events = self.events
+        first, last = self.window
+        window = events.event[first:last + 1]
+
+        def count(name):
+            i = events.find(name)
+            return window.count(i) if i is not None else 0
+
+        rows = self.rows
+        return [
+            ('tc_new', self.tc_new),
+            ('start_time', '%.9f' % events.ts[first]),
+            ('end_time', '%.9f' % events.ts[last]),
+            ('inserts', len(self.rate)),
+            ('deletes', count('fl_delete')),
+            ('driver', self.driver),
+            ('changes', count(self.driver)),
+            ('dumps', len(self.pairs[3])),
+            ('rate_window', '%g' % self.rates.window),
+            ('stalls', self.rates.stalls()),
+            ('dump_corr', '%.3f' % pearson([r[4] for r in rows],
+                                           [r[2] for r in rows])),
+        ] + header_vars(events.meta)
@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+#
+# Call tree of the probed functions, with inclusive and self time.
+#
+# Calls are nested per thread by lib/intervals.py, so each one is accounted
+# at its path from the outermost call still open on the thread, such as
+# tc_new_tfilter;fl_change;mlx5e_configure_flower;mlx5_cmd_exec. Its
+# inclusive time goes from the entry to the return, and its self time is
+# that minus the time spent in the probed calls made from it.
+#
+# Outputs, in the current directory:
+#   calltree.dat          per path: calls, inclusive and self time, the
+#                         longest call, in seconds, the self time per call
+#                         of the outermost function, that is, per rule for
+#                         tc_new_tfilter, in us, and the path
+#   calltree-windows.dat  ditto per time window, by return time: the start of
+#                         the window and the self time per outermost call of
+#                         each path, in us, one column per path
+#   calltree.folded       the self time of each path, in us, in the folded
+#                         stacks format of flamegraph.pl
+#
+# All the probe:* functions in the capture are nested, as set up by
+# rate-monitor/perf-probes.sh and its probe sets. Besides lib/calls.py, it
+# reads perf.data itself, or a 'perf script --ns' output:
+#   # calltree.py -i perf.data | -t <file|-> [-w window]
+#
+# License: GPLv3
+#
+
+import sys
+
+from intervals import Matcher, split_probe, FRAME_FUNC, FRAME_ENTRY, \
+    FRAME_CHILDREN
+from perfscript import parse_line
+
+# Where things are in a node
+N_CALLS = 0
+N_INCLUSIVE = 1
+N_SELF = 2
+N_MAX = 3
+
+
+class CallTree():
+    def __init__(self, funcs=None, window=1.0):
+        """funcs are the functions to nest, or None for all the probe:*
+        ones."""
+        self.funcs = funcs
+        self.window = window
+        self.matcher = Matcher(self.call_done)
+        # path -> [ calls, inclusive, self, max ]
+        self.nodes = { }
+        # window -> { path -> [ calls, self ] }
+        self.windows = { }
+        self.start = None
+
+    def handler(self, name):
+        """Returns what handles the events called 'name', as
+        handle(tid, cpu, ts, name, args), or None."""
+        func, is_ret = split_probe(name)
+        if not name.startswith('probe:') or \
+           (self.funcs is not None and func not in self.funcs):
+            return None
+        matcher = self.matcher
+        if is_ret:
+            def handle(tid, cpu, ts, name, args):
+                matcher.exit(tid, func, ts)
+        else:
+            def handle(tid, cpu, ts, name, args):
+                if self.start is None:
+                    self.start = ts
+                matcher.entry(tid, func, ts)
+        return handle
+
+    def call_done(self, tid, frame, ret, stack):
+        path = tuple([f[FRAME_FUNC] for f in stack]) + (frame[FRAME_FUNC],)
+        inclusive = ret - frame[FRAME_ENTRY]
+        own = inclusive - frame[FRAME_CHILDREN]
+        try:
+            node = self.nodes[path]
+        except KeyError:
+            node = self.nodes[path] = [0, 0.0, 0.0, 0.0]
+        node[N_CALLS] += 1
+        node[N_INCLUSIVE] += inclusive
+        node[N_SELF] += own
+        if inclusive > node[N_MAX]:
+            node[N_MAX] = inclusive
+
+        w = int((ret - self.start) / self.window)
+        try:
+            window = self.windows[w]
+        except KeyError:
+            window = self.windows[w] = { }
+        try:
+            node = window[path]
+        except KeyError:
+            node = window[path] = [0, 0.0]
+        node[0] += 1
+        node[1] += own
+
+    def feed(self, lines):
+        """Handles the events in perf script --ns output lines."""
+        self.feed_samples(filter(None, map(parse_line, lines)))
+
+    def feed_samples(self, samples):
+        handlers = { }
+        for sample in samples:
+            name = sample[3]
+            try:
+                handle = handlers[name]
+            except KeyError:
+                handle = handlers[name] = self.handler(name)
+            if handle is not None:
+                handle(*sample)
+
+    def paths(self):
+        """The paths seen, each one right after its caller."""
+        return sorted(self.nodes)
+
+    def per_root(self, path):
+        """Self time of path per call of its outermost function, in us."""
+        root = self.nodes.get(path[:1])
+        if not root:
+            return 0.0
+        return self.nodes[path][N_SELF] / root[N_CALLS] * 1e6
+
+    def report(self):
+        lines = ['%10s %12s %12s %12s  %s' %
+                 ('calls', 'inclusive', 'self', 'self/root', 'function')]
+        for path in self.paths():
+            node = self.nodes[path]
+            lines.append('%10d %12.6f %12.6f %10.3fus  %s%s' %
+                         (node[N_CALLS], node[N_INCLUSIVE], node[N_SELF],
+                          self.per_root(path), '  ' * (len(path) - 1),
+                          path[-1]))
+        return lines
+
+    def finish(self):
+        """Writes the outputs, and returns False if there were no calls."""
+        self.matcher.finish()
+        if not self.nodes:
+            return False
+        paths = self.paths()
+
+        fp = open('calltree.dat', 'w')
+        fp.write('#calls\tinclusive\tself\tmax\tself/root(us)\tpath\n')
+        for path in paths:
+            node = self.nodes[path]
+            fp.write('%d\t%.9f\t%.9f\t%.9f\t%.3f\t%s\n' %
+                     (node[N_CALLS], node[N_INCLUSIVE], node[N_SELF],
+                      node[N_MAX], self.per_root(path), ';'.join(path)))
+        fp.close()
+
+        # gnuplot takes the column titles out of the first line
+        fp = open('calltree-windows.dat', 'w')
+        fp.write('time\t%s\n' % '\t'.join([';'.join(p) for p in paths]))
+        for w in sorted(self.windows):
+            window = self.windows[w]
+            row = []
+            for path in paths:
+                node = window.get(path)
+                root = window.get(path[:1])
+                row.append(node[1] / root[0] * 1e6 if node and root else 0.0)
+            fp.write('%f\t%s\n' % (w * self.window,
+                                   '\t'.join(['%.3f' % v for v in row])))
+        fp.close()
+
+        fp = open('calltree.folded', 'w')
+        for path in paths:
+            us = int(round(self.nodes[path][N_SELF] * 1e6))
+            if us:
+                fp.write('%s %d\n' % (';'.join(path), us))
+        fp.close()
+        return True
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Call tree of the probed functions, with inclusive and '
+                    'self time')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-i', '--input',
+                        help='perf.data file to read')
+    source.add_argument('-t', '--text',
+                        help='perf script --ns output, - for stdin')
+    parser.add_argument('-w', '--window', type=float, default=1.0,
+                        help='time window, in seconds')
+    args = parser.parse_args()
+
+    tree = CallTree(window=args.window)
+    if args.input:
+        import eventcache
+        tree.feed_samples(eventcache.samples(args.input)[0])
+    else:
+        fp = sys.stdin if args.text == '-' else open(args.text)
+        tree.feed(fp)
+    found = tree.finish()
+    for line in tree.matcher.report():
+        print(line, file=sys.stderr)
+    if not found:
+        sys.exit('No probe:* calls found')
+    for line in tree.report():
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/python3
+#
+# Binary columnar data files, as an alternative to the text .dat files.
+#
+# A file holds one or more tables, like the blocks of a gnuplot data file.
+# Each table has fixed width columns, float64 ('d') or int64 ('q'), stored
+# one after the other, so that a reader can memory map the file and use the
+# columns as they are, without parsing anything:
+#   magic (8 bytes)
+#   column data, each column contiguous
+#   footer: json with the tables, columns, offsets and how to export them
+#   footer length (8 bytes, little endian), magic (8 bytes)
+#
+# The text .dat files can be exported out of it at any time, with:
+#   # columnar.py <file> [-t table] [-o output]
+#   # columnar.py <file> --split      (one <table>.dat file per table)
+#   # columnar.py <file> -l           (list the tables)
+#
+# License: GPLv3
+#
+
+import json
+import mmap
+import os
+import sys
+import tempfile
+from array import array
+
+MAGIC = b'PFCOL001'
+TYPES = ('d', 'q')
+
+# Rows kept in memory per spooled table, and formatted at once on export
+CHUNK = 65536
+
+
+class TableWriter():
+    """A table that gets rows as they come. Rows are spooled to temporary
+    files, one per column, until the Writer is closed."""
+
+    def __init__(self, writer, meta):
+        self.writer = writer
+        self.meta = meta
+        self.types = [c['type'] for c in meta['columns']]
+        self.buffers = [array(t) for t in self.types]
+        self.spools = [tempfile.TemporaryFile(dir=writer.dir)
+                       for t in self.types]
+        self.rows = 0
+
+    def append(self, *row):
+        for buf, value in zip(self.buffers, row):
+            buf.append(value)
+        self.rows += 1
+        if len(self.buffers[0]) >= CHUNK:
+            self.spill()
+
+    def extend(self, columns):
+        """Appends many rows at once, as one array per column."""
+        for buf, column in zip(self.buffers, columns):
+            buf.extend(column)
+        self.rows += len(columns[0])
+        if len(self.buffers[0]) >= CHUNK:
+            self.spill()
+
+    def spill(self):
+        for i, buf in enumerate(self.buffers):
+            buf.tofile(self.spools[i])
+            self.buffers[i] = array(self.types[i])
+
+    def copy_to(self, fp):
+        self.spill()
+        offsets = []
+        for spool in self.spools:
+            offsets.append(fp.tell())
+            spool.seek(0)
+            while True:
+                data = spool.read(CHUNK * 8)
+                if not data:
+                    break
+                fp.write(data)
+            spool.close()
+        return offsets
+
+
+class Writer():
+    def __init__(self, path):
+        self.path = path
+        self.dir = os.path.dirname(os.path.abspath(path))
+        self.fp = open(path, 'wb')
+        self.fp.write(MAGIC)
+        self.tables = []
+        self.spooled = []
+
+    def table_meta(self, name, columns, header, fmt, empty, end):
+        meta = {'name': name, 'rows': 0, 'header': header, 'format': fmt,
+                'empty': empty, 'end': end, 'columns': []}
+        for col, typecode in columns:
+            if typecode not in TYPES:
+                raise ValueError('invalid column type %s' % typecode)
+            meta['columns'].append({'name': col, 'type': typecode})
+        self.tables.append(meta)
+        return meta
+
+    def add(self, name, columns, header='', fmt=None, empty='', end=''):
+        """Writes a table out of arrays, columns being [ (name, array) ].
+        fmt is the row format for exporting it as text."""
+        meta = self.table_meta(name, [(col, a.typecode) for col, a in columns],
+                               header, fmt, empty, end)
+        meta['rows'] = len(columns[0][1]) if columns else 0
+        for c, (col, a) in zip(meta['columns'], columns):
+            if len(a) != meta['rows']:
+                raise ValueError('columns of %s differ in length' % name)
+            c['offset'] = self.fp.tell()
+            a.tofile(self.fp)
+
+    def table(self, name, columns, header='', fmt=None, empty='', end=''):
+        """Starts a table to be filled row by row, columns being
+        [ (name, type) ]."""
+        meta = self.table_meta(name, columns, header, fmt, empty, end)
+        table = TableWriter(self, meta)
+        self.spooled.append(table)
+        return table
+
+    def close(self):
+        for table in self.spooled:
+            table.meta['rows'] = table.rows
+            offsets = table.copy_to(self.fp)
+            for c, offset in zip(table.meta['columns'], offsets):
+                c['offset'] = offset
+        self.spooled = []
+
+        footer = json.dumps({'byteorder': sys.byteorder,
+                             'tables': self.tables}).encode()
+        self.fp.write(footer)
+        self.fp.write(len(footer).to_bytes(8, 'little'))
+        self.fp.write(MAGIC)
+        self.fp.close()
+
+
+class Table():
+    def __init__(self, meta, columns):
+        self.name = meta['name']
+        self.rows = meta['rows']
+        self.meta = meta
+        self.names = [c['name'] for c in meta['columns']]
+        self.columns = columns
+
+    def __getitem__(self, name):
+        return self.columns[self.names.index(name)]
+
+    def fmt(self):
+        if self.meta['format']:
+            return self.meta['format']
+        return '\t'.join(['%f' if c['type'] == 'd' else '%d'
+                          for c in self.meta['columns']]) + '\n'
+
+    def export(self, fp):
+        if self.meta['header']:
+            fp.write(self.meta['header'])
+        if not self.rows:
+            fp.write(self.meta['empty'])
+        fmt = self.fmt()
+        for i in range(0, self.rows, CHUNK):
+            rows = zip(*[c[i:i + CHUNK] for c in self.columns])
+            fp.write(''.join([fmt % row for row in rows]))
+        fp.write(self.meta['end'])
+
+
+def load(path):
+    """Maps a columnar file and returns its tables, with the columns as
+    memoryviews into the mapping."""
+    fp = open(path, 'rb')
+    size = os.fstat(fp.fileno()).st_size
+    if size < 24:
+        raise ValueError('%s: not a columnar file' % path)
+    mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    fp.close()
+    if mm[:8] != MAGIC or mm[-8:] != MAGIC:
+        raise ValueError('%s: not a columnar file' % path)
+
+    length = int.from_bytes(mm[-16:-8], 'little')
+    footer = json.loads(mm[size - 16 - length:size - 16])
+    swap = footer['byteorder'] != sys.byteorder
+    data = memoryview(mm)
+
+    tables = []
+    for meta in footer['tables']:
+        columns = []
+        for c in meta['columns']:
+            start = c['offset']
+            column = data[start:start + 8 * meta['rows']].cast(c['type'])
+            if swap:
+                column = array(c['type'], column)
+                column.byteswap()
+            columns.append(column)
+        tables.append(Table(meta, columns))
+    return tables
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Export a columnar data file as text')
+    parser.add_argument('file')
+    parser.add_argument('-t', '--table', action='append',
+                        help='only this table (name or index), may be repeated')
+    parser.add_argument('-o', '--output', default='-',
+                        help='output file, - for stdout')
+    parser.add_argument('-s', '--split', action='store_true',
+                        help='write each table to <table>.dat')
+    parser.add_argument('-l', '--list', action='store_true',
+                        help='list the tables')
+    args = parser.parse_args()
+
+    tables = load(args.file)
+    if args.table:
+        wanted = []
+        for t in args.table:
+            names = [table.name for table in tables]
+            wanted.append(tables[int(t)] if t.isdigit() and t not in names
+                          else tables[names.index(t)])
+        tables = wanted
+
+    if args.list:
+        for i, table in enumerate(tables):
+            print('%d\t%s\t%d rows\t%s' %
+                  (i, table.name, table.rows, ' '.join(table.names)))
+        return
+
+    if args.split:
+        for table in tables:
+            fp = open(table.name + '.dat', 'w')
+            table.export(fp)
+            fp.close()
+        return
+
+    fp = sys.stdout if args.output == '-' else open(args.output, 'w')
+    for table in tables:
+        table.export(fp)
+    fp.close()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except BrokenPipeError:
+        pass
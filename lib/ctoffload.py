@@ -0,0 +1,325 @@
+#!/usr/bin/python3
+#
+# Conntrack offload requests x executions, for ct-monitor.
+#
+# Each flowtable offload request (add, del, stats) is kept pending until the
+# workqueue executes it, and the outputs are written as executions come in,
+# so memory depends only on how many offloads are in flight:
+#   events.dat                    cumulative executions, by execution time
+#   events-req.dat                cumulative executions, by request time
+#   events-latency-<event>.dat    latency of each execution
+#   events-latency-<event>-pct.dat  latency percentiles per time window
+#   events-latency-pct.dat        latency percentiles for the whole capture
+#   events-backlog.dat            depth of each workqueue, as it changes
+#   events-throughput.dat         arrival and service rate, and peak depth,
+#                                 of each workqueue per time window
+#   events-bursts.dat             the bursts and how long they took to drain
+#   events-workqueue.dat          backlog and throughput of each workqueue
+# With binary=True, the first three and events-backlog.dat go to events.col
+# instead, one table per file, in the format of lib/columnar.py, and can be
+# exported from there. The workqueues are looked at by lib/backlog.py.
+#
+# Requests that don't get executed within 'ttl' seconds, or that don't fit in
+# 'max_pending' per event, are evicted, those of all the events each time
+# anything is executed. Executions come in time order, but not in request
+# order, so events-req.dat lines are held until no pending request is older
+# than them, which is never longer than 'ttl'.
+#
+# Besides the perf script handlers in ct-monitor/perf-script.py, it can read
+# perf.data itself, with lib/perfdata.py, or a 'perf script --ns' output, for
+# replaying captures and benchmarking:
+#   # ctoffload.py -i perf.data | -t <file|-> [-b] [-w window] [--ttl seconds]
+#                   [--burst depth]
+#
+# License: GPLv3
+#
+
+import heapq
+import sys
+from collections import OrderedDict
+
+import columnar
+from backlog import Backlog
+from histogram import WindowedHistogram, PERCENTILES
+from perfscript import parse_line
+
+EVENTS = ('add', 'del', 'stats')
+
+# probe name -> what it is, as set up by ct-monitor/perf-probes.sh
+PROBES = {
+    'nf_flow_offload_add_L6': ('request', 'add'),
+    'nf_flow_offload_del_L6': ('request', 'del'),
+    'nf_flow_offload_stats_L11': ('request', 'stats'),
+    'flow_offload_work_add': ('execute', 'add'),
+    'flow_offload_work_del': ('execute', 'del'),
+    'flow_offload_work_stats': ('execute', 'stats'),
+    'flow_offload_work_handler': ('handler', None),
+}
+
+# Counters kept per event
+COUNTERS = ('matched', 'unmatched', 'overwritten', 'evicted', 'pending')
+
+
+def pct_header():
+    return '\t'.join(['p%g' % p for p in PERCENTILES])
+
+
+class TextTable():
+    """Same interface as columnar.TableWriter, for the text files."""
+
+    def __init__(self, name, header, fmt):
+        self.fp = open(name + '.dat', 'w')
+        self.fp.write(header)
+        self.fmt = fmt
+
+    def append(self, *row):
+        self.fp.write(self.fmt % row)
+
+    def close(self):
+        self.fp.close()
+
+
+class CTOffload():
+    def __init__(self, window=1.0, ttl=60.0, max_pending=1 << 20, out=None,
+                 binary=False, burst_min=10):
+        self.binary = binary
+        self.window = window
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.out = out
+        self.pending = { }
+        self.latency = { }
+        self.counters = { }
+        self.exec_hits = [0] * len(EVENTS)
+        self.req_hits = [0] * len(EVENTS)
+        self.reorder = []
+        self.writer = None
+        self.tables = { }
+        self.files = { }
+        self.backlog = Backlog(EVENTS, window, burst_min)
+
+    def table(self, name, columns, fmt):
+        header = '#%s\n' % '\t'.join([col for col, t in columns])
+        if self.binary:
+            return self.writer.table(name, columns, header, fmt)
+        return TextTable(name, header, fmt)
+
+    def open(self):
+        if self.binary:
+            self.writer = columnar.Writer('events.col')
+        counts = [(event, 'q') for event in EVENTS]
+        self.tables['exec'] = self.table('events',
+            [('exec tstamp', 'd')] + counts, '%f\t%d\t%d\t%d\n')
+        self.tables['req'] = self.table('events-req',
+            [('req tstamp', 'd')] + counts, '%f\t%d\t%d\t%d\n')
+
+        for i, event in enumerate(EVENTS):
+            self.pending[event] = OrderedDict()
+            self.counters[event] = dict.fromkeys(COUNTERS, 0)
+
+            self.tables[event] = self.table('events-latency-' + event,
+                [('exec tstamp', 'd'), ('latency', 'd')], '%f\t%f\n')
+            fp = open('events-latency-%s-pct.dat' % event, 'w')
+            fp.write('#window start\tcount\t%s\tmax\n' % pct_header())
+            self.files[event + '-pct'] = fp
+            self.latency[event] = WindowedHistogram(self.window,
+                lambda start, hist, fp=fp: self.write_window(fp, start, hist))
+
+        self.tables['backlog'] = self.table('events-backlog',
+            [('tstamp', 'd')] + counts, '%f\t%d\t%d\t%d\n')
+        self.backlog.table = self.tables['backlog']
+
+    def write_window(self, fp, start, hist):
+        fp.write("%f\t%d\t%s\n" % (start, hist.count,
+                 '\t'.join(['%f' % v for v in
+                            hist.percentiles() + [hist.max / 1e9]])))
+
+    def expire(self, event, ts):
+        pending = self.pending[event]
+        counters = self.counters[event]
+        limit = ts - self.ttl
+        while pending:
+            offload, ts_req = next(iter(pending.items()))
+            if len(pending) <= self.max_pending and ts_req >= limit:
+                break
+            del pending[offload]
+            counters['evicted'] += 1
+
+    def request(self, event, offload, ts):
+        pending = self.pending[event]
+        if offload in pending:
+            # The first request is lost, it won't be matched
+            self.counters[event]['overwritten'] += 1
+            del pending[offload]
+        pending[offload] = ts
+        self.expire(event, ts)
+        self.backlog.request(EVENTS.index(event), ts)
+
+    def execute(self, event, offload, ts, tid=None):
+        self.backlog.execute(EVENTS.index(event), ts, tid)
+        pending = self.pending[event]
+        ts_req = pending.pop(offload, None)
+        if ts_req is None:
+            self.counters[event]['unmatched'] += 1
+            return
+        self.counters[event]['matched'] += 1
+
+        i = EVENTS.index(event)
+        hits = self.exec_hits
+        hits[i] += 1
+        self.tables['exec'].append(ts, *hits)
+        self.tables[event].append(ts, ts - ts_req)
+        self.latency[event].record(ts, ts - ts_req)
+
+        heapq.heappush(self.reorder, (ts_req, i))
+        # A stale request of another event would hold the flush back until
+        # that event sees traffic again, if ever
+        for other in EVENTS:
+            self.expire(other, ts)
+        self.flush_requests(self.oldest_pending())
+
+    def oldest_pending(self):
+        oldest = None
+        for pending in self.pending.values():
+            if pending:
+                ts_req = next(iter(pending.values()))
+                if oldest is None or ts_req < oldest:
+                    oldest = ts_req
+        return oldest
+
+    def flush_requests(self, until=None):
+        """Writes the executed requests older than 'until', or all of them."""
+        reorder = self.reorder
+        hits = self.req_hits
+        table = self.tables['req']
+        while reorder and (until is None or reorder[0][0] <= until):
+            ts_req, i = heapq.heappop(reorder)
+            hits[i] += 1
+            table.append(ts_req, *hits)
+
+    def finish(self):
+        self.flush_requests()
+
+        fp = open('events-latency-pct.dat', 'w')
+        fp.write('#event\tcount\tmean\tmin\t%s\tmax\n' % pct_header())
+        for event in EVENTS:
+            latency = self.latency[event]
+            latency.flush()
+            fp.write("%s\t%d\t%s\n" % (event, latency.all.count,
+                     '\t'.join(['%f' % v for v in latency.all.summary()[1:]])))
+            self.counters[event]['pending'] = len(self.pending[event])
+        fp.close()
+
+        self.backlog.finish()
+        self.backlog.write_throughput('events-throughput.dat')
+        self.backlog.write_bursts('events-bursts.dat')
+        self.backlog.write_summary('events-workqueue.dat')
+
+        for fp in self.files.values():
+            fp.close()
+        self.files = { }
+        if self.binary:
+            self.writer.close()
+        else:
+            for table in self.tables.values():
+                table.close()
+        self.tables = { }
+
+        for line in self.report():
+            print(line, file=self.out)
+
+    def handler(self, name):
+        """Returns what handles the events called 'name', as
+        handle(tid, cpu, ts, name, args), or None if they aren't offload
+        requests or executions."""
+        kind = PROBES.get(name.split(':', 1)[-1])
+        if kind is None:
+            return None
+        if kind[0] == 'handler':
+            work_handler = self.backlog.handler
+
+            def handle(tid, cpu, ts, name, args):
+                work_handler(tid, ts)
+            return handle
+        event = kind[1]
+        if kind[0] == 'request':
+            request = self.request
+
+            def handle(tid, cpu, ts, name, args):
+                i = args.find('offload=')
+                if i >= 0:
+                    request(event, int(args[i + 8:].split(None, 1)[0], 0), ts)
+            return handle
+        execute = self.execute
+
+        def handle(tid, cpu, ts, name, args):
+            i = args.find('offload=')
+            if i >= 0:
+                execute(event, int(args[i + 8:].split(None, 1)[0], 0), ts, tid)
+        return handle
+
+    def feed(self, lines):
+        """Handles the events in perf script --ns output lines."""
+        self.feed_samples(filter(None, map(parse_line, lines)))
+
+    def feed_samples(self, samples):
+        """Handles (tid, cpu, ts, name, args) samples."""
+        handlers = { }
+        for sample in samples:
+            name = sample[3]
+            try:
+                handle = handlers[name]
+            except KeyError:
+                handle = handlers[name] = self.handler(name)
+            if handle is not None:
+                handle(*sample)
+
+    def report(self):
+        lines = []
+        for event in EVENTS:
+            c = self.counters[event]
+            lines.append('%s: ' % event +
+                         ', '.join(['%d %s' % (c[name], name)
+                                    for name in COUNTERS]))
+        lines += self.backlog.report()
+        return lines
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Match conntrack offload requests out of a capture')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-i', '--input',
+                        help='perf.data file to read')
+    source.add_argument('-t', '--text',
+                        help='perf script --ns output, - for stdin')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='write events.col instead of the text files')
+    parser.add_argument('-w', '--window', type=float, default=1.0,
+                        help='latency percentiles and throughput window (s)')
+    parser.add_argument('--ttl', type=float, default=60.0,
+                        help='how long a request may stay pending (s)')
+    parser.add_argument('--burst', type=int, default=10,
+                        help='backlog that makes a burst (default 10)')
+    args = parser.parse_args()
+
+    if args.input:
+        import eventcache
+        samples, meta = eventcache.samples(args.input)
+    else:
+        fp = sys.stdin if args.text == '-' else open(args.text)
+
+    offloads = CTOffload(args.window, args.ttl, binary=args.binary,
+                         burst_min=args.burst)
+    offloads.open()
+    if args.input:
+        offloads.feed_samples(samples)
+    else:
+        offloads.feed(fp)
+    offloads.finish()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+#
+# Level of detail reduction of plot data.
+#
+# A 1024 pixels wide graph can't show millions of points, gnuplot just takes
+# long to draw them on top of each other. Series are reduced to a few
+# thousand points before plotting, in one of two ways:
+#   minmax: x is split in 'points' buckets, about one per pixel, and only the
+#           first, last, lowest and highest points of each bucket are kept, so
+#           spikes are never lost.
+#   lttb:   Largest Triangle Three Buckets, keeps 'points' points that best
+#           preserve the shape of the curve.
+# Rows are kept whole, so any other column, such as cumulative counts, stays
+# correct as long as it was computed before the reduction.
+#
+# It can also be used on gnuplot data files, block by block:
+#   # downsample.py [-n points] [-m minmax|lttb] [-x col] [-y cols] \
+#         <file> [-o output]
+# Columns are numbered from 1, and 0 is the row number within the block, as
+# in gnuplot.
+#
+# License: GPLv3
+#
+
+import sys
+
+POINTS = 1024
+METHODS = ('minmax', 'lttb')
+
+
+def minmax(x, y, points=POINTS):
+    """Returns the indices of the first, last, minimum and maximum y of each
+    x bucket."""
+    n = len(x)
+    if n <= 4 * points:
+        return list(range(n))
+
+    lo = min(x)
+    width = (max(x) - lo) / points or 1.0
+    # bucket -> [ first, last, min, max ]
+    buckets = { }
+    for i in range(n):
+        b = int((x[i] - lo) / width)
+        v = y[i]
+        try:
+            k = buckets[b]
+        except KeyError:
+            buckets[b] = [i, i, i, i]
+            continue
+        k[1] = i
+        if v < y[k[2]]:
+            k[2] = i
+        elif v > y[k[3]]:
+            k[3] = i
+
+    keep = set()
+    for k in buckets.values():
+        keep.update(k)
+    return sorted(keep)
+
+
+def lttb(x, y, points=POINTS):
+    n = len(x)
+    if n <= points or points < 3:
+        return list(range(n))
+
+    keep = [0]
+    every = (n - 2) / (points - 2)
+    a = 0
+    for i in range(points - 2):
+        # Average of the next bucket
+        start = int((i + 1) * every) + 1
+        end = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(x[start:end]) / (end - start)
+        avg_y = sum(y[start:end]) / (end - start)
+
+        # Point of this bucket making the largest triangle with the last
+        # kept point and that average
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax = x[a]
+        ay = y[a]
+        best = start
+        area = -1.0
+        for j in range(start, end):
+            s = abs((ax - avg_x) * (y[j] - ay) - (ax - x[j]) * (avg_y - ay))
+            if s > area:
+                area = s
+                best = j
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return keep
+
+
+def reduce(x, ys, points=POINTS, method='minmax'):
+    """Indices of the rows to keep so that each of the ys columns, plotted
+    against x, looks the same."""
+    func = minmax if method == 'minmax' else lttb
+    if len(ys) == 1:
+        return func(x, ys[0], points)
+    keep = set()
+    for y in ys:
+        keep.update(func(x, y, points))
+    return sorted(keep)
+
+
+def column_list(text):
+    """Parses '2,3' or '2-4' into [ 2, 3 ] or [ 2, 3, 4 ]."""
+    cols = []
+    for item in text.split(','):
+        if '-' in item:
+            a, b = [int(c) for c in item.split('-')]
+            cols.extend(range(a, b + 1))
+        else:
+            cols.append(int(item))
+    return cols
+
+
+def reduce_block(rows, out, xcol, ycols, points, method):
+    def column(c):
+        if c == 0:
+            return list(range(len(rows)))
+        return [float(r[1][c - 1]) for r in rows]
+
+    if rows:
+        try:
+            keep = reduce(column(xcol), [column(c) for c in ycols],
+                          points, method)
+        except (IndexError, ValueError):
+            # Not numbers, leave it alone
+            keep = range(len(rows))
+        out.write(''.join([rows[i][0] for i in keep]))
+
+
+def reduce_file(fp, out, xcol=1, ycols=(2,), points=POINTS, method='minmax'):
+    """Reduces each block of a gnuplot data file. Comments and the blank lines
+    between blocks are kept."""
+    rows = []
+    for line in fp:
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            reduce_block(rows, out, xcol, ycols, points, method)
+            rows = []
+            out.write(line)
+            continue
+        rows.append((line, fields))
+    reduce_block(rows, out, xcol, ycols, points, method)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Reduce the points of a gnuplot data file')
+    parser.add_argument('file', help='data file, - for stdin')
+    parser.add_argument('-o', '--output', default='-',
+                        help='output file, - for stdout')
+    parser.add_argument('-n', '--points', type=int, default=POINTS,
+                        help='buckets (minmax) or points (lttb) per block')
+    parser.add_argument('-m', '--method', default='minmax', choices=METHODS)
+    parser.add_argument('-x', type=int, default=1,
+                        help='x column, 0 for the row number')
+    parser.add_argument('-y', default='2',
+                        help='y columns, like 2,3 or 2-4')
+    args = parser.parse_args()
+
+    fp = sys.stdin if args.file == '-' else open(args.file)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    reduce_file(fp, out, args.x, column_list(args.y), args.points,
+                args.method)
+    out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/python3
+#
+# Cache of the decoded samples of a capture, next to it.
+#
+# Decoding a multi-GB perf.data, by lib/perfdata.py or, for what it can't
+# read, by perf script, takes minutes, and used to happen again on every
+# re-plot. The samples are decoded once and kept as columns in a
+# lib/columnar.py file, plus their args:
+#   perf.data.cache/<key>/events.col  tid, cpu, timestamp, event id and where
+#                                     the args of each sample end
+#   perf.data.cache/<key>/args        the args of all the samples, back to
+#                                     back
+#   perf.data.cache/<key>/info.json   the event names and the header
+# The key is a hash of the contents of perf.data and of the decoder code, so
+# that the cache is not used anymore when either changes, and is replaced by
+# the next decode. The hash of perf.data is remembered for as long as its
+# size, mtime and inode don't change, so a hit costs no read of it at all.
+#
+# Analyzers get the samples as perfdata.PerfData.samples() yields them,
+# cached or not, through samples() or events() here. To build the cache, or
+# drop it:
+#   # eventcache.py [-i perf.data] [--drop]
+# Removing the perf.data.cache directory is fine too.
+#
+# License: GPLv3
+#
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from array import array
+
+import columnar
+from perfdata import PerfData, PerfDataError
+from perfscript import Events, parse_line, parse_header
+
+# What the key depends on, besides the capture
+DECODERS = ('perfdata.py', 'perfscript.py', 'columnar.py', 'eventcache.py')
+
+# Bytes hashed at once, and args written at once
+READ_SIZE = 8 << 20
+CHUNK = 65536
+
+COLUMNS = (('tid', 'q'), ('cpu', 'q'), ('ts', 'd'), ('event', 'q'),
+           ('args', 'q'))
+
+
+def decoder_version():
+    """Hash of the code that decodes captures."""
+    h = hashlib.blake2b(digest_size=8)
+    mydir = os.path.dirname(os.path.realpath(__file__))
+    for name in DECODERS:
+        h.update(open(os.path.join(mydir, name), 'rb').read())
+    return h.hexdigest()
+
+
+def content_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    fp = open(path, 'rb')
+    while True:
+        data = fp.read(READ_SIZE)
+        if not data:
+            break
+        h.update(data)
+    fp.close()
+    return h.hexdigest()
+
+
+class Entry():
+    """The cache entry of a capture, whether it's there or not."""
+
+    def __init__(self, path):
+        self.dir = os.path.abspath(path) + '.cache'
+        os.makedirs(self.dir, exist_ok=True)
+
+        # The hash of the capture, if it's still the same file
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns, st.st_ino]
+        memo = os.path.join(self.dir, 'capture.json')
+        try:
+            saved = json.load(open(memo))
+        except (OSError, ValueError):
+            saved = { }
+        if saved.get('stat') == stamp:
+            digest = saved['hash']
+        else:
+            digest = content_hash(path)
+            fp = open(memo, 'w')
+            json.dump({'stat': stamp, 'hash': digest}, fp)
+            fp.close()
+
+        self.key = hashlib.blake2b((digest + decoder_version()).encode(),
+                                   digest_size=8).hexdigest()
+        self.path = os.path.join(self.dir, self.key)
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, 'info.json'))
+
+    def load(self):
+        """Maps the entry, and returns its events table, names and meta."""
+        info = json.load(open(os.path.join(self.path, 'info.json')))
+        table = columnar.load(os.path.join(self.path, 'events.col'))[0]
+        return table, info['names'], info['meta']
+
+    def args(self):
+        fp = open(os.path.join(self.path, 'args'), 'rb')
+        if not os.fstat(fp.fileno()).st_size:
+            fp.close()
+            return b''
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        fp.close()
+        return data
+
+    def samples(self):
+        """Yields the cached samples, as PerfData.samples() does."""
+        table, names, meta = self.load()
+        data = self.args()
+        start = 0
+        for tid, cpu, ts, event, end in zip(*table.columns):
+            yield (tid, cpu, ts, names[event],
+                   data[start:end].decode(errors='replace'))
+            start = end
+
+    def events(self, keep_args=False):
+        """Returns the cached samples as a perfscript.Events, right out of
+        the columns."""
+        table, names, meta = self.load()
+        events = Events(keep_args)
+        events.names = list(names)
+        events.ids = {name: i for i, name in enumerate(names)}
+        events.meta = meta
+        for name, typecode in (('tid', 'l'), ('cpu', 'l'), ('ts', 'd'),
+                               ('event', 'l')):
+            column = table[name]
+            a = array(typecode)
+            if a.itemsize == column.itemsize:
+                a.frombytes(memoryview(column).cast('B'))
+            else:
+                a = array(typecode, column)
+            setattr(events, name, a)
+        if keep_args:
+            data = self.args()
+            start = 0
+            for end in table['args']:
+                events.args.append(data[start:end].decode(errors='replace'))
+                start = end
+        return events
+
+    def store(self, samples, meta):
+        """Yields the samples, caching them meanwhile. The entry is only
+        there once all of them went through."""
+        tmp = tempfile.mkdtemp(prefix='.new-', dir=self.dir)
+        try:
+            writer = columnar.Writer(os.path.join(tmp, 'events.col'))
+            table = writer.table('events', COLUMNS)
+            fp = open(os.path.join(tmp, 'args'), 'wb')
+            ids = { }
+            names = []
+            columns = [array(t) for c, t in COLUMNS]
+            tid, cpu, ts, event, ends = [c.append for c in columns]
+            pending = []
+            pos = 0
+            for sample in samples:
+                try:
+                    event(ids[sample[3]])
+                except KeyError:
+                    ids[sample[3]] = len(names)
+                    names.append(sample[3])
+                    event(ids[sample[3]])
+                tid(sample[0])
+                cpu(sample[1])
+                ts(sample[2])
+                args = sample[4].encode()
+                pos += len(args)
+                ends(pos)
+                pending.append(args)
+                if len(pending) >= CHUNK:
+                    fp.write(b''.join(pending))
+                    pending = []
+                    table.extend(columns)
+                    columns = [array(t) for c, t in COLUMNS]
+                    tid, cpu, ts, event, ends = [c.append for c in columns]
+                yield sample
+            fp.write(b''.join(pending))
+            fp.close()
+            table.extend(columns)
+            writer.close()
+            fp = open(os.path.join(tmp, 'info.json'), 'w')
+            json.dump({'names': names, 'meta': meta}, fp)
+            fp.close()
+
+            # Whatever was there is for other contents or decoders
+            for name in os.listdir(self.dir):
+                if not name.startswith('.') and name != 'capture.json':
+                    shutil.rmtree(os.path.join(self.dir, name),
+                                  ignore_errors=True)
+            os.rename(tmp, self.path)
+        finally:
+            # Not all the samples were read, or storing them failed
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def perf_script(path):
+    """Returns (samples, meta) out of perf script, for the captures that
+    lib/perfdata.py can't read."""
+    proc = subprocess.Popen(['perf', 'script', '--ns', '--header',
+                             '-i', path],
+                            stdout=subprocess.PIPE, universal_newlines=True,
+                            errors='replace')
+    meta = { }
+
+    # The header comes first, so meta is complete before the first sample
+    first = None
+    for line in proc.stdout:
+        first = parse_line(line)
+        if first is not None:
+            break
+        header = parse_header(line)
+        if header is not None:
+            meta.setdefault(*header)
+
+    def samples():
+        if first is not None:
+            yield first
+        for line in proc.stdout:
+            sample = parse_line(line)
+            if sample is not None:
+                yield sample
+        if proc.wait():
+            raise PerfDataError('perf script -i %s failed' % path)
+    return samples(), meta
+
+
+def entry(path):
+    """The cache entry of the capture at path, or None if there can't be
+    one."""
+    try:
+        return Entry(path)
+    except OSError as err:
+        print('Not caching %s: %s' % (path, err), file=sys.stderr)
+        return None
+
+
+def samples(path, cache=True):
+    """Returns (samples, meta) for the capture at path: the cached samples
+    if any, or else the ones decoded by lib/perfdata.py, or by perf script,
+    caching them as they go."""
+    cached = entry(path) if cache else None
+    if cached is not None and cached.exists():
+        return cached.samples(), cached.load()[2]
+
+    try:
+        perf = PerfData(path)
+        decoded, meta = perf.samples(), dict(perf.meta)
+    except PerfDataError as err:
+        print('%s, using perf script' % err, file=sys.stderr)
+        decoded, meta = perf_script(path)
+    if cached is not None:
+        decoded = cached.store(decoded, meta)
+    return decoded, meta
+
+
+def events(path, keep_args=False, cache=True):
+    """Returns the samples of the capture at path as a perfscript.Events,
+    cached or not, as samples() does."""
+    cached = entry(path) if cache else None
+    if cached is not None and cached.exists():
+        return cached.events(keep_args)
+    if cached is None:
+        # Nothing to store, so the args can be left out if not kept
+        try:
+            return PerfData(path).read(keep_args)
+        except PerfDataError:
+            pass
+
+    decoded, meta = samples(path, False)
+    if cached is not None:
+        decoded = cached.store(decoded, meta)
+    events = Events(keep_args)
+    events.meta = meta
+    append = events.append
+    for sample in decoded:
+        append(*sample)
+    return events
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Cache the decoded samples of a capture')
+    parser.add_argument('-i', '--input', default='perf.data',
+                        help='perf.data file to read')
+    parser.add_argument('--drop', action='store_true',
+                        help='remove the cache instead')
+    args = parser.parse_args()
+
+    if args.drop:
+        shutil.rmtree(os.path.abspath(args.input) + '.cache',
+                      ignore_errors=True)
+        return
+    cached = entry(args.input)
+    if cached is None:
+        sys.exit(1)
+    if not cached.exists():
+        decoded, meta = samples(args.input)
+        for sample in decoded:
+            pass
+    table, names, meta = cached.load()
+    print('%s: %d samples, %d events' % (cached.path, table.rows,
+                                         len(names)))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except PerfDataError as err:
+        sys.exit(str(err))
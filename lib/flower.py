@@ -0,0 +1,563 @@
+#
+# fl_change() and fl_delete() phases, out of the flower:* probes set up by
+# rule-install-rate.py, written as gnuplot data and scripts:
+#   fl_change.dat, fl_replace.dat, fl_delete.dat   calls over time, and the
+#       accumulated time of the sw part, of the hw part and of the whole
+#       call, for inserts, replaces and deletes
+#   fl_change-workers.dat   calls and rate per thread
+#   fl_churn.dat            completed calls per second, if there were
+#                           replaces or deletes
+#   fl_rates.dat            insert, replace and delete rates per
+#                           rate_window, and their EWMA, see lib/rates.py
+#   fl_stalls.dat           the windows where any of those rates dropped
+#                           below stall_threshold times its median
+#   fl_change-split.dat     mean time per call of the sw part, of the hw
+#                           part and of the rest of the call, and of the sw
+#                           part over the first and the last SPLIT_SHARE of
+#                           the calls, which tells whether it stays constant
+#                           as the table grows
+# Probe.add_point() gets the events, from the perf script handlers of
+# rule-install-rate.py or from lib/pipeline.py, and Probe.save() writes it
+# all.
+#
+# License: GPLv3
+#
+
+from array import array
+
+from intervals import Matcher, FRAME_FUNC, FRAME_ENTRY, FRAME_MARKS
+import columnar
+import downsample
+from rates import Rates
+
+# Code line probes inside fl_change(), in the order they are hit, and then
+# the fl_hw_destroy_filter() call inside fl_delete(). 'replace' is the fold
+# probe again, when it fetched a filter being replaced.
+MARKS = ('sw', 'hw', 'fold', 'hw_done', 'replace')
+
+# Where the timestamps are in a Matcher frame
+CHANGE_ENTRY = FRAME_ENTRY
+CHANGE_SW = FRAME_MARKS
+CHANGE_HW = FRAME_MARKS + 1
+CHANGE_FOLD = FRAME_MARKS + 2
+DELETE_HW_DONE = FRAME_MARKS + 3
+CHANGE_REPLACE = FRAME_MARKS + 4
+
+# probe name prefix -> what it is
+PROBE_KINDS = (
+    ('flower__fl_change_entry', 'entry'),
+    ('flower__fl_change_sw', 'sw'),
+    ('flower__fl_change_hw', 'hw'),
+    ('flower__fl_change_fold', 'fold'),
+    ('flower__fl_change_ret', 'ret'),
+    ('flower__fl_delete_entry', 'del_entry'),
+    ('flower__fl_delete_ret', 'del_ret'),
+    ('flower__fl_hw_destroy_entry', 'destroy'),
+    ('flower__fl_hw_destroy_ret', 'destroy_ret'),
+)
+
+# Kinds of calls, and the file each one is written to
+OPS = (
+    ('insert', 'fl_change'),
+    ('replace', 'fl_replace'),
+    ('delete', 'fl_delete'),
+)
+
+# How many points are formatted at once by Series.write()
+WRITE_CHUNK = 65536
+
+# Share of the calls, first and last ones, whose sw part fl_change-split.dat
+# compares
+SPLIT_SHARE = 0.1
+
+# Whether only the call rate is plotted, out of the fl_change() entries
+simple = False
+
+# Whether outputs are written as binary columnar files, see lib/columnar.py
+binary = False
+
+# Whether all points are plotted, instead of fl_change-lod.dat, the data
+# reduced to a few thousand points per curve by lib/downsample.py
+full = False
+
+# Window of the call rates, time constant of their EWMA, in seconds, and the
+# fraction of the median rate below which a window is a stall
+rate_window = 1.0
+rate_ewma = 5.0
+stall_threshold = 0.5
+
+# fl_rates.dat columns of each kind of call: calls so far, rate and EWMA
+RATE_COLUMNS = dict([(op, (2 + 3 * i, 3 + 3 * i, 4 + 3 * i))
+                     for i, (op, name) in enumerate(OPS)])
+
+
+def data_source(name):
+    """How gnuplot gets to the data of 'name': the .dat file, or its text
+    exported on the fly out of the binary one."""
+    if not binary:
+        return "'%s.dat'" % name
+    return "'< %s %s.col'" % (columnar.__file__, name)
+
+
+def plot_source(name):
+    if full:
+        return data_source(name)
+    return "'%s-lod.dat'" % name
+
+
+class Series():
+    """A gnuplot data block, stored as two growable float64 columns."""
+
+    def __init__(self):
+        self.x = array('d')
+        self.y = array('d')
+
+    def __len__(self):
+        return len(self.x)
+
+    def append(self, x, y):
+        self.x.append(x)
+        self.y.append(y)
+
+    def select(self, indices):
+        series = Series()
+        series.x = array('d', [self.x[i] for i in indices])
+        series.y = array('d', [self.y[i] for i in indices])
+        return series
+
+    def write(self, fp):
+        if not len(self.x):
+            # So gnuplot sees this block.
+            fp.write('0 0\n')
+            return
+
+        for i in range(0, len(self.x), WRITE_CHUNK):
+            x = self.x[i:i + WRITE_CHUNK]
+            y = self.y[i:i + WRITE_CHUNK]
+            fp.write(''.join(['%f %f\n' % point for point in zip(x, y)]))
+
+
+class Phases():
+    """Calls of one kind (insert, replace or delete), in the 4 blocks of
+    <name>.dat: calls over time, and the accumulated time of the sw part, of
+    the hw part and of the whole call."""
+
+    def __init__(self, op, name):
+        self.op = op
+        self.name = name
+        self.xy = [ Series(), Series(), Series(), Series() ]
+        self.last_entry = 0.0
+
+    def __len__(self):
+        return len(self.xy[0])
+
+    def write_gnuplot_cfg_simple(self, description):
+        fp = open('%s.plt' % self.name, 'w')
+        fp.write("""
+        set terminal pngcairo size 1024,768 dashed
+        set output "{2}.png"
+        set title "Flower rule install performance\\nTime consumed and install rate"
+        set xlabel "Datapath flows"
+        set ylabel "Time (s)"
+        set y2label "Insert rate (flows/s)"
+        set ytics nomirror
+        set y2tics
+
+        plot \
+             {1} index 0 using 1:2 title "Time" with lines, \
+             {1} index 0 every ::1 using 1:($1/$2) \
+                title "{0} acc insert rate" axes x1y2 with lines, \
+             'fl_rates.dat' using {3}:{4} \
+                title "{0} insert rate per {6:g}s" axes x1y2 with steps, \
+             'fl_rates.dat' using {3}:{5} \
+                title "{0} insert rate EWMA" axes x1y2 with lines
+        """.format(description, plot_source(self.name), self.name,
+                   *RATE_COLUMNS['insert'], rate_window))
+        fp.close()
+
+    def write_gnuplot_cfg_complete(self, description):
+        fp = open('%s.plt' % self.name, 'w')
+        fp.write("""
+        set terminal pngcairo size 1024,768 dashed
+        set output "{2}.png"
+        set title "Flower rule {3} performance\\nTime consumed per rule {3} and {3} rate"
+        set xlabel "Time (s)"
+        set ylabel "Datapath flows"
+        set y2label "{4} rate"
+        set ytics nomirror
+        set y2tics
+
+        plot \
+             {1} index 0 using 1:2 title "{0} cumulative" with lines, \
+             {1} index 1 using 1:2 title "{0} sw part" with lines, \
+             {1} index 2 using 1:2 title "{0} hw part" with lines, \
+             {1} index 3 using 1:2 title "{0} just flower" with lines, \
+             {1} index 0 every ::1 using 1:($2/$1) \
+                title "{0} acc {5} rate" axes x1y2 with lines, \
+             'fl_rates.dat' using 1:{7} \
+                title "{0} {5} rate per {6:g}s" axes x1y2 with steps, \
+             'fl_rates.dat' using 1:{8} \
+                title "{0} {5} rate EWMA" axes x1y2 with lines
+        """.format(description, plot_source(self.name), self.name,
+                   'install' if self.op == 'insert' else self.op,
+                   self.op.capitalize(), self.op, rate_window,
+                   *RATE_COLUMNS[self.op][1:]))
+        fp.close()
+
+    def write_gnuplot_cfg(self, description):
+        if simple:
+            self.write_gnuplot_cfg_simple(description)
+        else:
+            self.write_gnuplot_cfg_complete(description)
+
+    def sort_calls(self):
+        """With several threads, calls complete out of order, so the calls
+        over time are put back in entry order. They are numbered 1 to n
+        already."""
+        calls = self.xy[0]
+        calls.x = array('d', sorted(calls.x))
+
+    def add_delta(self, series, delta):
+        # x is the accumulated time, y the amount of points so far
+        if len(series):
+            series.append(delta + series.x[-1], len(series) + 1)
+        else:
+            series.append(delta, 1)
+
+    def split(self):
+        """Returns the calls, and the mean time per call, in seconds, of the
+        sw part, of the hw part, of the rest of the call, of the whole call,
+        and of the sw part over the first and the last SPLIT_SHARE of the
+        calls."""
+        sw, hw, whole = [self.xy[i].x for i in (1, 2, 3)]
+        calls = len(whole)
+        if not calls:
+            return (0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        total_sw = sw[-1] if len(sw) else 0.0
+        total_hw = hw[-1] if len(hw) else 0.0
+        share = max(int(len(sw) * SPLIT_SHARE), 1)
+        first = last = 0.0
+        if len(sw) > share:
+            first = sw[share - 1] / share
+            last = (sw[-1] - sw[-share - 1]) / share
+        return (calls, total_sw / calls, total_hw / calls,
+                (whole[-1] - total_sw - total_hw) / calls, whole[-1] / calls,
+                first, last)
+
+    def save(self):
+        if binary:
+            self.save_binary()
+        else:
+            fp = open('%s.dat' % self.name, 'w')
+            for series in self.xy:
+                series.write(fp)
+                fp.write('\n\n')
+            fp.close()
+        if not full:
+            self.save_lod()
+
+    def save_lod(self):
+        fp = open('%s-lod.dat' % self.name, 'w')
+        for series in self.xy:
+            keep = downsample.reduce(series.x, [series.y])
+            series.select(keep).write(fp)
+            fp.write('\n\n')
+        fp.close()
+
+    def save_binary(self):
+        # Same blocks as the .dat file, which can be exported out of it.
+        out = columnar.Writer('%s.col' % self.name)
+        for i, series in enumerate(self.xy):
+            out.add('%s-%d' % (self.name, i), [('x', series.x), ('y', series.y)],
+                    fmt='%f %f\n', empty='0 0\n', end='\n\n')
+        out.close()
+
+
+class Probe():
+    def __init__(self):
+        self.description = "tc flower"
+        self.first_ts = 0.0
+        self.phases = { }
+        for op, name in OPS:
+            self.phases[op] = Phases(op, name)
+        # Inserts, as before replaces and deletes were tracked
+        self.xy = self.phases['insert'].xy
+        self.matcher = Matcher(self.finish_point, MARKS)
+        self.kinds = { }
+        # tid -> [ fl_change calls, first entry, last entry or return ]
+        self.workers = { }
+        # second since the first call -> [ inserts, replaces, deletes ]
+        self.churn = { }
+
+    def probe_kind(self, probe):
+        # Resolve each probe name only once, there are just a handful of them.
+        try:
+            return self.kinds[probe]
+        except KeyError:
+            pass
+
+        kind = None
+        for wanted, k in PROBE_KINDS:
+            if probe.startswith(wanted):
+                kind = k
+                break
+        self.kinds[probe] = kind
+        return kind
+
+    def add_point(self, ts, probe, tid, fold=None):
+        """fold is the value fetched by the fold probe, if it was: the filter
+        being replaced, or 0 on inserts."""
+        kind = self.probe_kind(probe)
+        if kind is None:
+            return
+
+        if self.first_ts == 0.0 and kind in ('entry', 'del_entry'):
+            self.first_ts = ts
+
+        if kind == 'entry':
+            self.add_worker_call(tid, ts)
+            if simple:
+                self.finish_point_simple(ts)
+            else:
+                self.matcher.entry(tid, 'fl_change', ts)
+        elif simple:
+            return
+        elif kind == 'ret':
+            self.matcher.exit(tid, 'fl_change', ts)
+        elif kind == 'del_entry':
+            self.matcher.entry(tid, 'fl_delete', ts)
+        elif kind == 'del_ret':
+            self.matcher.exit(tid, 'fl_delete', ts)
+        elif kind == 'destroy':
+            # Only accounted within fl_delete(), replaces destroy the old
+            # filter after the fold probe.
+            self.matcher.mark(tid, 'fl_delete', 'hw', ts)
+        elif kind == 'destroy_ret':
+            self.matcher.mark(tid, 'fl_delete', 'hw_done', ts)
+        else:
+            if self.matcher.mark(tid, 'fl_change', kind, ts) and \
+               kind == 'fold' and fold:
+                self.matcher.mark(tid, 'fl_change', 'replace', ts)
+
+    def add_worker_call(self, tid, ts):
+        try:
+            worker = self.workers[tid]
+        except KeyError:
+            worker = self.workers[tid] = [0, ts, ts]
+        worker[0] += 1
+        worker[2] = ts
+
+    def finish_point_simple(self, ts):
+#             'fl_change.dat' index 0 using 1:2 title "Time" with lines, \
+#             'fl_change.dat' index 0 every ::1 using 1:($1/$2) \
+
+        # Populate the first table
+        count = len(self.xy[0]) + 1
+        delta = ts - self.first_ts
+        self.xy[0].append(count, delta)
+
+
+    def add_churn(self, op, ts):
+        second = int(ts - self.first_ts)
+        try:
+            counts = self.churn[second]
+        except KeyError:
+            counts = self.churn[second] = [0, 0, 0]
+        counts[[o for o, name in OPS].index(op)] += 1
+
+    def finish_point_complete(self, frame, ret, op='insert'):
+#             'fl_change.dat' index 0 using 1:2 title "{0} cumulative" with lines, \
+#             'fl_change.dat' index 1 using 1:2 title "{0} sw part" with lines, \
+#             'fl_change.dat' index 2 using 1:2 title "{0} hw part" with lines, \
+#             'fl_change.dat' index 3 using 1:2 title "{0} just flower" with lines, \
+        entry = frame[CHANGE_ENTRY]
+        sw = frame[CHANGE_SW]
+        hw = frame[CHANGE_HW]
+        fold = frame[CHANGE_FOLD]
+        phases = self.phases[op]
+
+        last_entry = phases.last_entry
+        if entry > last_entry:
+            phases.last_entry = entry
+
+        # Sanity check. The call is matched per thread, so rescheduling is
+        # fine, but the code line probes may still have been missed.
+        if not sw or not fold:
+            print('Skipping point: missing data')
+            return
+
+        if entry > sw or sw > fold or fold > ret:
+            print('Skipping point: invalid stamp')
+            return
+
+        # Populate the first table
+        # With several threads inserting, calls complete out of order, so the
+        # deltas are only reported and the time is taken since the first call.
+        if last_entry:
+            delta = entry - last_entry
+            if delta > 0.01:
+                print(delta, entry, last_entry, self.first_ts)
+        else:
+            delta = entry - self.first_ts
+            if delta > 0.01:
+                print(delta, entry, self.first_ts)
+        phases.xy[0].append(entry - self.first_ts, len(phases.xy[0]) + 1)
+        self.add_churn(op, ret)
+
+        # Populate the second table
+        if hw:
+            delta = hw - sw
+            if delta < 0:
+                print("Warning: negative point: %f", delta)
+        else:
+            # skip_hw was used and we have to use the next point instead
+            delta = fold - sw
+        phases.add_delta(phases.xy[1], delta)
+
+        # Populate the third table
+        if hw:
+            delta = fold - hw
+            if delta < 0:
+                print("Warning2: negative point: %f", delta)
+            phases.add_delta(phases.xy[2], delta)
+
+        # Populate the fourth table
+        delta = ret - entry
+        if delta < 0:
+            print("Warning3: negative point: %f", delta)
+        phases.add_delta(phases.xy[3], delta)
+
+    def finish_point_delete(self, frame, ret):
+        # fl_delete(): removal from the sw tables up to fl_hw_destroy_filter(),
+        # which is the hw part, and then the whole call.
+        entry = frame[FRAME_ENTRY]
+        hw = frame[CHANGE_HW]
+        hw_done = frame[DELETE_HW_DONE]
+        phases = self.phases['delete']
+
+        if hw and (not hw_done or entry > hw or hw > hw_done or hw_done > ret):
+            print('Skipping delete point: invalid stamp')
+            return
+
+        phases.xy[0].append(entry - self.first_ts, len(phases.xy[0]) + 1)
+        self.add_churn('delete', ret)
+        phases.add_delta(phases.xy[1], (hw or ret) - entry)
+        if hw:
+            phases.add_delta(phases.xy[2], hw_done - hw)
+        phases.add_delta(phases.xy[3], ret - entry)
+
+    def finish_point(self, tid, frame, ret, stack):
+        if frame[FRAME_FUNC] == 'fl_delete':
+            self.finish_point_delete(frame, ret)
+            return
+
+        self.workers[tid][2] = ret
+        self.finish_point_complete(frame, ret,
+                                   'replace' if frame[CHANGE_REPLACE]
+                                   else 'insert')
+
+    def finish(self):
+        self.matcher.finish()
+        for line in self.matcher.report():
+            print(line)
+
+    def save(self):
+        """Writes the outputs, and returns the gnuplot scripts to run."""
+        plots = []
+        for op, name in OPS:
+            phases = self.phases[op]
+            # fl_change is always there, the others only if they happened
+            if op == 'insert' or len(phases):
+                if not simple:
+                    phases.sort_calls()
+                phases.write_gnuplot_cfg(self.description)
+                phases.save()
+                plots.append(name + '.plt')
+
+        if len(self.phases['replace']) or len(self.phases['delete']):
+            self.save_churn()
+            plots.append('fl_churn.plt')
+
+        self.save_rates()
+        self.save_workers()
+        if not simple:
+            self.save_split()
+        return plots
+
+    def save_split(self):
+        fp = open('fl_change-split.dat', 'w')
+        fp.write('#op\tcalls\tsw (us)\thw (us)\tother (us)\ttotal (us)'
+                 '\tsw first %g%% (us)\tsw last %g%% (us)\n' %
+                 (SPLIT_SHARE * 100, SPLIT_SHARE * 100))
+        for op, name in OPS:
+            split = self.phases[op].split()
+            fp.write('%s\t%d\t%s\n' % (op, split[0], '\t'.join(
+                ['%.3f' % (t * 1e6) for t in split[1:]])))
+        fp.close()
+
+    def save_rates(self):
+        rates = Rates(rate_window, rate_ewma, stall_threshold)
+        for op, name in OPS:
+            calls = self.phases[op].xy[0]
+            # Simple ones have the call number as x, and the time as y
+            rates.add(op, calls.y if simple else calls.x)
+        if not rates.compute(0.0):
+            return
+        rates.write('fl_rates.dat')
+        rates.write_stalls('fl_stalls.dat')
+        for line in rates.report():
+            print(line)
+
+    def save_churn(self):
+        fp = open('fl_churn.dat', 'w')
+        fp.write('#second\t%s\n' % '\t'.join([op for op, name in OPS]))
+        if self.churn:
+            for second in range(max(self.churn) + 1):
+                fp.write('%d\t%d\t%d\t%d\n' %
+                         (second, *self.churn.get(second, (0, 0, 0))))
+        fp.close()
+
+        fp = open('fl_churn.plt', 'w')
+        fp.write("""
+        set terminal pngcairo size 1024,768 dashed
+        set output "fl_churn.png"
+        set title "Flower rule churn performance\\nCompleted calls per second"
+        set xlabel "Time (s)"
+        set ylabel "Calls/s"
+        set key left
+
+        plot \
+             'fl_churn.dat' using 1:2 title "insert" with steps, \
+             'fl_churn.dat' using 1:3 title "replace" with steps, \
+             'fl_churn.dat' using 1:4 title "delete" with steps
+        """)
+        fp.close()
+
+    def save_workers(self):
+        # One line per thread that called fl_change(), that is, per tc
+        # process when several of them are inserting at once.
+        fp = open('fl_change-workers.dat', 'w')
+        fp.write('#tid\tcalls\tfirst\tlast\trate\n')
+        total = 0
+        first = last = None
+        for tid in sorted(self.workers):
+            calls, start, end = self.workers[tid]
+            rate = calls / (end - start) if end > start else 0.0
+            fp.write('%d\t%d\t%f\t%f\t%f\n' % (tid, calls, start, end, rate))
+            total += calls
+            first = start if first is None else min(first, start)
+            last = end if last is None else max(last, end)
+        fp.close()
+
+        if total and last > first:
+            print('%d workers, %d calls, aggregate rate %f calls/s' %
+                  (len(self.workers), total, total / (last - first)))
+
+
+def parse_fold(args):
+    """The filter being replaced, out of the arguments of a flower:fl_change_fold
+    event in perf script text, or None if it wasn't fetched."""
+    i = args.find('fold=')
+    if i < 0:
+        return None
+    return int(args[i + 5:].split(None, 1)[0], 0)
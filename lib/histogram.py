@@ -0,0 +1,125 @@
+#
+# Log bucketed latency histograms, HDR style.
+#
+# Values are kept in nanoseconds, in buckets that double in width every
+# power of two, each power split in 2^SUB_BITS linear sub buckets. With 5 sub
+# bucket bits, any value is off by at most 1/32 (~3%), and a histogram
+# covering up to hours needs less than 2k counters. Recording is constant
+# time, and percentiles walk the counters once.
+#
+# License: GPLv3
+#
+
+from array import array
+
+SUB_BITS = 5
+SUB = 1 << SUB_BITS
+
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+def bucket_index(value):
+    if value < SUB:
+        return value
+    shift = value.bit_length() - SUB_BITS - 1
+    return ((shift + 1) << SUB_BITS) + (value >> shift) - SUB
+
+
+def bucket_top(index):
+    """Highest value that lands on bucket index."""
+    if index < SUB:
+        return index
+    shift = (index >> SUB_BITS) - 1
+    return (((index & (SUB - 1)) + SUB + 1) << shift) - 1
+
+
+class Histogram():
+    def __init__(self):
+        self.counts = array('Q')
+        self.reset()
+
+    def reset(self):
+        del self.counts[:]
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, seconds):
+        value = int(seconds * 1e9)
+        if value < 0:
+            value = 0
+        i = bucket_index(value)
+        counts = self.counts
+        if i >= len(counts):
+            counts.frombytes(bytes(8 * (i - len(counts) + 1)))
+        counts[i] += 1
+
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def merge(self, other):
+        if len(other.counts) > len(self.counts):
+            self.counts.frombytes(bytes(8 * (len(other.counts) - len(self.counts))))
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def percentiles(self, wanted=PERCENTILES):
+        """Returns the values, in seconds, below which each of the wanted
+        percentages of the recorded values are."""
+        result = []
+        if not self.count:
+            return [0.0] * len(wanted)
+
+        seen = 0
+        i = -1
+        for p in wanted:
+            target = max(1, -(-self.count * p // 100))
+            while seen < target:
+                i += 1
+                seen += self.counts[i]
+            result.append(min(bucket_top(i), self.max) / 1e9)
+        return result
+
+    def mean(self):
+        return self.total / self.count / 1e9 if self.count else 0.0
+
+    def summary(self, wanted=PERCENTILES):
+        """count, mean, min, percentiles... and max, in seconds"""
+        return ([self.count, self.mean(), (self.min or 0) / 1e9] +
+                self.percentiles(wanted) + [self.max / 1e9])
+
+
+class WindowedHistogram():
+    """Keeps a histogram for the whole run and one for the current time
+    window. Each window is handed to 'emit' once it's over."""
+
+    def __init__(self, window, emit):
+        self.window = window
+        self.emit = emit
+        self.all = Histogram()
+        self.current = Histogram()
+        self.start = None
+
+    def record(self, ts, seconds):
+        if self.start is None:
+            self.start = ts - ts % self.window
+        elif ts >= self.start + self.window:
+            self.flush()
+            self.start = ts - ts % self.window
+        self.current.record(seconds)
+        self.all.record(seconds)
+
+    def flush(self):
+        if self.current.count:
+            self.emit(self.start, self.current)
+        self.current.reset()
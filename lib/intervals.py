@@ -0,0 +1,145 @@
+#
+# Entry/return matching of probed functions, per thread.
+#
+# Matching on the CPU breaks as soon as a task gets rescheduled in the middle
+# of a call, which is common after rtnl_lock removal. Here each thread has a
+# stack of open calls instead, so it doesn't matter where the thread runs, and
+# nested calls (tc_new_tfilter -> fl_change -> driver) are matched too.
+#
+# A call is kept in a frame, which is a list:
+#   [ function, entry timestamp, time spent in tracked children, marks... ]
+# Marks are timestamps of probes placed inside the function, such as the
+# flower code line probes. 0.0 means the mark wasn't hit.
+#
+# License: GPLv3
+#
+
+FRAME_FUNC = 0
+FRAME_ENTRY = 1
+FRAME_CHILDREN = 2
+FRAME_MARKS = 3
+
+# Counters kept per function
+MATCHED = 0
+NESTED = 1
+ORPHAN_ENTRIES = 2
+ORPHAN_RETURNS = 3
+
+
+def split_probe(name):
+    """Splits a perf probe event name, like 'probe:fl_change__return', into
+    the function name and whether it's the return probe."""
+    name = name.split(':', 1)[-1]
+    if name.endswith('__return'):
+        return name[:-8], True
+    return name, False
+
+
+class Matcher():
+    def __init__(self, callback, marks=(), max_depth=64):
+        """callback(tid, frame, return ts, stack) is called for each matched
+        call, with stack being the calls still open on that thread, outermost
+        first."""
+        self.callback = callback
+        self.marks = { }
+        for i, mark in enumerate(marks):
+            self.marks[mark] = FRAME_MARKS + i
+        self.nr_marks = len(marks)
+        self.max_depth = max_depth
+        self.threads = { }
+        self.counters = { }
+
+    def counter(self, func):
+        try:
+            return self.counters[func]
+        except KeyError:
+            self.counters[func] = [0, 0, 0, 0]
+            return self.counters[func]
+
+    def entry(self, tid, func, ts):
+        try:
+            stack = self.threads[tid]
+        except KeyError:
+            stack = self.threads[tid] = []
+
+        if len(stack) >= self.max_depth:
+            # Returns are being lost, don't let it grow forever
+            self.counter(stack[0][FRAME_FUNC])[ORPHAN_ENTRIES] += 1
+            del stack[0]
+        stack.append([func, ts, 0.0] + [0.0] * self.nr_marks)
+
+    def find(self, stack, func):
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][FRAME_FUNC] == func:
+                return i
+        return -1
+
+    def mark(self, tid, func, mark, ts):
+        """Records mark on the innermost open call to func on thread tid.
+        Only the first hit of a mark counts."""
+        stack = self.threads.get(tid)
+        if not stack:
+            return False
+        i = self.find(stack, func)
+        if i < 0:
+            return False
+
+        slot = self.marks[mark]
+        frame = stack[i]
+        if frame[slot]:
+            return False
+        frame[slot] = ts
+        return True
+
+    def exit(self, tid, func, ts):
+        stack = self.threads.get(tid)
+        i = self.find(stack, func) if stack else -1
+        if i < 0:
+            self.counter(func)[ORPHAN_RETURNS] += 1
+            return
+
+        # Calls made after it had their returns lost
+        for frame in stack[i + 1:]:
+            self.counter(frame[FRAME_FUNC])[ORPHAN_ENTRIES] += 1
+        del stack[i + 1:]
+
+        frame = stack.pop()
+        counter = self.counter(func)
+        counter[MATCHED] += 1
+        if stack:
+            counter[NESTED] += 1
+            stack[-1][FRAME_CHILDREN] += ts - frame[FRAME_ENTRY]
+        else:
+            del self.threads[tid]
+
+        self.callback(tid, frame, ts, stack)
+
+    def finish(self):
+        """Accounts the calls that never returned."""
+        for stack in self.threads.values():
+            for frame in stack:
+                self.counter(frame[FRAME_FUNC])[ORPHAN_ENTRIES] += 1
+        self.threads = { }
+
+    def report(self):
+        return report(self.counters)
+
+
+def add_counters(total, counters):
+    """Adds up the counters of several matchers, such as one per process."""
+    for func, c in counters.items():
+        t = total.setdefault(func, [0] * len(c))
+        for i in range(len(c)):
+            t[i] += c[i]
+
+
+def report(counters):
+    lines = []
+    for func in sorted(counters):
+        c = counters[func]
+        lines.append('%s: %d matched, %d nested, %d orphaned '
+                     '(%d entries, %d returns)' %
+                     (func, c[MATCHED], c[NESTED],
+                      c[ORPHAN_ENTRIES] + c[ORPHAN_RETURNS],
+                      c[ORPHAN_ENTRIES], c[ORPHAN_RETURNS]))
+    return lines
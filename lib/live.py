@@ -0,0 +1,201 @@
+#
+# Live rates out of a stream of perf script lines.
+#
+# Events are accounted in one second buckets, by their own timestamps, and
+# only the last 'window' buckets are kept. Each time a second completes, the
+# insert (fl_change), delete (fl_delete) and driver call rates over the window
+# are printed, the driver being the one of the probe set, along with the
+# fl_change latency per phase when the flower:* code line probes from
+# rule-install-rate.py are there:
+#   sw:   from fl_change_sw up to fl_change_hw (or fl_change_fold, if skip_hw)
+#   hw:   from fl_change_hw up to fl_change_fold
+#   fold: from fl_change_fold up to the return
+# Out of a pipe, the seconds also complete as the wall clock goes, so that
+# they are printed even when no events come, as in a stall.
+#
+# A function may be probed by both rate-monitor, as probe:fl_change, and
+# rule-install-rate.py, as flower:fl_change_entry. Its calls are only taken
+# from the first of both that shows up, so that they are not counted twice.
+#
+# Memory use depends only on the window size and the number of threads with
+# calls in progress.
+#
+# License: GPLv3
+#
+
+import os
+import select
+import time
+from collections import deque
+
+import probeset
+from intervals import Matcher, split_probe, FRAME_ENTRY, FRAME_MARKS
+from perfscript import parse_line
+
+MARKS = ('sw', 'hw', 'fold')
+PHASES = ('total',) + MARKS
+
+# Bucket layout: event counts, then count, sum and max for each phase
+INSERTS = 0
+DELETES = 1
+DRIVER = 2
+LATENCY = 3
+BUCKET_SIZE = LATENCY + 3 * len(PHASES)
+
+# flower:* probes installed by rule-install-rate.py -> (what, function, mark)
+FLOWER_PROBES = {
+    'fl_change_entry': ('entry', 'fl_change', None),
+    'fl_change_ret': ('exit', 'fl_change', None),
+    'fl_change_sw': ('mark', 'fl_change', 'sw'),
+    'fl_change_hw': ('mark', 'fl_change', 'hw'),
+    'fl_change_fold': ('mark', 'fl_change', 'fold'),
+    'fl_delete_entry': ('entry', 'fl_delete', None),
+    'fl_delete_ret': ('exit', 'fl_delete', None),
+    'fl_hw_destroy_entry': ('entry', 'fl_hw_destroy_filter', None),
+    'fl_hw_destroy_ret': ('exit', 'fl_hw_destroy_filter', None),
+}
+
+
+class LiveRates():
+    def __init__(self, probes=None, window=5, out=None):
+        probes = probeset.load() if probes is None else probes
+        self.driver = probes.driver
+        self.window = window
+        self.out = out
+        self.buckets = deque(maxlen=window)
+        self.second = None
+        self.kinds = { }
+        # function -> the probe group its calls are taken from
+        self.owners = { }
+        self.matcher = Matcher(self.call_done, MARKS)
+
+    def classify(self, name):
+        """Maps an event name to (what, function, mark), what being None if
+        the calls of the function are taken from another probe group."""
+        group, short = name.split(':', 1) if ':' in name else ('', name)
+        if short in FLOWER_PROBES:
+            what, func, mark = FLOWER_PROBES[short]
+        else:
+            func, is_ret = split_probe(name)
+            what, mark = 'exit' if is_ret else 'entry', None
+        if what != 'mark' and self.owners.setdefault(func, group) != group:
+            what = None
+        return what, func, mark
+
+    def bucket(self, ts):
+        second = int(ts)
+        if self.second is None:
+            self.second = second
+            self.buckets.append([0] * BUCKET_SIZE)
+        while second > self.second:
+            self.report()
+            self.second += 1
+            self.buckets.append([0] * BUCKET_SIZE)
+        return self.buckets[-1]
+
+    def add_latency(self, bucket, phase, value):
+        i = LATENCY + 3 * phase
+        bucket[i] += 1
+        bucket[i + 1] += value
+        if value > bucket[i + 2]:
+            bucket[i + 2] = value
+
+    def call_done(self, tid, frame, ret, stack):
+        if frame[0] != 'fl_change':
+            return
+        bucket = self.buckets[-1]
+        entry = frame[FRAME_ENTRY]
+        sw, hw, fold = frame[FRAME_MARKS:FRAME_MARKS + 3]
+        self.add_latency(bucket, 0, ret - entry)
+        if sw and (hw or fold):
+            self.add_latency(bucket, 1, (hw or fold) - sw)
+        if hw and fold:
+            self.add_latency(bucket, 2, fold - hw)
+        if fold:
+            self.add_latency(bucket, 3, ret - fold)
+
+    def add_event(self, tid, ts, name):
+        try:
+            what, func, mark = self.kinds[name]
+        except KeyError:
+            what, func, mark = self.kinds[name] = self.classify(name)
+
+        bucket = self.bucket(ts)
+        if what is None:
+            return
+        if what == 'entry':
+            if func == 'fl_change':
+                bucket[INSERTS] += 1
+            elif func == 'fl_delete':
+                bucket[DELETES] += 1
+            elif func == self.driver:
+                bucket[DRIVER] += 1
+            self.matcher.entry(tid, func, ts)
+        elif what == 'exit':
+            self.matcher.exit(tid, func, ts)
+        else:
+            self.matcher.mark(tid, func, mark, ts)
+
+    def feed(self, lines):
+        for line in lines:
+            sample = parse_line(line)
+            if sample is not None:
+                self.add_event(sample[0], sample[2], sample[3])
+
+    def feed_pipe(self, fd):
+        """Handles the perf script lines read out of fd as they come, and
+        completes the seconds as the wall clock goes, out of the timestamp of
+        the last event, even when none come."""
+        pending = b''
+        offset = None
+        while True:
+            timeout = None
+            if offset is not None:
+                now = time.monotonic() + offset
+                timeout = max(self.second + 1 - now, 0.0)
+            if select.select([fd], [], [], timeout)[0]:
+                data = os.read(fd, 65536)
+                if not data:
+                    break
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    sample = parse_line(line.decode(errors='replace'))
+                    if sample is not None:
+                        self.add_event(sample[0], sample[2], sample[3])
+                        offset = sample[2] - time.monotonic()
+            if offset is not None:
+                self.bucket(time.monotonic() + offset)
+
+    def report(self):
+        buckets = self.buckets
+        span = len(buckets)
+        total = [0] * BUCKET_SIZE
+        for bucket in buckets:
+            for i in range(LATENCY):
+                total[i] += bucket[i]
+            for p in range(len(PHASES)):
+                i = LATENCY + 3 * p
+                total[i] += bucket[i]
+                total[i + 1] += bucket[i + 1]
+                total[i + 2] = max(total[i + 2], bucket[i + 2])
+
+        line = '%d: insert %d/s delete %d/s %s %d/s' % \
+               (self.second, total[INSERTS] / span, total[DELETES] / span,
+                self.driver, total[DRIVER] / span)
+        lat = []
+        for p, phase in enumerate(PHASES):
+            count, value, peak = total[LATENCY + 3 * p:LATENCY + 3 * p + 3]
+            if count:
+                lat.append('%s %.1f/%.1f' %
+                           (phase, value / count * 1e6, peak * 1e6))
+        if lat:
+            line += ' | fl_change avg/max us: ' + ' '.join(lat)
+        print(line, file=self.out, flush=True)
+
+    def finish(self):
+        if self.second is not None:
+            self.report()
+        self.matcher.finish()
+        for line in self.matcher.report():
+            print(line, file=self.out)
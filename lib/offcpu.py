@@ -0,0 +1,401 @@
+#!/usr/bin/python3
+#
+# Scheduler attribution of call latency.
+#
+# With sched:sched_switch and sched:sched_wakeup in the capture, the time of
+# each thread is split in:
+#   on CPU     running
+#   runnable   woken up or preempted, and waiting for a CPU
+#   blocked    sleeping: on a lock, rtnl_lock included, on the socket, or on
+#              the driver
+# and each matched call gets that breakdown, as well as how many times it was
+# switched out and migrated to another CPU. The calls are:
+#   tc_new_tfilter, tc_ctl_tfilter, fl_change, fl_delete and the driver of
+#       the probe set, out of the probe:* probes of rate-monitor/perf-probes.sh
+#   sw part, hw part and just flower, the fl_change() phases out of the
+#       flower:* probes of rule-install-rate.py, as in fl_change.dat
+#   outside flower, from each fl_change() return to the next fl_change()
+#       entry on the same thread, which is what 'tc flower cumulative' has on
+#       top of 'just flower': rtnl, netlink and tc itself
+# Calls are only looked at once scheduler events show up, and the time of a
+# thread before its first one is unknown.
+#
+# Outputs, in the current directory:
+#   offcpu.dat   per call or phase: calls, total time, on CPU, runnable,
+#               blocked and unknown time, in seconds, switches and migrations
+#   offcpu.plt   gnuplot script for offcpu.png, with the share of each state
+#               and the average breakdown per call
+#
+# Besides lib/pipeline.py, it reads perf.data itself, or a 'perf script --ns'
+# output:
+#   # offcpu.py -i perf.data | -t <file|-> [--probe-set name]
+#
+# License: GPLv3
+#
+
+import re
+import sys
+
+import probeset
+from intervals import Matcher, split_probe, FRAME_FUNC, FRAME_MARKS
+from perfscript import parse_line
+
+# Thread states
+ON_CPU = 0
+RUNNABLE = 1
+BLOCKED = 2
+
+# Where things are in a thread: its state and since when, the time spent in
+# each state so far, how many times it was switched out and migrated, and
+# the last CPU it ran on
+T_STATE = 0
+T_SINCE = 1
+T_TIMES = 2
+T_SWITCHES = 5
+T_MIGRATIONS = 6
+T_CPU = 7
+
+# Functions whose calls are broken down, out of their probe:* probes, besides
+# the driver of the probe set
+FUNCS = ('tc_new_tfilter', 'tc_ctl_tfilter', 'fl_change', 'fl_delete')
+
+# fl_change() phases, out of the flower:* probes
+PHASES = ('outside flower', 'sw part', 'hw part', 'just flower')
+
+# The snapshots of the thread at the entry and at each flower code line
+# probe are kept in the Matcher frames, as marks
+MARKS = ('entry', 'sw', 'hw', 'fold')
+S_ENTRY = FRAME_MARKS
+S_SW = FRAME_MARKS + 1
+S_HW = FRAME_MARKS + 2
+S_FOLD = FRAME_MARKS + 3
+
+WAKEUPS = ('sched:sched_wakeup', 'sched:sched_wakeup_new',
+           'sched:sched_waking')
+
+# perf script prints the fields, and lib/perfdata.py the integer ones, with
+# prev_state as a number. Old perf versions print 'comm:pid [prio] state'.
+SWITCH_RE = re.compile(r'prev_pid=(\d+).*prev_state=(\S+).*next_pid=(\d+)')
+SWITCH_OLD_RE = re.compile(r':(\d+) \[-?\d+\] (\S+) ==> .*:(\d+) \[')
+WAKEUP_RE = re.compile(r'(?<!\w)pid=(\d+)')
+
+
+def parse_switch(args):
+    """Returns the pid switched out, whether it's still runnable, that is,
+    preempted, and the pid switched in, out of sched_switch args."""
+    m = SWITCH_RE.search(args) or SWITCH_OLD_RE.search(args)
+    if m is None:
+        return None
+    prev, state, next = m.groups()
+    if state[0].isdigit():
+        # Preempted tasks are TASK_RUNNING, possibly with TASK_REPORT_MAX
+        runnable = int(state, 0) & 0xff == 0
+    else:
+        runnable = state[0] == 'R'
+    return int(prev), runnable, int(next)
+
+
+class Threads():
+    """The state of each thread, and the time it spent in each one."""
+
+    def __init__(self):
+        self.threads = { }
+
+    def get(self, tid):
+        try:
+            return self.threads[tid]
+        except KeyError:
+            t = self.threads[tid] = [None, 0.0, 0.0, 0.0, 0.0, 0, 0, -1]
+            return t
+
+    def advance(self, t, ts):
+        if t[T_STATE] is not None:
+            t[T_TIMES + t[T_STATE]] += ts - t[T_SINCE]
+        t[T_SINCE] = ts
+
+    def moved(self, t, cpu):
+        if t[T_CPU] >= 0 and t[T_CPU] != cpu:
+            t[T_MIGRATIONS] += 1
+        t[T_CPU] = cpu
+
+    def switch(self, ts, cpu, prev, runnable, next):
+        t = self.get(prev)
+        self.advance(t, ts)
+        t[T_STATE] = RUNNABLE if runnable else BLOCKED
+        t[T_SWITCHES] += 1
+        if next:
+            t = self.get(next)
+            self.advance(t, ts)
+            t[T_STATE] = ON_CPU
+            self.moved(t, cpu)
+
+    def wakeup(self, ts, tid):
+        t = self.get(tid)
+        if t[T_STATE] != ON_CPU:
+            self.advance(t, ts)
+            t[T_STATE] = RUNNABLE
+
+    def running(self, ts, tid, cpu):
+        """The thread hit a probe, so it's on that CPU, whatever was missed
+        before."""
+        t = self.get(tid)
+        if t[T_STATE] != ON_CPU:
+            self.advance(t, ts)
+            t[T_STATE] = ON_CPU
+        self.moved(t, cpu)
+
+    def snapshot(self, tid, ts):
+        """Returns ts and, up to it, the time the thread spent on CPU,
+        runnable and blocked, and how many times it was switched out and
+        migrated."""
+        t = self.get(tid)
+        times = t[T_TIMES:T_TIMES + 3]
+        if t[T_STATE] is not None:
+            times[t[T_STATE]] += ts - t[T_SINCE]
+        return (ts, times[0], times[1], times[2], t[T_SWITCHES],
+                t[T_MIGRATIONS])
+
+
+class SchedLatency():
+    def __init__(self, probes=None):
+        probes = probeset.load() if probes is None else probes
+        self.funcs = FUNCS + (probes.driver,)
+        self.threads = Threads()
+        self.calls = Matcher(self.call_done, ('entry',))
+        self.phases = Matcher(self.phase_done, MARKS)
+        # thread -> snapshot at its last fl_change() return
+        self.last_ret = { }
+        # call or phase -> [ calls, time, on CPU, runnable, blocked,
+        #                    switches, migrations ]
+        self.rows = { }
+        self.switches = 0
+
+    def add(self, name, start, end):
+        try:
+            row = self.rows[name]
+        except KeyError:
+            row = self.rows[name] = [0, 0.0, 0.0, 0.0, 0.0, 0, 0]
+        row[0] += 1
+        for i in range(len(start)):
+            row[i + 1] += end[i] - start[i]
+
+    def handler(self, name):
+        """Returns what handles the events called 'name', as
+        handle(tid, cpu, ts, name, args), or None."""
+        threads = self.threads
+
+        if name == 'sched:sched_switch':
+            def handle(tid, cpu, ts, name, args):
+                switch = parse_switch(args)
+                if switch is not None:
+                    self.switches += 1
+                    threads.switch(ts, cpu, *switch)
+            return handle
+
+        if name in WAKEUPS:
+            def handle(tid, cpu, ts, name, args):
+                m = WAKEUP_RE.search(args)
+                if m is not None:
+                    threads.wakeup(ts, int(m.group(1)))
+            return handle
+
+        system, event = name.split(':', 1) if ':' in name else ('', name)
+        if system == 'flower' and event.startswith('fl_change_'):
+            kind = event[10:]
+            phases = self.phases
+            if kind == 'entry':
+                def handle(tid, cpu, ts, name, args):
+                    if not self.switches:
+                        return
+                    threads.running(ts, tid, cpu)
+                    snap = threads.snapshot(tid, ts)
+                    last = self.last_ret.pop(tid, None)
+                    if last is not None:
+                        self.add('outside flower', last, snap)
+                    phases.entry(tid, 'fl_change', ts)
+                    phases.mark(tid, 'fl_change', 'entry', snap)
+            elif kind == 'ret':
+                def handle(tid, cpu, ts, name, args):
+                    if not self.switches:
+                        return
+                    threads.running(ts, tid, cpu)
+                    phases.exit(tid, 'fl_change', ts)
+            elif kind in MARKS:
+                def handle(tid, cpu, ts, name, args):
+                    if not self.switches:
+                        return
+                    threads.running(ts, tid, cpu)
+                    phases.mark(tid, 'fl_change', kind,
+                                threads.snapshot(tid, ts))
+            else:
+                return None
+            return handle
+
+        func, is_ret = split_probe(name)
+        if system != 'probe' or func not in self.funcs:
+            return None
+        calls = self.calls
+        if is_ret:
+            def handle(tid, cpu, ts, name, args):
+                if not self.switches:
+                    return
+                threads.running(ts, tid, cpu)
+                calls.exit(tid, func, ts)
+        else:
+            def handle(tid, cpu, ts, name, args):
+                if not self.switches:
+                    return
+                threads.running(ts, tid, cpu)
+                calls.entry(tid, func, ts)
+                calls.mark(tid, func, 'entry', threads.snapshot(tid, ts))
+        return handle
+
+    def call_done(self, tid, frame, ret, stack):
+        self.add(frame[FRAME_FUNC], frame[S_ENTRY],
+                 self.threads.snapshot(tid, ret))
+
+    def phase_done(self, tid, frame, ret, stack):
+        entry = frame[S_ENTRY]
+        sw = frame[S_SW]
+        hw = frame[S_HW]
+        fold = frame[S_FOLD]
+        snap = self.threads.snapshot(tid, ret)
+        self.last_ret[tid] = snap
+        self.add('just flower', entry, snap)
+        # As fl_change.dat has them, skipping calls with missed probes
+        if not sw or not fold or sw[0] > fold[0]:
+            return
+        self.add('sw part', sw, hw or fold)
+        if hw:
+            self.add('hw part', hw, fold)
+
+    def feed(self, lines):
+        """Handles the events in perf script --ns output lines."""
+        self.feed_samples(filter(None, map(parse_line, lines)))
+
+    def feed_samples(self, samples):
+        handlers = { }
+        for sample in samples:
+            name = sample[3]
+            try:
+                handle = handlers[name]
+            except KeyError:
+                handle = handlers[name] = self.handler(name)
+            if handle is not None:
+                handle(*sample)
+
+    def names(self):
+        """The calls and phases seen, in the order they are written."""
+        return [name for name in self.funcs + PHASES if name in self.rows]
+
+    def report(self):
+        lines = []
+        for name in self.names():
+            calls, total, on, runnable, blocked, switches, migrations = \
+                self.rows[name]
+            unknown = total - on - runnable - blocked
+            pct = [100.0 * t / total if total > 0 else 0.0
+                   for t in (on, runnable, blocked, unknown)]
+            lines.append('%s: %d calls, %.3f us avg: %.1f%% on CPU, '
+                         '%.1f%% runnable, %.1f%% blocked, %.1f%% unknown, '
+                         '%.3f switches and %.3f migrations per call' %
+                         ((name, calls, total / calls * 1e6) + tuple(pct) +
+                          (switches / calls, migrations / calls)))
+        return lines
+
+    def finish(self):
+        """Writes the outputs, and returns the gnuplot scripts to run."""
+        self.calls.finish()
+        self.phases.finish()
+        if not self.switches:
+            print('No sched:sched_switch events, the capture needs them for '
+                  'the scheduler breakdown')
+            return []
+        if not self.rows:
+            print('No calls to break down')
+            return []
+
+        fp = open('offcpu.dat', 'w')
+        fp.write('#call\tcalls\ttime\toncpu\trunnable\tblocked\tunknown\t'
+                 'switches\tmigrations\n')
+        for name in self.names():
+            calls, total, on, runnable, blocked, switches, migrations = \
+                self.rows[name]
+            fp.write('"%s"\t%d\t%.9f\t%.9f\t%.9f\t%.9f\t%.9f\t%d\t%d\n' %
+                     (name, calls, total, on, runnable, blocked,
+                      total - on - runnable - blocked, switches, migrations))
+        fp.close()
+        self.write_gnuplot_cfg()
+
+        for line in self.report():
+            print(line)
+        return ['offcpu.plt']
+
+    def write_gnuplot_cfg(self):
+        fp = open('offcpu.plt', 'w')
+        fp.write("""
+        set terminal pngcairo size 1024,1024 dashed
+        set termoption noenhanced
+        set output "offcpu.png"
+        set multiplot layout 2,1 title "Where the call time goes"
+        set style data histograms
+        set style histogram rowstacked
+        set style fill solid border -1
+        set boxwidth 0.75
+        set key outside right
+        set xtics rotate by -30
+
+        set ylabel "Time (%)"
+        set yrange [0:100]
+        plot \
+             'offcpu.dat' using ($3 > 0 ? 100*$4/$3 : 0):xtic(1) title "on CPU", \
+             '' using ($3 > 0 ? 100*$5/$3 : 0) title "runnable", \
+             '' using ($3 > 0 ? 100*$6/$3 : 0) title "blocked", \
+             '' using ($3 > 0 ? 100*$7/$3 : 0) title "unknown"
+
+        set ylabel "Average per call (us)"
+        set yrange [0:*]
+        plot \
+             'offcpu.dat' using (1e6*$4/$2):xtic(1) title "on CPU", \
+             '' using (1e6*$5/$2) title "runnable", \
+             '' using (1e6*$6/$2) title "blocked", \
+             '' using (1e6*$7/$2) title "unknown"
+        unset multiplot
+        """)
+        fp.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Break call latency down into on CPU, runnable and '
+                    'blocked time')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-i', '--input',
+                        help='perf.data file to read')
+    source.add_argument('-t', '--text',
+                        help='perf script --ns output, - for stdin')
+    parser.add_argument('--probe-set', default=probeset.DEFAULT,
+                        help='driver probe set, as perf-probes.sh -s was '
+                             'given')
+    args = parser.parse_args()
+
+    try:
+        probes = probeset.load(args.probe_set)
+    except probeset.ProbeSetError as err:
+        parser.error(err)
+
+    offcpu = SchedLatency(probes)
+    if args.input:
+        import eventcache
+        offcpu.feed_samples(eventcache.samples(args.input)[0])
+    else:
+        fp = sys.stdin if args.text == '-' else open(args.text)
+        offcpu.feed(fp)
+    if not offcpu.finish():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
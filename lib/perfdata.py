@@ -0,0 +1,480 @@
+#!/usr/bin/python3
+#
+# perf.data reader, without perf.
+#
+# perf script hands every sample to its embedded Python as a couple of dicts,
+# and building them is most of the time parsing takes. This reads the file
+# itself instead. It is memory mapped, and:
+#   - the attrs section gives each event's sample layout and its sample ids
+#   - the EVENT_DESC feature gives the event names
+#   - the format files in the TRACING_DATA feature give the layout of the
+#     tracepoint and probe fields, such as 'offload' or 'fold'
+# Samples are then decoded with struct layouts built once per event, straight
+# out of the mapping.
+#
+# Samples come out as perfscript.parse_line() returns them:
+#   (tid, cpu, timestamp, event name, args)
+# with the probe fields in args as perf script prints them, like
+# 'offload=0xffff888100000100', so that whatever handles perf script text
+# handles them too. Formatting them is a good part of the decoding, so
+# read() leaves them out when the perfscript.Events it fills in doesn't keep
+# them. As perf does, samples are sorted by time: they are kept until a
+# FINISHED_ROUND record tells that nothing older can come anymore.
+#
+# Only regular perf.data files are supported, not pipe mode nor compressed
+# ones, and PerfDataError tells when perf script is needed instead.
+#
+# It can also print the samples, roughly as 'perf script --ns' does:
+#   # perfdata.py [-i perf.data] [--header | --header-only]
+#
+# License: GPLv3
+#
+
+import mmap
+import os
+import re
+import struct
+import sys
+
+MAGIC = b'PERFILE2'
+
+# perf_event_header types
+RECORD_COMM = 3
+RECORD_SAMPLE = 9
+RECORD_FINISHED_ROUND = 68
+
+# perf_event_attr.sample_type bits, in the order they are laid out in a
+# sample, with their struct format
+SAMPLE_IDENTIFIER = 1 << 16
+SAMPLE_LAYOUT = (
+    (SAMPLE_IDENTIFIER, 'Q', None),
+    (1 << 0, 'Q', 'ip'),
+    (1 << 1, 'II', 'tid'),
+    (1 << 2, 'Q', 'time'),
+    (1 << 3, 'Q', None),           # addr
+    (1 << 6, 'Q', None),           # id
+    (1 << 9, 'Q', None),           # stream_id
+    (1 << 7, 'II', 'cpu'),
+    (1 << 8, 'Q', None),           # period
+)
+SAMPLE_ID = 1 << 6
+SAMPLE_READ = 1 << 4
+SAMPLE_CALLCHAIN = 1 << 5
+SAMPLE_RAW = 1 << 10
+
+# Feature bits, each one with a section after the data
+FEAT_TRACING_DATA = 1
+FEAT_HOSTNAME = 3
+FEAT_OSRELEASE = 4
+FEAT_VERSION = 5
+FEAT_ARCH = 6
+FEAT_NRCPUS = 7
+FEAT_CPUDESC = 8
+FEAT_CPUID = 9
+FEAT_CMDLINE = 11
+FEAT_EVENT_DESC = 12
+FEAT_BITS = 256
+
+# String features -> perf script --header key
+STRING_FEATURES = {
+    FEAT_HOSTNAME: 'hostname',
+    FEAT_OSRELEASE: 'os release',
+    FEAT_VERSION: 'perf version',
+    FEAT_ARCH: 'arch',
+    FEAT_CPUDESC: 'cpudesc',
+    FEAT_CPUID: 'cpuid',
+}
+
+# How much of the file is read before dropping it from memory
+DROP_SIZE = 16 << 20
+
+FIELD_RE = re.compile(r'field:([^;]*);\s*offset:(\d+);\s*size:(\d+);'
+                      r'(?:\s*signed:(\d+);)?')
+INT_FORMATS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+
+class PerfDataError(Exception):
+    pass
+
+
+class EventFormat():
+    """The fields of a tracepoint, out of its format file."""
+
+    def __init__(self, text):
+        self.system = None
+        self.name = None
+        self.id = None
+        self.fields = []
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith('name:'):
+                self.name = line[5:].strip()
+            elif line.startswith('ID:'):
+                self.id = int(line[3:])
+            elif line.startswith('field:'):
+                m = FIELD_RE.match(line)
+                if m:
+                    decl, offset, size, signed = m.groups()
+                    self.fields.append((decl.strip(), int(offset), int(size),
+                                        signed == '1'))
+
+    def layout(self, order):
+        """Returns the struct to unpack the args out of the raw data, and the
+        format that prints them as perf script does, skipping the common and
+        the probe address fields, and whatever isn't a plain integer."""
+        fmt = order
+        pos = 0
+        names = []
+        for decl, offset, size, sign in sorted(self.fields,
+                                               key=lambda f: f[1]):
+            name = decl.split()[-1]
+            if name.startswith('common_') or name.startswith('__probe') or \
+               '[' in decl or '__data_loc' in decl or size not in INT_FORMATS:
+                continue
+            if offset > pos:
+                fmt += '%dx' % (offset - pos)
+            c = INT_FORMATS[size]
+            fmt += c if sign else c.upper()
+            pos = offset + size
+            names.append(('%s=%%d' if sign else '%s=0x%%x') % name)
+        if not names:
+            return None, None
+        return struct.Struct(fmt), ' '.join(names)
+
+
+class Attr():
+    def __init__(self, data, order):
+        (self.type, self.size, self.config, self.period, self.sample_type,
+         self.read_format, self.flags) = struct.unpack_from(order + 'IIQQQQQ',
+                                                            data)
+        self.name = None
+        self.format = None
+        if self.sample_type & SAMPLE_READ:
+            raise PerfDataError('PERF_SAMPLE_READ is not supported')
+
+        # Fixed part of the samples, before the callchain and the raw data,
+        # and where tid, cpu and time are in it
+        fmt = order
+        fields = { }
+        for bit, f, what in SAMPLE_LAYOUT:
+            if self.sample_type & bit:
+                if what:
+                    # tid and cpu are the second and first of their pairs
+                    fields[what] = len(fmt) - 1 + (1 if what == 'tid' else 0)
+                fmt += f
+        self.prefix = struct.Struct(fmt)
+        self.fields = fields
+        self.args = (None, None)
+
+
+class PerfData():
+    def __init__(self, path):
+        fp = open(path, 'rb')
+        size = os.fstat(fp.fileno()).st_size
+        if size < 104:
+            raise PerfDataError('%s: not a perf.data file' % path)
+        self.map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        fp.close()
+        data = self.map
+
+        if data[:8] == MAGIC:
+            self.order = '<'
+        elif data[:8] == MAGIC[::-1]:
+            self.order = '>'
+        else:
+            raise PerfDataError('%s: not a perf.data file' % path)
+        order = self.order
+
+        (header_size, attr_size, attrs_off, attrs_size, self.data_off,
+         self.data_size) = struct.unpack_from(order + 'QQQQQQ', data, 8)
+        if header_size == 16:
+            raise PerfDataError('%s: pipe mode is not supported' % path)
+        features = 0
+        for i, word in enumerate(struct.unpack_from(order + '4Q', data, 72)):
+            features |= word << (64 * i)
+
+        self.meta = { }
+        self.formats = { }
+        self.attrs = []
+        # sample id -> attr
+        self.ids = { }
+        for off in range(attrs_off, attrs_off + attrs_size, attr_size):
+            attr = Attr(data[off:off + attr_size - 16], order)
+            ids_off, ids_size = struct.unpack_from(order + 'QQ', data,
+                                                   off + attr_size - 16)
+            for i in struct.unpack_from(order + '%dQ' % (ids_size // 8), data,
+                                        ids_off):
+                self.ids[i] = attr
+            self.attrs.append(attr)
+        if not self.attrs:
+            raise PerfDataError('%s: no events' % path)
+
+        self.read_features(features)
+        for attr in self.attrs:
+            attr.format = self.formats.get(attr.config) \
+                if attr.type == 2 else None
+            if attr.name is None:
+                attr.name = '%s:%s' % (attr.format.system, attr.format.name) \
+                    if attr.format else 'event%d' % self.attrs.index(attr)
+            if attr.format is not None:
+                attr.args = attr.format.layout(order)
+
+        # Where the sample id is, which must be the same for all events
+        first = self.attrs[0].sample_type
+        self.id_pos = None
+        if len(self.attrs) > 1:
+            if first & SAMPLE_IDENTIFIER:
+                self.id_pos = 8
+            elif first & SAMPLE_ID:
+                # After ip, tid, time and addr, 8 bytes each
+                self.id_pos = 8 + 8 * bin(first & 0xf).count('1')
+            else:
+                raise PerfDataError('%s: samples without ids' % path)
+
+    def read_features(self, features):
+        data = self.map
+        order = self.order
+        pos = self.data_off + self.data_size
+        for bit in range(FEAT_BITS):
+            if not features & (1 << bit):
+                continue
+            off, size = struct.unpack_from(order + 'QQ', data, pos)
+            pos += 16
+            if bit in STRING_FEATURES:
+                self.meta[STRING_FEATURES[bit]] = self.string(off)[0]
+            elif bit == FEAT_NRCPUS:
+                avail, online = struct.unpack_from(order + 'II', data, off)
+                self.meta['nrcpus online'] = str(online)
+                self.meta['nrcpus avail'] = str(avail)
+            elif bit == FEAT_CMDLINE:
+                nr, = struct.unpack_from(order + 'I', data, off)
+                off += 4
+                args = []
+                for i in range(nr):
+                    arg, off = self.string(off)
+                    args.append(arg)
+                self.meta['cmdline'] = ' '.join(args)
+            elif bit == FEAT_EVENT_DESC:
+                self.read_event_desc(off)
+            elif bit == FEAT_TRACING_DATA:
+                self.read_tracing_data(off, off + size)
+
+    def string(self, off):
+        """Reads a perf_header_string, and returns it and where it ends."""
+        length, = struct.unpack_from(self.order + 'I', self.map, off)
+        off += 4
+        text = self.map[off:off + length].split(b'\0', 1)[0]
+        return text.decode(errors='replace'), off + length
+
+    def read_event_desc(self, off):
+        order = self.order
+        nre, sz = struct.unpack_from(order + 'II', self.map, off)
+        off += 8
+        for i in range(nre):
+            config, = struct.unpack_from(order + 'Q', self.map, off + 8)
+            off += sz
+            nr, = struct.unpack_from(order + 'I', self.map, off)
+            name, off = self.string(off + 4)
+            ids = struct.unpack_from(order + '%dQ' % nr, self.map, off)
+            off += 8 * nr
+            if ids:
+                attr = self.ids.get(ids[0])
+            else:
+                attr = [a for a in self.attrs if a.config == config][:1]
+                attr = attr[0] if attr else None
+            if attr is not None:
+                attr.name = name
+
+    def read_tracing_data(self, off, end):
+        data = self.map
+        if data[off:off + 10] != b'\x17\x08\x44tracing':
+            return
+        off += 10
+        version_end = data.find(b'\0', off)
+        off = version_end + 1
+        order = '>' if data[off] else '<'
+        off += 2
+        off += 4                                    # page size
+
+        def section(off, name):
+            if data[off:off + len(name)] == name:
+                off += len(name) + 1
+                size, = struct.unpack_from(order + 'Q', data, off)
+                off += 8 + size
+            return off
+
+        off = section(off, b'header_page')
+        off = section(off, b'header_event')
+
+        # ftrace formats, then the event formats of each system
+        count, = struct.unpack_from(order + 'I', data, off)
+        off += 4
+        for i in range(count):
+            size, = struct.unpack_from(order + 'Q', data, off)
+            off += 8 + size
+        systems, = struct.unpack_from(order + 'I', data, off)
+        off += 4
+        for i in range(systems):
+            name_end = data.find(b'\0', off)
+            system = data[off:name_end].decode(errors='replace')
+            off = name_end + 1
+            count, = struct.unpack_from(order + 'I', data, off)
+            off += 4
+            for j in range(count):
+                size, = struct.unpack_from(order + 'Q', data, off)
+                off += 8
+                text = data[off:off + size].decode(errors='replace')
+                fmt = EventFormat(text)
+                fmt.system = system
+                if fmt.id is not None:
+                    self.formats[fmt.id] = fmt
+                off += size
+
+    def samples(self, comms=None, args=True):
+        """Yields the samples, sorted by time. If comms is a dict, it gets
+        the command name of each thread, as they come. Without args, the
+        args of the samples are left empty."""
+        data = self.map
+        order = self.order
+        header = struct.Struct(order + 'IHH')
+        u64 = struct.Struct(order + 'Q')
+        u32 = struct.Struct(order + 'I')
+        comm = struct.Struct(order + 'II')
+
+        # sample id -> how to decode the sample: the fixed part, where tid,
+        # cpu and time are in it, whether there's a callchain, and the
+        # struct and the format of the raw args
+        decoders = { }
+        for attr in self.attrs:
+            f = attr.fields
+            decoders[attr] = (attr.prefix, f.get('tid'), f.get('cpu'),
+                              f.get('time'),
+                              attr.sample_type & SAMPLE_CALLCHAIN,
+                              attr.args[0] if args and
+                              attr.sample_type & SAMPLE_RAW else None,
+                              attr.args[1], attr.name)
+        id_pos = self.id_pos
+        single = decoders[self.attrs[0]] if id_pos is None else None
+        decoders = {i: decoders[attr] for i, attr in self.ids.items()}
+
+        # Samples not flushed yet, the newest of them, the newest of them as
+        # of the last FINISHED_ROUND, and up to where they were flushed
+        pending = []
+        last_max = 0
+        round_max = 0
+        flushed = 0
+        seq = 0
+        # What was read already is dropped from memory now and then
+        dropped = 0
+        pos = self.data_off
+        end = pos + self.data_size
+        while pos < end:
+            rtype, misc, size = header.unpack_from(data, pos)
+            if size < 8:
+                raise PerfDataError('bad record at %d' % pos)
+            if rtype == RECORD_SAMPLE:
+                decoder = single or \
+                    decoders.get(u64.unpack_from(data, pos + id_pos)[0])
+                if decoder is None:
+                    pos += size
+                    continue
+                prefix, tid, cpu, time, callchain, raw, fmt, name = decoder
+                values = prefix.unpack_from(data, pos + 8)
+                text = ''
+                if raw is not None:
+                    off = pos + 8 + prefix.size
+                    if callchain:
+                        off += 8 + 8 * u64.unpack_from(data, off)[0]
+                    if u32.unpack_from(data, off)[0] >= raw.size:
+                        text = fmt % raw.unpack_from(data, off + 4)
+                time = values[time] if time is not None else 0
+                sample = (values[tid] if tid is not None else -1,
+                          values[cpu] if cpu is not None else -1,
+                          time / 1e9, name, text)
+                if time < flushed:
+                    # Older than what was flushed already, as perf would
+                    # tell, there's nothing better to do with it
+                    yield sample
+                else:
+                    pending.append((time, seq, sample))
+                    seq += 1
+                    if time > last_max:
+                        last_max = time
+            elif rtype == RECORD_FINISHED_ROUND:
+                # Nothing still to come precedes what the rounds before this
+                # one had
+                pending.sort()
+                n = 0
+                while n < len(pending) and pending[n][0] <= round_max:
+                    yield pending[n][2]
+                    n += 1
+                del pending[:n]
+                flushed = round_max
+                round_max = last_max
+                if pos - dropped >= DROP_SIZE:
+                    drop = pos & ~(mmap.PAGESIZE - 1)
+                    data.madvise(mmap.MADV_DONTNEED, dropped, drop - dropped)
+                    dropped = drop
+            elif rtype == RECORD_COMM and comms is not None:
+                pid, tid = comm.unpack_from(data, pos + 8)
+                name = data[pos + 16:pos + size].split(b'\0', 1)[0]
+                comms[tid] = name.decode(errors='replace')
+            pos += size
+
+        pending.sort()
+        for s in pending:
+            yield s[2]
+
+    def read(self, keep_args=False):
+        """Returns all the samples, as a perfscript.Events."""
+        from perfscript import Events
+
+        events = Events(keep_args)
+        events.meta = dict(self.meta)
+        append = events.append
+        for sample in self.samples(args=keep_args):
+            append(*sample)
+        return events
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Print the samples of a perf.data file, without perf')
+    parser.add_argument('-i', '--input', default='perf.data')
+    parser.add_argument('--header', action='store_true',
+                        help='print the header first, as perf script --header')
+    parser.add_argument('--header-only', action='store_true',
+                        help='print just the header')
+    args = parser.parse_args()
+
+    try:
+        perf = PerfData(args.input)
+    except PerfDataError as err:
+        sys.exit(str(err))
+    out = sys.stdout
+    if args.header or args.header_only:
+        out.write('# ========\n')
+        for key, value in perf.meta.items():
+            out.write('# %s : %s\n' % (key, value))
+        out.write('# ========\n#\n')
+        if args.header_only:
+            return
+    comms = { }
+    lines = []
+    for tid, cpu, ts, name, sample_args in perf.samples(comms):
+        lines.append('%16s %6d [%03d] %.9f: %s: %s\n' %
+                     (comms.get(tid, ':%d' % tid), tid, cpu, ts, name,
+                      sample_args))
+        if len(lines) >= 65536:
+            out.write(''.join(lines))
+            lines = []
+    out.write(''.join(lines))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except BrokenPipeError:
+        pass
@@ -0,0 +1,246 @@
+#
+# Parser for 'perf script' text output.
+#
+# Lines such as
+#    revalidator12  5079 [028] 16126.431019123:        probe:tc_dump_tfilter: (ffffffff8c554490)
+# are stored column wise: one array per field, one entry per event. Event
+# names are interned and referred to by their index in Events.names. The
+# header printed by 'perf script --header', such as
+#    # os release : 5.14.0-70.el9.x86_64
+# goes to Events.meta.
+#
+# The text is read in large chunks and, for big regular files, parsed by a
+# pool of processes, each one handling a byte range of the file.
+#
+# License: GPLv3
+#
+
+import os
+import sys
+from array import array
+
+# Read this much text at once
+CHUNK_SIZE = 64 << 20
+
+# Below this size, parsing in parallel is not worth the fork
+PARALLEL_MIN_SIZE = 256 << 20
+
+
+def parse_line(line):
+    """Returns (tid, cpu, timestamp, event name, args) out of a perf script
+    line, or None if it's not an event."""
+    parts = line.split()
+    if len(parts) < 5 or parts[0][0] == '#':
+        return None
+
+    # The command name may have blanks in it, so look for the cpu
+    i = 2
+    if parts[2][0] != '[':
+        for i in range(3, len(parts) - 2):
+            if parts[i][0] == '[' and parts[i][-1] == ']':
+                break
+        else:
+            return None
+
+    j = i + 2
+    name = parts[j]
+    if name.isdigit() and j + 1 < len(parts):
+        # sample period
+        j += 1
+        name = parts[j]
+    if name[-1] == ':':
+        name = name[:-1]
+
+    try:
+        t = parts[i - 1]
+        return (int(t[t.find('/') + 1:]), int(parts[i][1:-1]),
+                float(parts[i + 1].rstrip(':')), name, ' '.join(parts[j + 1:]))
+    except ValueError:
+        return None
+
+
+def parse_header(line):
+    """Returns (key, value) out of a perf script --header line, or None."""
+    if line[:1] != '#':
+        return None
+    key, sep, value = line[1:].partition(' : ')
+    if not sep:
+        return None
+    return key.strip(), value.strip()
+
+
+# perf script --header keys -> shell variable names, as perf-plot.sh uses them
+HEADER_VARS = (
+    ('os release', 'kernel'),
+    ('nrcpus avail', 'ncpu'),
+    ('cpudesc', 'cpumodel'),
+)
+
+
+def header_vars(meta):
+    return [(var, meta.get(key, '')) for key, var in HEADER_VARS]
+
+
+class Events():
+    def __init__(self, keep_args=False):
+        self.tid = array('l')
+        self.cpu = array('l')
+        self.ts = array('d')
+        self.event = array('l')
+        self.names = []
+        self.ids = {}
+        # Whatever follows the event name, only if asked for
+        self.args = [] if keep_args else None
+        self.skipped = 0
+        self.meta = { }
+
+    def __len__(self):
+        return len(self.ts)
+
+    def event_id(self, name):
+        try:
+            return self.ids[name]
+        except KeyError:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+            return self.ids[name]
+
+    def find(self, name):
+        """Returns the id of event 'name', matching with or without the
+        group prefix ('probe:fl_change' or 'fl_change'), or None."""
+        if name in self.ids:
+            return self.ids[name]
+        for i, full in enumerate(self.names):
+            if full.split(':', 1)[-1] == name:
+                return i
+        return None
+
+    def append(self, tid, cpu, ts, name, args=''):
+        """Adds one event, as returned by parse_line()."""
+        self.tid.append(tid)
+        self.cpu.append(cpu)
+        self.ts.append(ts)
+        try:
+            self.event.append(self.ids[name])
+        except KeyError:
+            self.event.append(self.event_id(name))
+        if self.args is not None:
+            self.args.append(args)
+
+    def parse_lines(self, lines):
+        tid = self.tid
+        cpu = self.cpu
+        ts = self.ts
+        event = self.event
+        args = self.args
+        ids = self.ids
+
+        for line in lines:
+            sample = parse_line(line)
+            if sample is None:
+                header = parse_header(line)
+                if header is not None:
+                    self.meta.setdefault(*header)
+                elif line.strip() and line.lstrip()[0] != '#':
+                    self.skipped += 1
+                continue
+
+            tid.append(sample[0])
+            cpu.append(sample[1])
+            ts.append(sample[2])
+            try:
+                event.append(ids[sample[3]])
+            except KeyError:
+                event.append(self.event_id(sample[3]))
+            if args is not None:
+                args.append(sample[4])
+
+    def extend(self, other):
+        """Appends the events parsed by another Events instance."""
+        remap = array('l', [self.event_id(name) for name in other.names])
+        self.tid.extend(other.tid)
+        self.cpu.extend(other.cpu)
+        self.ts.extend(other.ts)
+        self.event.extend(array('l', [remap[e] for e in other.event]))
+        if self.args is not None:
+            self.args.extend(other.args)
+        self.skipped += other.skipped
+        for key, value in other.meta.items():
+            self.meta.setdefault(key, value)
+
+    def select(self, idx):
+        """Returns a new Events with just the entries listed in idx."""
+        new = Events(self.args is not None)
+        new.names = list(self.names)
+        new.ids = dict(self.ids)
+        new.meta = self.meta
+        new.tid = array('l', [self.tid[i] for i in idx])
+        new.cpu = array('l', [self.cpu[i] for i in idx])
+        new.ts = array('d', [self.ts[i] for i in idx])
+        new.event = array('l', [self.event[i] for i in idx])
+        if self.args is not None:
+            new.args = [self.args[i] for i in idx]
+        return new
+
+
+def parse_stream(fp, keep_args=False):
+    """Parses a text stream, such as a pipe from perf script, in chunks."""
+    events = Events(keep_args)
+    while True:
+        lines = fp.readlines(CHUNK_SIZE)
+        if not lines:
+            break
+        events.parse_lines(lines)
+    return events
+
+
+def _parse_range(job):
+    # Parses the lines starting within [start, end) of the file
+    path, start, end, keep_args = job
+    events = Events(keep_args)
+    fp = open(path, 'rb')
+    if start:
+        # The previous range owns the line crossing 'start'
+        fp.seek(start - 1)
+        fp.readline()
+    pos = fp.tell()
+    while pos < end:
+        lines = fp.readlines(CHUNK_SIZE)
+        if not lines:
+            break
+        n = 0
+        for line in lines:
+            if pos >= end:
+                break
+            pos += len(line)
+            n += 1
+        text = b''.join(lines[:n]).decode(errors='replace')
+        events.parse_lines(text.splitlines())
+    fp.close()
+    return events
+
+
+def parse_file(path, keep_args=False, jobs=None):
+    """Parses a perf script output file, in parallel if it's big enough."""
+    if path == '-':
+        return parse_stream(sys.stdin, keep_args)
+
+    size = os.path.getsize(path)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs < 2 or size < PARALLEL_MIN_SIZE:
+        fp = open(path, 'r', errors='replace')
+        events = parse_stream(fp, keep_args)
+        fp.close()
+        return events
+
+    from multiprocessing import Pool
+
+    step = size // jobs + 1
+    ranges = [(path, i, min(i + step, size), keep_args)
+              for i in range(0, size, step)]
+    events = Events(keep_args)
+    with Pool(jobs) as pool:
+        for part in pool.map(_parse_range, ranges):
+            events.extend(part)
+    return events
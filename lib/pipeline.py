@@ -0,0 +1,204 @@
+#
+# Single decode, multi analyzer pipeline.
+#
+# Each tool used to decode the capture on its own, some of them more than
+# once. Here, the capture is decoded once, by lib/perfdata.py or out of the
+# 'perf script --ns --header' output, and each event is handed to the
+# analyzers that want it:
+#   phases  fl_change() and fl_delete() phases, as rule-install-rate.py parse
+#           writes them (lib/flower.py)
+#   calls   call rates and durations, as rate-monitor/perf-analyze.py writes
+#           them (lib/calls.py)
+#   dumps   stats dumps, and their cost to the inserts, ditto
+#   tree    call tree of the probed functions, with their self time, ditto
+#           (lib/calltree.py)
+#   ct      conntrack offload latency, as ct-monitor/perf-script.py writes it
+#           (lib/ctoffload.py)
+#   offcpu  on CPU, runnable and blocked time of the calls and fl_change()
+#           phases, out of the sched:* events (lib/offcpu.py)
+# Analyzers are only imported when used. Each one is asked once per event
+# name for the handler of those events, handle(tid, cpu, ts, name, args), or
+# None, and writes its outputs at the end, unless none of its events were
+# seen.
+#
+# The header of the capture is written to perf-header.env, as shell variable
+# assignments for the perf-plot.sh scripts.
+#
+# License: GPLv3
+#
+
+import shlex
+
+from perfscript import parse_line, parse_header, header_vars
+
+
+def write_env(path, variables):
+    fp = open(path, 'w')
+    for name, value in variables:
+        fp.write('%s=%s\n' % (name, shlex.quote(str(value))))
+    fp.close()
+
+
+class FlowerPhases():
+    def __init__(self, opts, outputs):
+        import flower
+        flower.simple = opts.simple
+        flower.binary = opts.binary
+        flower.full = opts.full
+        flower.rate_window = opts.rate_window
+        flower.rate_ewma = opts.rate_ewma
+        flower.stall_threshold = opts.stall_threshold
+        self.flower = flower
+        self.probe = flower.Probe()
+        self.plots = []
+
+    def wants(self, name):
+        if name.startswith('flower:'):
+            return self.event
+        return None
+
+    def event(self, tid, cpu, ts, name, args):
+        # Named as perf names them for the handlers
+        self.probe.add_point(ts, name.replace(':', '__', 1), tid,
+                             self.flower.parse_fold(args))
+
+    def finish(self, meta):
+        self.probe.finish()
+        self.plots = self.probe.save()
+
+
+class CallAnalysis():
+    def __init__(self, opts, outputs):
+        from calls import Calls
+        import probeset
+        self.outputs = outputs
+        self.calls = Calls(full=opts.full, points=opts.points,
+                           dump_window=opts.dump_window,
+                           size_buckets=opts.size_buckets,
+                           probes=probeset.load(opts.probe_set),
+                           tree_window=opts.tree_window,
+                           rate_window=opts.rate_window,
+                           rate_ewma=opts.rate_ewma,
+                           stall_threshold=opts.stall_threshold)
+
+    def wants(self, name):
+        return self.calls.wants(name)
+
+    def finish(self, meta):
+        calls = self.calls
+        calls.events.meta = meta
+        if not calls.analyze():
+            print('No %s calls found' % calls.tc_new)
+            return
+        if 'calls' in self.outputs:
+            calls.write_calls()
+        if 'dumps' in self.outputs:
+            calls.write_dumps()
+        if 'tree' in self.outputs:
+            calls.write_tree()
+        write_env('fl_change-summary.env', calls.summary())
+
+
+class CTLatency():
+    def __init__(self, opts, outputs):
+        from ctoffload import CTOffload
+        self.offloads = CTOffload(opts.window, opts.ttl, binary=opts.binary,
+                                  burst_min=opts.burst)
+        self.opened = False
+
+    def wants(self, name):
+        handle = self.offloads.handler(name)
+        if handle is not None and not self.opened:
+            self.offloads.open()
+            self.opened = True
+        return handle
+
+    def finish(self, meta):
+        if self.opened:
+            self.offloads.finish()
+
+
+class OffCPU():
+    def __init__(self, opts, outputs):
+        from offcpu import SchedLatency
+        import probeset
+        self.sched = SchedLatency(probeset.load(opts.probe_set))
+        self.plots = []
+
+    def wants(self, name):
+        return self.sched.handler(name)
+
+    def finish(self, meta):
+        self.plots = self.sched.finish()
+
+
+# name -> analyzer class, and the output of it that the name stands for
+ANALYZERS = {
+    'phases': (FlowerPhases, None),
+    'calls': (CallAnalysis, 'calls'),
+    'dumps': (CallAnalysis, 'dumps'),
+    'tree': (CallAnalysis, 'tree'),
+    'ct': (CTLatency, None),
+    'offcpu': (OffCPU, None),
+}
+
+
+class Pipeline():
+    def __init__(self, names, opts):
+        # One analyzer per class, knowing all the outputs wanted out of it
+        outputs = { }
+        for name in names:
+            cls, output = ANALYZERS[name]
+            outputs.setdefault(cls, []).append(output)
+        self.analyzers = [cls(opts, wanted) for cls, wanted in outputs.items()]
+        self.used = set()
+        self.handlers = { }
+        self.meta = { }
+
+    def handlers_for(self, name):
+        handlers = []
+        for analyzer in self.analyzers:
+            handle = analyzer.wants(name)
+            if handle is not None:
+                handlers.append(handle)
+                self.used.add(analyzer)
+        self.handlers[name] = handlers
+        return handlers
+
+    def feed(self, lines):
+        """Handles perf script --ns --header output lines."""
+        meta = self.meta
+
+        def samples():
+            for line in lines:
+                sample = parse_line(line)
+                if sample is None:
+                    header = parse_header(line)
+                    if header is not None:
+                        meta.setdefault(*header)
+                    continue
+                yield sample
+        self.feed_samples(samples())
+
+    def feed_samples(self, samples, meta=None):
+        """Handles (tid, cpu, ts, name, args) samples, as
+        perfdata.PerfData.samples() yields them, with meta as the header."""
+        handlers = self.handlers
+        if meta:
+            for item in meta.items():
+                self.meta.setdefault(*item)
+        for sample in samples:
+            try:
+                wanted = handlers[sample[3]]
+            except KeyError:
+                wanted = self.handlers_for(sample[3])
+            for handle in wanted:
+                handle(*sample)
+
+    def finish(self):
+        """Writes the outputs, and returns the analyzers that had events."""
+        write_env('perf-header.env', header_vars(self.meta))
+        used = [a for a in self.analyzers if a in self.used]
+        for analyzer in used:
+            analyzer.finish(self.meta)
+        return used
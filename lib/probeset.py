@@ -0,0 +1,64 @@
+#
+# Driver probe sets, as in rate-monitor/probesets/<name>.conf.
+#
+# Each line of a set is:
+#   <module, or - for the kernel> <function> [driver]
+# with '#' comments. rate-monitor/perf-probes.sh -s <name> probes the entry
+# and the return of each function, and the analyzers learn out of the same
+# file which one is the driver entry point, plotted along with fl_change(),
+# and which functions make the call tree.
+#
+# License: GPLv3
+#
+
+import os
+
+SETS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..',
+                        'rate-monitor', 'probesets')
+
+DEFAULT = 'mlx5'
+
+
+class ProbeSetError(Exception):
+    pass
+
+
+class ProbeSet():
+    def __init__(self, name, functions):
+        """functions is a list of (module, function, role)."""
+        self.name = name
+        self.functions = functions
+        self.funcs = tuple([f for m, f, role in functions])
+        drivers = [f for m, f, role in functions if role == 'driver']
+        if not drivers:
+            raise ProbeSetError('%s: no driver function' % name)
+        self.driver = drivers[0]
+
+
+def names():
+    """The probe sets that come with the tools."""
+    return sorted([f[:-5] for f in os.listdir(SETS_DIR)
+                   if f.endswith('.conf')])
+
+
+def load(name=DEFAULT):
+    """Loads a probe set, by its name or out of a file."""
+    path = name
+    if not os.path.exists(path):
+        path = os.path.join(SETS_DIR, name + '.conf')
+        if not os.path.exists(path):
+            raise ProbeSetError('unknown probe set %s, try one of: %s' %
+                                (name, ', '.join(names())))
+
+    functions = []
+    for n, line in enumerate(open(path), 1):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        if len(fields) not in (2, 3) or \
+           (len(fields) == 3 and fields[2] != 'driver'):
+            raise ProbeSetError('%s:%d: expected <module> <function> '
+                                '[driver]' % (path, n))
+        functions.append((fields[0], fields[1],
+                          fields[2] if len(fields) == 3 else None))
+    return ProbeSet(os.path.basename(path).rsplit('.', 1)[0], functions)
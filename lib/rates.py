@@ -0,0 +1,184 @@
+#
+# Call rates per time window, out of the call timestamps.
+#
+# The cumulative average, calls so far over the time so far, hides the
+# slowdowns that come as the table fills, such as rhashtable resizes or the
+# driver waiting on the firmware: once there are many rules, a second
+# without any barely moves it. Here the calls of each series are counted per
+# window instead, with an EWMA on top to follow the trend, and the windows in
+# which the rate drops below a fraction of its median are listed as stalls.
+#
+# Each series is only looked at from its first call to its last one, so that
+# deletes don't stall while the inserts are still going on, and the other way
+# around. The windows of its first and last calls are only partly covered by
+# the series, so they are not taken as stalls either.
+#
+# License: GPLv3
+#
+
+import math
+
+# Where things are in a stall
+STALL_FIRST = 0
+STALL_LAST = 1
+STALL_MIN = 2
+
+# Stalls listed per series by Rates.report(), all of them being in the file
+REPORT_STALLS = 10
+
+
+def window_counts(ts, start, window, n):
+    """Counts the timestamps in each of the n windows from start on."""
+    counts = [0] * n
+    last = n - 1
+    for k in [int((t - start) / window) for t in ts]:
+        counts[min(max(k, 0), last)] += 1
+    return counts
+
+
+def ewma(values, alpha):
+    """Exponentially weighted moving average, starting at the first value."""
+    out = []
+    avg = values[0] if values else 0.0
+    for v in values:
+        avg += alpha * (v - avg)
+        out.append(avg)
+    return out
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if not n:
+        return 0.0
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2
+
+
+def find_stalls(rates, low, first, last):
+    """Returns the runs of windows within [first, last] whose rate is below
+    low, as [ first window, last window, lowest rate ]."""
+    stalls = []
+    stall = None
+    for k in range(first, last + 1):
+        if rates[k] < low:
+            if stall is None:
+                stall = [k, k, rates[k]]
+                stalls.append(stall)
+            else:
+                stall[STALL_LAST] = k
+                stall[STALL_MIN] = min(stall[STALL_MIN], rates[k])
+        else:
+            stall = None
+    return stalls
+
+
+class Series():
+    def __init__(self, name, ts):
+        self.name = name
+        self.ts = ts
+        self.calls = []
+        self.rate = []
+        self.ewma = []
+        self.median = 0.0
+        self.stalls = []
+
+
+class Rates():
+    def __init__(self, window=1.0, tau=5.0, threshold=0.5):
+        """tau is the time constant of the EWMA, in seconds, and threshold
+        the fraction of the median rate below which a window is a stall."""
+        self.window = window
+        self.alpha = 1.0 - math.exp(-window / tau) if tau > 0 else 1.0
+        self.threshold = threshold
+        self.series = []
+        self.start = 0.0
+        self.n = 0
+
+    def add(self, name, ts):
+        """ts are the timestamps of the calls, in any order."""
+        self.series.append(Series(name, ts))
+
+    def compute(self, start=None, end=None):
+        """Counts the calls of all the series over the same windows, from
+        start, or the first call of any of them, up to end, or the last
+        one. Returns False if there were no calls at all."""
+        stamps = [f(s.ts) for s in self.series if len(s.ts)
+                  for f in (min, max)]
+        if not stamps:
+            return False
+        self.start = min(stamps) if start is None else start
+        end = max(stamps) if end is None else end
+        self.n = max(int((end - self.start) / self.window) + 1, 1)
+
+        for s in self.series:
+            counts = window_counts(s.ts, self.start, self.window, self.n)
+            total = 0
+            s.calls = []
+            for c in counts:
+                total += c
+                s.calls.append(total)
+            s.rate = [c / self.window for c in counts]
+            s.ewma = ewma(s.rate, self.alpha)
+            active = [k for k, c in enumerate(counts) if c]
+            if not active:
+                continue
+            first, last = active[0] + 1, active[-1] - 1
+            s.median = median(s.rate[first:last + 1] if first <= last
+                              else s.rate[active[0]:active[-1] + 1])
+            s.stalls = find_stalls(s.rate, s.median * self.threshold,
+                                   first, last)
+        return True
+
+    def write(self, path):
+        """One row per window: its start and, for each series, the calls up
+        to its end, the rate in it and the EWMA of the rate."""
+        fp = open(path, 'w')
+        fp.write('#time\t%s\n' % '\t'.join(
+            ['%s calls\t%s rate\t%s ewma' % (s.name, s.name, s.name)
+             for s in self.series]))
+        for k in range(self.n):
+            row = ['%.6f' % (k * self.window)]
+            for s in self.series:
+                row.append('%d\t%f\t%f' % (s.calls[k], s.rate[k], s.ewma[k]))
+            fp.write('\t'.join(row) + '\n')
+        fp.close()
+
+    def write_stalls(self, path):
+        fp = open(path, 'w')
+        fp.write('#series\tstart\tend\tlowest rate\tmedian rate'
+                 '\tcalls before\n')
+        for s in self.series:
+            for stall in s.stalls:
+                first = stall[STALL_FIRST]
+                fp.write('%s\t%.6f\t%.6f\t%f\t%f\t%d\n' %
+                         (s.name, first * self.window,
+                          (stall[STALL_LAST] + 1) * self.window,
+                          stall[STALL_MIN], s.median,
+                          s.calls[first - 1] if first else 0))
+        fp.close()
+
+    def report(self):
+        lines = []
+        for s in self.series:
+            if not len(s.ts):
+                continue
+            lines.append('%s: median %.1f calls/s per %gs window, %d windows '
+                         'below %d%% of it' %
+                         (s.name, s.median, self.window,
+                          sum([st[STALL_LAST] - st[STALL_FIRST] + 1
+                               for st in s.stalls]),
+                          self.threshold * 100))
+            for stall in s.stalls[:REPORT_STALLS]:
+                lines.append('  %.3f-%.3fs: %.1f calls/s at the lowest' %
+                             (stall[STALL_FIRST] * self.window,
+                              (stall[STALL_LAST] + 1) * self.window,
+                              stall[STALL_MIN]))
+            if len(s.stalls) > REPORT_STALLS:
+                lines.append('  and %d more, see the stalls file' %
+                             (len(s.stalls) - REPORT_STALLS))
+        return lines
+
+    def stalls(self):
+        return sum([len(s.stalls) for s in self.series])
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+#
+# Parses 'perf script --ns' output once and writes the data files plotted by
+# perf-plot.sh:
+#   fl_change-rate.dat           fl_change() call timestamps
+#   fl_change-call_duration.dat  entry and return timestamps of fl_change,
+#                                tc_new_tfilter (or tc_ctl_tfilter) and
+#                                mlx5e_configure_flower, one block each
+#   fl_change-stats.dat          ditto for tc_dump_tfilter
+# and what is actually plotted, with the rates and cumulative times already
+# computed, reduced to a few thousand points per curve by lib/downsample.py
+# (unless --full):
+#   fl_change-rate-plot.dat           call number, time since the first call
+#                                     and average rate up to it
+#   fl_change-call_duration-plot.dat  call number, duration and cumulative
+#                                     duration, one block per function
+#   fl_change-stats-plot.dat          time since the test start, duration
+#                                     and cumulative duration
+# and, as the accumulated rate hides slowdowns once there are many rules:
+#   fl_change-rates.dat               per --rate-window: time since the test
+#                                     start and, for the fl_change() inserts,
+#                                     the fl_delete() deletes and the driver
+#                                     calls, the calls so far, the rate and
+#                                     its EWMA (--rate-ewma time constant)
+#   fl_change-stalls.dat              the windows where any of those rates
+#                                     was below --stall-threshold times its
+#                                     median, see lib/rates.py
+# and, to tell what the stats dumps cost to the inserts:
+#   fl_change-dumps.dat               per --dump-window: time since the test
+#                                     start, rules in the table, insert rate,
+#                                     dumps/s, dump busy time per second and
+#                                     average dump duration
+#   fl_change-dumps-cost.dat          per table size bucket: the correlation
+#                                     of the insert rate with the dump busy
+#                                     time and with the dump rate over the
+#                                     windows, and the linear fit of the
+#                                     insert rate on the dump rate, as inserts/s
+#                                     lost per dump/s and inserts/s without
+#                                     dumps
+# and the call tree of all the probed functions, see lib/calltree.py:
+#   calltree.dat                      per call path: calls, inclusive, self
+#                                     and longest time, and the self time
+#                                     per rule
+#   calltree-windows.dat              the self time per rule of each path,
+#                                     per --tree-window
+#   calltree.folded                   the self time of each path, for
+#                                     flamegraph.pl
+# The driver functions are the ones in the probe set given to
+# perf-probes.sh, mlx5 by default.
+# The fit needs windows with and without dumps at each table size, which
+# stats-dump.sh -P gives.
+#
+# The text is parsed in large chunks into columns (tid, cpu, timestamp and
+# probe), and everything else is computed from these, by lib/calls.py. Calls
+# are matched per thread, nested ones included, and with big captures that
+# work is split by thread among a pool of processes. The same files can be
+# written along with the outputs of the other tools, out of a single decode
+# of the capture, by ../analyze.py.
+#
+# Usage:
+#   # ./perf-analyze.py [-i perf.data | -t perf-script.txt] [-j jobs] [--shell]
+#         [--full | --points N] [--rate-window S] [--rate-ewma S]
+#         [--stall-threshold F] [--dump-window S] [--size-buckets N]
+#         [--probe-set name] [--tree-window S] [--no-cache]
+#
+# By default it reads perf.data itself, with lib/perfdata.py, and only runs
+# 'perf script --ns --header' on it for what that can't read. Either way,
+# the decoded events are kept in perf.data.cache for the next runs, such as
+# re-plotting with other titles, see lib/eventcache.py. With
+# --shell, the summary, which includes the kernel and CPUs the capture was
+# taken on, is printed as shell variable assignments, which perf-plot.sh
+# evals.
+#
+# License: GPLv2
+
+import argparse
+import os
+import shlex
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'lib'))
+import downsample
+import eventcache
+import perfscript
+import probeset
+from calls import Calls
+from perfdata import PerfDataError
+
+
+def load(args):
+    if args.text:
+        return perfscript.parse_file(args.text, jobs=args.jobs)
+
+    try:
+        return eventcache.events(args.input, cache=not args.no_cache)
+    except PerfDataError as err:
+        sys.exit(str(err))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Parse perf script output for perf-plot.sh')
+    parser.add_argument('-i', '--input', default='perf.data',
+                        help='perf.data file to read')
+    parser.add_argument('-t', '--text',
+                        help='use this perf script --ns output instead, - for stdin')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of processes to use on big captures')
+    parser.add_argument('--shell', action='store_true',
+                        help='print the summary as shell variables')
+    parser.add_argument('--full', action='store_true',
+                        help='plot all points, instead of a reduced set')
+    parser.add_argument('--points', type=int, default=downsample.POINTS,
+                        help='x buckets per curve, when reducing them')
+    parser.add_argument('--rate-window', type=float, default=1.0,
+                        help='window for the call rates, in seconds')
+    parser.add_argument('--rate-ewma', type=float, default=5.0,
+                        help='time constant of the rate EWMA, in seconds')
+    parser.add_argument('--stall-threshold', type=float, default=0.5,
+                        help='fraction of the median rate below which a '
+                             'window is a stall')
+    parser.add_argument('--dump-window', type=float, default=0.1,
+                        help='window for the dump cost, in seconds')
+    parser.add_argument('--size-buckets', type=int, default=10,
+                        help='table size buckets for the dump cost')
+    parser.add_argument('--probe-set', default=probeset.DEFAULT,
+                        help='driver probe set, as perf-probes.sh -s was '
+                             'given')
+    parser.add_argument('--tree-window', type=float, default=1.0,
+                        help='window for the call tree self time, in seconds')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='decode perf.data again, without its cache')
+    args = parser.parse_args()
+
+    try:
+        probes = probeset.load(args.probe_set)
+    except probeset.ProbeSetError as err:
+        parser.error(err)
+
+    calls = Calls(load(args), args.jobs, args.full, args.points,
+                  args.dump_window, args.size_buckets, probes,
+                  args.tree_window, args.rate_window, args.rate_ewma,
+                  args.stall_threshold)
+    if not calls.analyze():
+        sys.exit('No %s calls found' % calls.tc_new)
+    calls.write_calls()
+    calls.write_dumps()
+    calls.write_tree()
+
+    for name, value in calls.summary():
+        if args.shell:
+            print('%s=%s' % (name, shlex.quote(str(value))))
+        else:
+            print('%s: %s' % (name, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,58 +1,71 @@
 #!/bin/bash
 #
 # Plots:
-#  - fl_change() calls over time and its rate.
+#  - fl_change() calls over time and its rate, accumulated and per window
+#  - insert, delete and driver call rates per window over time, and the
+#    windows where they stalled
 #  - time spent on some key functions and cumulative times
 #  - ditto for stats polling
+#  - insert rate x stats dump load, and the inserts/s each dump/s costs as
+#    the rule table grows
+#  - self time per rule of each probed function, per call path, over time
 #
 # The script is smart enough to track task CPU changes, which may happen
 # especially if rtnl_lock is not held by rtnetlink anymore.
 #
 # Usage:
 # 1. setup perf probes:
-#    # ./perf-probes.sh
+#    # ./perf-probes.sh [-s probe set]
+#    with the probe set of the driver, mlx5 by default, see probesets/
 # 2. record it
 #    # perf record -e probe:* -aR -- sleep 300
 #    # <start the test>
 #    # <stop perf record when the test finishes>
+#    or, with a controlled stats dump load on top of the test:
+#    # perf record -e probe:* -aR -- ./stats-dump.sh -i <iface> -r 50 -P 2:2 \
+#          -- <test>
+#    adding '-e sched:sched_switch -e sched:sched_wakeup' to either, for
+#    ../lib/offcpu.py to tell how much of each call was spent on CPU,
+#    waiting for a CPU or blocked
 # 3. plot it
-#    # ./perf-plot.sh
+#    # ./perf-plot.sh [-F] [-s] [-p probe set] [title notes]
+#    -F plots all points, instead of a few thousand per curve
+#    -s plots what ../analyze.py already wrote, along with the outputs of
+#       the other tools, instead of parsing perf.data again
+#    Either way, the decoded perf.data is cached in perf.data.cache, so
+#    plotting it again is quick.
+#    -p the probe set given to perf-probes.sh, if not mlx5
 # 4. check output at fl_change-*.png
 #
 # Author: Marcelo Ricardo Leitner  2019
 # License: GPLv2
 
-script=$(perf script --ns)
-if grep -qw tc_new_tfilter <<<"$script"; then
-	tc_new=tc_new_tfilter
-else
-	tc_new=tc_ctl_tfilter
-fi
+mydir=$(dirname "$(readlink -f "$0")")
 
-#
-# General stats
-#
-start_time=$(grep probe:$tc_new: <<<"$script" | head -n1 | awk '{print $4}' | sed s/://)
-end_time=$(grep probe:${tc_new}__return: <<<"$script" | tail -n1 | awk '{print $4}' | sed s/://)
-
-# Carve out
-#    revalidator12  5079 [028] 16126.431019:                probe:tc_dump_tfilter: (ffffffff8c554490)
-# Into
-#    5079 16126.431019 tc_dump_tfilter
-# Restrict it to the test time, and sort it by process (so that its calls are
-# serialized)
-pscript=$(awk '{ sub(":$", "", $4); sub("[^:]+:", "", $5); sub(":$", "", $5); print $2, $4, $5 }' <<<"$script" |\
-	sed -n "/ $start_time /,/ $end_time /{p}" |\
-	sort
-	)
-#echo "$pscript" > fl_change.dbg
+full=
+analyzed=
+probeset=mlx5
+while [ "$1" = "-F" -o "$1" = "-s" -o "$1" = "-p" ]; do
+	[ "$1" = "-F" ] && full=--full
+	[ "$1" = "-s" ] && analyzed=1
+	if [ "$1" = "-p" ]; then
+		probeset="$2"
+		shift
+	fi
+	shift
+done
 
-inserts=$(grep -cw fl_change <<<"$pscript")
-deletes=$(grep -cw fl_delete <<<"$pscript")
-changes=$(grep -cw mlx5e_configure_flower <<<"$pscript")
-kernel=$(perf script --header-only | sed -n 's/.*os release : //p')
-ncpu=$(perf script --header-only | sed -n 's/.*nrcpus avail : //p')
-cpumodel=$(perf script --header-only | sed -n 's/.*cpudesc : //p')
+# Parse perf script output once. This writes all the .dat files below and
+# gives us tc_new, start_time, end_time, inserts, deletes, the driver
+# function and its calls (changes), the dumps and the kernel, ncpu and
+# cpumodel of the capture.
+if [ -n "$analyzed" ]; then
+	. ./fl_change-summary.env || exit 1
+else
+	summary=$("$mydir/perf-analyze.py" --shell $full \
+		--probe-set "$probeset") || exit 1
+	eval "$summary"
+fi
 
 echo "Start time: $start_time"
 echo "End time: $end_time"
@@ -62,9 +75,12 @@ echo "Avg insert rate: $avginsert"
 echo "Avg delete rate: $(echo "$deletes/($end_time-$start_time)" | bc)"
 avgchange=$(echo "$changes/($end_time-$start_time)" | bc)
 echo "Avg change rate: $avgchange"
+echo "Rate stalls: $stalls (see fl_change-stalls.dat)"
+echo "Stats dumps: $dumps (insert rate x dump busy time correlation: $dump_corr)"
 echo "Kernel: $kernel"
 
 # Common title across the graphs
+driver="${driver:-mlx5e_configure_flower}"
 title="${kernel//_/\\\\_}\n$cpumodel - $ncpu CPUs${@:+\\n}${@//_/\\\\_}"
 
 
@@ -74,9 +90,6 @@ title="${kernel//_/\\\\_}\n$cpumodel - $ncpu CPUs${@:+\\n}${@//_/\\\\_}"
 rate()
 {
 	rate_file="fl_change-rate"
-	awk '/fl_change$/{print $2}' <<<"$pscript" | sort -n > $rate_file.dat
-
-	first=$(head -n1 $rate_file.dat)
 
 	cat > $rate_file.plt <<-_EOF_
 	set terminal pngcairo size 1024,768 dashed
@@ -89,54 +102,52 @@ rate()
 	set y2tics
 
 	plot \\
-	     '$rate_file.dat' using (\$1-$first) title "Time" with lines, \\
-	     '$rate_file.dat' every ::1 using :(\$0/(\$1-$first) < $((avginsert*2)) ? \$0/(\$1-$first) : 0) \\
-		title 'fl\\_change rate' axes x1y2 with lines
+	     '$rate_file-plot.dat' using 1:2 title "Time" with lines, \\
+	     '$rate_file-plot.dat' every ::1 using 1:3 \\
+		title 'fl\\_change acc rate' axes x1y2 with lines, \\
+	     'fl_change-rates.dat' using 2:3 \\
+		title 'fl\\_change rate per ${rate_window}s' axes x1y2 with steps, \\
+	     'fl_change-rates.dat' using 2:4 \\
+		title 'fl\\_change rate EWMA' axes x1y2 with lines
 	_EOF_
 
 	gnuplot $rate_file.plt
 }
 
 
+#
+# Call rates per window over time, with the stalls
+#
+rates()
+{
+	rates_file="fl_change-rates"
+	cat > $rates_file.plt <<-_EOF_
+	set terminal pngcairo size 1024,768 dashed
+	set output "$rates_file.png"
+	set title "Flower rule install performance\\nCall rates per ${rate_window}s window\\n$title"
+	set xlabel "Test time (s)"
+	set ylabel "Calls/s"
+
+	plot \\
+	     '$rates_file.dat' using 1:3 title 'fl\\_change' with steps, \\
+	     '$rates_file.dat' using 1:4 title 'fl\\_change EWMA' with lines, \\
+	     '$rates_file.dat' using 1:6 title 'fl\\_delete' with steps, \\
+	     '$rates_file.dat' using 1:7 title 'fl\\_delete EWMA' with lines, \\
+	     '$rates_file.dat' using 1:9 title '${driver//_/\\_}' with steps, \\
+	     '$rates_file.dat' using 1:10 title '${driver//_/\\_} EWMA' with lines, \\
+	     'fl_change-stalls.dat' using 2:4 title 'stalls' with points pt 7
+	_EOF_
+
+	gnuplot $rates_file.plt
+}
+
+
 #
 # Call durations
 #
 call_duration()
 {
 	duration_file="fl_change-call_duration"
-	#perf script | grep -e probe:fl_change: -e probe:fl_change__return: | awk '{print $4}' |\
-	#	sed s/:// | sed -e 'N;s/\n/ /' > fl_change.dat
-	# Serialize per process, and then per timestamp
-	# The regexp only prints the entry point if it finds a corresponding exit point
-	sed -n "/fl_change$/h;/fl_change__return/{x;p;x;p}" <<<"$pscript" |\
-		awk '{ print $2 }' |\
-		sed -e 'N;s/\n/ /' |\
-		sort -n > $duration_file.dat
-
-	echo >> $duration_file.dat
-	echo >> $duration_file.dat
-
-	#perf script | grep -e probe:$tc_new: -e probe:${tc_new}__return: | awk '{print $4}' |\
-	#	sed s/:// | sed -e 'N;s/\n/ /' >> fl_change.dat
-	# Serialize per process, and then per timestamp
-	# The regexp only prints the entry point if it finds a corresponding exit point
-	sed -n "/${tc_new}$/h;/${tc_new}__return/{x;p;x;p}" <<<"$pscript" |\
-		awk '{ print $2 }' |\
-		sed -e 'N;s/\n/ /' |\
-		sort -n >> $duration_file.dat
-
-	echo >> $duration_file.dat
-	echo >> $duration_file.dat
-
-	#perf script | grep -e probe:mlx5e_configure_flower: -e probe:mlx5e_configure_flower__return: | awk '{print $4}' |\
-	#	sed s/:// | sed -e 'N;s/\n/ /' >> fl_change.dat
-	# Serialize per process, and then per timestamp
-	# The regexp only prints the entry point if it finds a corresponding exit point
-	sed -n "/mlx5e_configure_flower$/h;/mlx5e_configure_flower__return/{x;p;x;p}" <<<"$pscript" |\
-		awk '{ print $2 }' |\
-		sed -e 'N;s/\n/ /' |\
-		sort -n >> $duration_file.dat
-
 	cat > $duration_file.plt <<-_EOF_
 	set terminal pngcairo size 1024,768 dashed
 	set output "$duration_file.png"
@@ -148,12 +159,12 @@ call_duration()
 	set y2tics
 
 	plot \\
-	     '$duration_file.dat' index 0 using (\$2-\$1) title 'fl\\_change call duration' with lines, \\
-	     '$duration_file.dat' index 1 using (\$2-\$1) title '${tc_new//_/\\_} call duration' with lines, \\
-	     '$duration_file.dat' index 2 using (\$2-\$1) title 'mlx5e\\_configure\\_flower call duration' with lines, \\
-	     '$duration_file.dat' index 0 using (\$2-\$1) title 'fl\\_change cumulative time' axes x1y2 with lines smooth cumulative, \\
-	     '$duration_file.dat' index 1 using (\$2-\$1) title '${tc_new//_/\\_} cumulative time' axes x1y2 with lines smooth cumulative, \\
-	     '$duration_file.dat' index 2 using (\$2-\$1) title 'mlx5e\\_configure\\_flower cumulative time' axes x1y2 with lines smooth cumulative
+	     '$duration_file-plot.dat' index 0 using 1:2 title 'fl\\_change call duration' with lines, \\
+	     '$duration_file-plot.dat' index 1 using 1:2 title '${tc_new//_/\\_} call duration' with lines, \\
+	     '$duration_file-plot.dat' index 2 using 1:2 title '${driver//_/\\_} call duration' with lines, \\
+	     '$duration_file-plot.dat' index 0 using 1:3 title 'fl\\_change cumulative time' axes x1y2 with lines, \\
+	     '$duration_file-plot.dat' index 1 using 1:3 title '${tc_new//_/\\_} cumulative time' axes x1y2 with lines, \\
+	     '$duration_file-plot.dat' index 2 using 1:3 title '${driver//_/\\_} cumulative time' axes x1y2 with lines
 	_EOF_
 
 	gnuplot $duration_file.plt
@@ -166,17 +177,6 @@ call_duration()
 stats()
 {
 	stats_file="fl_change-stats"
-	#sed -n "/ $start_time:/,/ $end_time:/{/probe:tc_dump_tfilter/p}" <<<"$script" |\
-	#	awk '{print $4}' | sed s/:// | sed -e 'N;s/\n/ /' > fl_change.dat
-	# Serialize per process, and then per timestamp
-	# The regexp only prints the entry point if it finds a corresponding exit point
-	sed -n '/tc_dump_tfilter$/h;/tc_dump_tfilter__return/{x;p;x;p}' <<<"$pscript" |\
-		sort |\
-		awk '{ print $2 }' |\
-		sed -e 'N;s/\n/ /' |\
-		sort -n \
-		> $stats_file.dat
-
 	cat > $stats_file.plt <<-_EOF_
 	set terminal pngcairo size 1024,768 dashed
 	set output "$stats_file.png"
@@ -188,8 +188,8 @@ stats()
 	set y2tics
 
 	plot \\
-	     '$stats_file.dat' index 0 using (\$1-$start_time):(\$2-\$1) title 'tc\\_dump\\_tfilter call duration' with points, \\
-	     '$stats_file.dat' index 0 using (\$1-$start_time):(\$2-\$1) title "cumulative call duration" axes x1y2 with lines smooth cumulative
+	     '$stats_file-plot.dat' index 0 using 1:2 title 'tc\\_dump\\_tfilter call duration' with points, \\
+	     '$stats_file-plot.dat' index 0 using 1:3 title "cumulative call duration" axes x1y2 with lines
 	_EOF_
 
 	if grep -q . $stats_file.dat; then
@@ -200,7 +200,82 @@ stats()
 }
 
 
+#
+# What stats dumps cost to the inserts
+#
+dumps()
+{
+	dumps_file="fl_change-dumps"
+	cat > $dumps_file.plt <<-_EOF_
+	set terminal pngcairo size 1024,1024 dashed
+	set output "$dumps_file.png"
+	set multiplot layout 2,1 title "Stats dumps impact on the insert rate\n$title"
+
+	set xlabel "Test time (s)"
+	set ylabel "Insert rate (flows/s)"
+	set y2label "Dump busy time (s/s)"
+	set ytics nomirror
+	set y2tics
+	plot \
+	     '$dumps_file.dat' using 1:3 title 'fl\_change rate' with lines, \
+	     '$dumps_file.dat' using 1:5 title 'tc\_dump\_tfilter busy time' axes x1y2 with lines
+
+	set xlabel "Rules in the table"
+	set ylabel "Inserts/s lost per dump/s"
+	set y2label "Correlation"
+	set y2range [-1:1]
+	plot \
+	     '$dumps_file-cost.dat' using 1:5 title 'insert rate cost' with linespoints, \
+	     '$dumps_file-cost.dat' using 1:3 title 'r(dump busy time, insert rate)' axes x1y2 with linespoints, \
+	     '$dumps_file-cost.dat' using 1:4 title 'r(dump rate, insert rate)' axes x1y2 with linespoints
+	unset multiplot
+	_EOF_
+
+	if grep -q '^[^#]' $dumps_file.dat; then
+		gnuplot $dumps_file.plt
+	else
+		rm -f $dumps_file.png
+	fi
+}
+
+
+#
+# Where the time of each rule goes, per function
+#
+calltree()
+{
+	tree_file="calltree"
+	cat > $tree_file.plt <<-_EOF_
+	set terminal pngcairo size 1024,1024 dashed
+	set output "$tree_file.png"
+	set multiplot layout 2,1 title "Self time per call path, per call of its outermost function\n$title"
+
+	set key outside right top noenhanced
+	set xlabel "Test time (s)"
+	set ylabel "Self time per outermost call (us)"
+	plot for [i=2:*] '$tree_file-windows.dat' using 1:i title columnhead(i) with lines
+
+	set style data histograms
+	set style fill solid border -1
+	set xtics rotate by -30 noenhanced
+	set xlabel ""
+	unset key
+	plot '$tree_file.dat' using 5:xtic(6)
+	unset multiplot
+	_EOF_
+
+	if [ -f $tree_file.dat ] && grep -q '^[^#]' $tree_file.dat; then
+		gnuplot $tree_file.plt
+	else
+		rm -f $tree_file.png
+	fi
+}
+
+
 rate &
+rates &
 call_duration &
 stats &
+dumps &
+calltree &
 wait
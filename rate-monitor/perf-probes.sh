@@ -1,16 +1,55 @@
-#!/bin/bash -ex
+#!/bin/bash -e
 #
 # Adds the perf probes for perf-plot.sh
 #
+# Usage:
+#   # ./perf-probes.sh [-s probe set]
+#   The probe set is the name of one in probesets/, mlx5 by default, or a
+#   file like them, with the driver functions to probe. See
+#   probesets/mlx5.conf for the format.
+#
+
+mydir=$(dirname "$(readlink -f "$0")")
+probeset=mlx5
+
+usage()
+{
+	echo "Usage: $0 [-s probe set]"
+	echo "where probe set is one of: $(cd "$mydir/probesets" && ls *.conf | sed 's/\.conf$//' | xargs)"
+	echo "      or a file like them."
+	exit 1
+}
+
+while [ $# -ge 1 ]; do
+	opt="$1"
+	shift
+	case "$opt" in
+	-s)
+		probeset="$1"
+		shift
+		;;
+	*)
+		echo "Invalid argument '$opt'."
+		usage
+	esac
+done
+
+setfile="$probeset"
+if [ ! -f "$setfile" ]; then
+	setfile="$mydir/probesets/$probeset.conf"
+fi
+if [ ! -f "$setfile" ]; then
+	echo "Probe set '$probeset' not found."
+	usage
+fi
+
+set -x
 
 perf probe -d probe:* || :
 perf probe -m cls_flower -a fl_change
 perf probe -m cls_flower -a fl_change%return
 perf probe -m cls_flower -a fl_delete
 perf probe -m cls_flower -a fl_delete%return
-# Switch to other NICs here if you wish, and on perf-plot.sh
-perf probe -m mlx5_core -a mlx5e_configure_flower
-perf probe -m mlx5_core -a mlx5e_configure_flower%return
 perf probe -a tc_dump_tfilter
 perf probe -a tc_dump_tfilter%return
 
@@ -22,3 +61,15 @@ else
 	perf probe -a tc_del_tfilter
 	perf probe -a tc_del_tfilter%return
 fi
+
+# The driver, and whatever else the probe set has
+sed 's/#.*//' "$setfile" | while read module func role; do
+	[ -z "$func" ] && continue
+	if [ "$module" = - ]; then
+		perf probe -a $func
+		perf probe -a $func%return
+	else
+		perf probe -m $module -a $func
+		perf probe -m $module -a $func%return
+	fi
+done
@@ -0,0 +1,138 @@
+#!/bin/bash
+#
+# Dumps the filters of an interface, with stats, as OVS revalidators would,
+# while a command runs. This puts a known tc_dump_tfilter load on top of the
+# install workload, for perf-analyze.py to tell how much insert throughput
+# each dump/s costs.
+#
+# Usage:
+#   # ./stats-dump.sh -i <interface> [-r rate] [-c dumpers] [-P on:off] \
+#         [-- command]
+#   rate is the dumps per second of all dumpers together, 0 for back to back
+#   (default 10). dumpers is how many dump at once (default 1). With -P,
+#   dumping goes on for 'on' seconds and stops for 'off' seconds, over and
+#   over, so that the insert rate is seen with and without dumps at each
+#   table size. Without a command, it dumps until interrupted.
+#
+# Along with perf-probes.sh and perf record:
+#   # perf record -e probe:* -aR -- ./stats-dump.sh -i eth0 -r 50 -c 2 \
+#         -P 2:2 -- tc -b tc-rules.batch
+#
+# License: GPLv2
+
+iface=
+rate=10
+dumpers=1
+period=
+
+usage()
+{
+	echo "Usage: $0 -i <interface> [-r rate] [-c dumpers] [-P on:off] [-- command]"
+	exit 1
+}
+
+while [ $# -ge 1 ]; do
+	opt="$1"
+	shift
+	case "$opt" in
+	-i)
+		iface="$1"
+		shift
+		;;
+	-r)
+		rate="$1"
+		shift
+		;;
+	-c)
+		dumpers="$1"
+		shift
+		if ! [[ "$dumpers" =~ ^[1-9][0-9]*$ ]]; then
+			echo "Invalid number of dumpers '$dumpers'."
+			usage
+		fi
+		;;
+	-P)
+		period="$1"
+		shift
+		if ! [[ "$period" =~ ^[0-9.]+:[0-9.]+$ ]]; then
+			echo "Invalid period '$period'."
+			usage
+		fi
+		;;
+	--)
+		break
+		;;
+	*)
+		echo "Invalid argument '$opt'."
+		usage
+	esac
+done
+
+if [ -z "$iface" ]; then
+	echo "You must specify one interface."
+	usage
+fi
+
+# Each dumper sleeps this long between dumps
+interval=$(awk -v r=$rate -v d=$dumpers 'BEGIN { print (r > 0 ? d / r : 0) }')
+
+dumper()
+{
+	while :; do
+		tc -s filter show dev $iface ingress > /dev/null
+		sleep $interval
+	done
+}
+
+dump_on()
+{
+	pids=
+	for ((d = 0; d < dumpers; d++)); do
+		dumper &
+		pids+=" $!"
+	done
+}
+
+dump_off()
+{
+	[ -n "$pids" ] && kill $pids 2> /dev/null
+	wait $pids 2> /dev/null
+	pids=
+}
+
+# Sleeps without holding off the traps
+pause()
+{
+	sleep $1 &
+	wait $!
+}
+
+dump()
+{
+	trap 'dump_off; exit 0' INT TERM
+	if [ -z "$period" ]; then
+		dump_on
+		wait
+		return
+	fi
+
+	while :; do
+		dump_on
+		pause ${period%:*}
+		dump_off
+		pause ${period#*:}
+	done
+}
+
+if [ $# -eq 0 ]; then
+	dump
+	exit 0
+fi
+
+dump &
+control=$!
+"$@"
+ret=$?
+kill $control
+wait $control 2> /dev/null
+exit $ret
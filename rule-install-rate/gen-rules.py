@@ -0,0 +1,326 @@
+#!/usr/bin/python3
+#
+# Generate a tc batch file with flower rules, for run.sh.
+#
+# Rules match on src/dst mac and src/dst ip. Each of these fields may be
+# masked with a prefix length, and every combination of prefix lengths is a
+# different flower mask. With --masks, the rules are spread over that many
+# masks, taken in order from the combinations of --mac-prefixes and
+# --prefixes (ip prefix lengths varying first). The first mask always
+# matches all bits of the fields listed first in these options.
+#
+# Within a mask, each rule gets a distinct key. Keys are sequential by
+# default, or scrambled with --seed. Rule i gets handle i + 1. The same
+# parameters always produce the same rules, and they are saved along with the
+# batch file, at <file>.params, so that --if-changed can skip the generation
+# when nothing changed.
+#
+# With --op, the batch works on the rules that the same parameters add:
+#   add:     adds them (default)
+#   delete:  deletes them, by handle
+#   replace: replaces each one with the same match and --replace-action
+#   mixed:   adds them, and after each add deletes one of the rules added so
+#            far with probability --ratio
+#
+# Usage:
+#   # ./gen-rules.py -i <interface> -n <count> [-o tc-rules.batch] \
+#         [--masks M] [--prefixes 32-16] [--mac-prefixes 48-24] \
+#         [--mask-dist uniform|zipf] [--seed S] [--actions drop:9,pass:1] \
+#         [--op add|delete|replace|mixed] [--ratio 0.5]
+#
+# License: GPLv3
+#
+
+import argparse
+import os
+import random
+import sys
+from itertools import product
+
+OPS = ('add', 'delete', 'replace', 'mixed')
+
+# Rules formatted and written at once
+WRITE_CHUNK = 65536
+
+SRC_IP = 56 << 24
+DST_IP = 55 << 24
+SRC_MAC = 0xec13db << 24
+DST_MAC = 0xec14c2 << 24
+
+# Bits of the fields above that are fixed, and so never part of a key
+IP_FIXED = 8
+MAC_FIXED = 24
+
+# Text of 16 bits halves of ip and mac addresses, built on first use
+IP16 = []
+MAC16 = []
+
+
+def prefix_list(text, longest):
+    """Parses '32,24,16' or '32-16' into a list of prefix lengths."""
+    prefixes = []
+    for item in text.split(','):
+        if '-' in item:
+            a, b = [int(x) for x in item.split('-')]
+            step = -1 if a > b else 1
+            prefixes.extend(range(a, b + step, step))
+        else:
+            prefixes.append(int(item))
+    for p in prefixes:
+        if p < 0 or p > longest:
+            raise ValueError('invalid prefix length %d' % p)
+    return prefixes
+
+
+def weighted_list(text):
+    """Parses 'drop:9,pass:1' into ([ 'drop', 'pass' ], [ 9, 1 ])."""
+    items = []
+    weights = []
+    for item in text.split(','):
+        name, _, weight = item.rpartition(':')
+        if not name or not weight.replace('.', '', 1).isdigit():
+            name, weight = item, '1'
+        items.append(name)
+        weights.append(float(weight))
+    return items, weights
+
+
+def build_tables():
+    octets = ['%d' % i for i in range(256)]
+    hexa = ['%02x' % i for i in range(256)]
+    IP16.extend([a + '.' + b for a in octets for b in octets])
+    MAC16.extend([a + ':' + b for a in hexa for b in hexa])
+
+
+class Mask():
+    """Prefix lengths of src_mac, dst_mac, src_ip and dst_ip, and how key
+    bits are laid out in these fields."""
+
+    def __init__(self, prefixes):
+        self.prefixes = prefixes
+        smac, dmac, sip, dip = prefixes
+        # Variable bits of each field, and the shift to put them in place
+        self.fields = [
+            (max(smac - MAC_FIXED, 0), 48 - smac),
+            (max(dmac - MAC_FIXED, 0), 48 - dmac),
+            (max(sip - IP_FIXED, 0), 32 - sip),
+            (max(dip - IP_FIXED, 0), 32 - dip),
+        ]
+        self.bits = sum([bits for bits, shift in self.fields])
+        # bits, mask and shift of each field, flattened
+        self.layout = []
+        for bits, shift in self.fields:
+            self.layout.extend((bits, (1 << bits) - 1, shift))
+        self.suffix = ['' if smac == 48 else '/%d' % smac,
+                       '' if dmac == 48 else '/%d' % dmac,
+                       '' if sip == 32 else '/%d' % sip,
+                       '' if dip == 32 else '/%d' % dip]
+
+
+def scrambler(bits, rng):
+    """Parameters of a bijection over [0, 2^bits), so that scrambled keys
+    stay unique: key = ((key ^ xor) * mul + add) & mask; key ^= key >> shift
+    """
+    mask = (1 << bits) - 1
+    width = max(bits, 1)
+    return (rng.getrandbits(width) & mask, rng.getrandbits(width) | 1,
+            rng.getrandbits(width), mask, max(bits // 2, 1))
+
+
+def build_masks(args):
+    ip_prefixes = prefix_list(args.prefixes, 32)
+    mac_prefixes = prefix_list(args.mac_prefixes, 48)
+    masks = []
+    for p in product(mac_prefixes, mac_prefixes, ip_prefixes, ip_prefixes):
+        masks.append(Mask(p))
+        if len(masks) == args.masks:
+            return masks
+    sys.exit('Only %d masks are possible with these prefix lengths, '
+             'not %d.' % (len(masks), args.masks))
+
+
+def mask_chooser(args, rng):
+    """Returns a function giving the mask index for n rules at once."""
+    if args.mask_dist == 'uniform':
+        state = [0]
+
+        def choose(n):
+            first = state[0]
+            state[0] += n
+            return [i % args.masks for i in range(first, first + n)]
+        return choose
+
+    weights = [1.0 / (i + 1) ** args.zipf_s for i in range(args.masks)]
+    population = range(args.masks)
+
+    def choose(n):
+        return rng.choices(population, weights, k=n)
+    return choose
+
+
+def action_chooser(args, rng):
+    actions, weights = weighted_list(args.actions)
+    if len(actions) == 1:
+        return lambda n: actions * n
+    return lambda n: rng.choices(actions, weights, k=n)
+
+
+def params(args):
+    return ''.join(['%s=%s\n' % (name, getattr(args, name))
+                    for name in sorted(vars(args))
+                    if name not in ('output', 'if_changed')])
+
+
+def generate_delete(args, fp):
+    fmt = 'filter del dev %s parent ffff: protocol ip prio %d handle %%d ' \
+          'flower\n' % (args.iface, args.prio)
+    for first in range(1, args.count + 1, WRITE_CHUNK):
+        last = min(first + WRITE_CHUNK, args.count + 1)
+        fp.write(''.join([fmt % handle for handle in range(first, last)]))
+
+
+def generate(args, fp):
+    if args.op == 'delete':
+        generate_delete(args, fp)
+        return
+
+    rng = random.Random(args.seed)
+    # Its own generator, so that the rules are the same as with --op add
+    mix = random.Random(args.seed)
+    live = []
+    delete = 'filter del dev %s parent ffff: protocol ip prio %d handle %%d ' \
+             'flower\n' % (args.iface, args.prio)
+    masks = build_masks(args)
+    choose_masks = mask_chooser(args, rng)
+    choose_actions = action_chooser(args, rng)
+
+    if args.seed is None:
+        scramble = [None] * len(masks)
+    else:
+        scramble = [scrambler(m.bits, rng) for m in masks]
+
+    head = 'filter %s dev %s parent ffff: protocol ip prio %d handle %%d ' \
+           'flower %s' % ('replace' if args.op == 'replace' else 'add',
+                          args.iface, args.prio,
+                          args.skip + ' ' if args.skip else '')
+    fmt = head + 'src_mac %s:%s:%s%s dst_mac %s:%s:%s%s src_ip %s.%s%s ' \
+                 'dst_ip %s.%s%s action %s\n'
+    counts = [0] * len(masks)
+    build_tables()
+    ip16 = IP16
+    mac16 = MAC16
+
+    done = 0
+    while done < args.count:
+        n = min(WRITE_CHUNK, args.count - done)
+        lines = []
+        actions = choose_actions(n)
+        if args.op == 'replace':
+            actions = [args.replace_action] * n
+        for handle, m, action in zip(range(done + 1, done + n + 1),
+                                     choose_masks(n), actions):
+            mask = masks[m]
+            key = counts[m]
+            counts[m] += 1
+            if key >> mask.bits:
+                sys.exit('Mask %s can only hold %d rules.' %
+                         (mask.prefixes, 1 << mask.bits))
+            if scramble[m]:
+                xor, mul, add, kmask, shift = scramble[m]
+                key = ((key ^ xor) * mul + add) & kmask
+                key ^= key >> shift
+
+            b0, m0, s0, b1, m1, s1, b2, m2, s2, b3, m3, s3 = mask.layout
+            smac = SRC_MAC | (key & m0) << s0
+            key >>= b0
+            dmac = DST_MAC | (key & m1) << s1
+            key >>= b1
+            sip = SRC_IP | (key & m2) << s2
+            key >>= b2
+            dip = DST_IP | (key & m3) << s3
+            suffix = mask.suffix
+            lines.append(fmt %
+                         (handle, mac16[smac >> 32], mac16[(smac >> 16) & 0xffff],
+                          mac16[smac & 0xffff], suffix[0],
+                          mac16[dmac >> 32], mac16[(dmac >> 16) & 0xffff],
+                          mac16[dmac & 0xffff], suffix[1],
+                          ip16[sip >> 16], ip16[sip & 0xffff], suffix[2],
+                          ip16[dip >> 16], ip16[dip & 0xffff], suffix[3],
+                          action))
+
+            if args.op == 'mixed':
+                live.append(handle)
+                if mix.random() < args.ratio:
+                    i = mix.randrange(len(live))
+                    live[i], live[-1] = live[-1], live[i]
+                    lines.append(delete % live.pop())
+        fp.write(''.join(lines))
+        done += n
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a tc batch file with flower rules')
+    parser.add_argument('-i', '--iface', required=True,
+                        help='interface to add the rules to')
+    parser.add_argument('-n', '--count', type=int, required=True,
+                        help='number of rules')
+    parser.add_argument('-o', '--output', default='tc-rules.batch',
+                        help='batch file, - for stdout')
+    parser.add_argument('-f', '--skip', default='',
+                        choices=['', 'skip_sw', 'skip_hw'],
+                        help='skip flag for all rules')
+    parser.add_argument('--prio', type=int, default=1)
+    parser.add_argument('-m', '--masks', type=int, default=1,
+                        help='number of distinct masks')
+    parser.add_argument('--prefixes', default='32-16',
+                        help='ip prefix lengths to build masks from')
+    parser.add_argument('--mac-prefixes', default='48-24',
+                        help='mac prefix lengths to build masks from')
+    parser.add_argument('--mask-dist', default='uniform',
+                        choices=['uniform', 'zipf'],
+                        help='how rules are spread among masks')
+    parser.add_argument('--zipf-s', type=float, default=1.0,
+                        help='exponent for --mask-dist zipf')
+    parser.add_argument('-s', '--seed', type=int,
+                        help='scramble the keys and use this random seed')
+    parser.add_argument('-a', '--actions', default='drop',
+                        help='actions, with optional weights, like drop:9,pass:1')
+    parser.add_argument('--op', default='add', choices=OPS,
+                        help='what the batch does with the rules')
+    parser.add_argument('--ratio', type=float, default=0.5,
+                        help='deletes per add, for --op mixed')
+    parser.add_argument('--replace-action', default='pass',
+                        help='action of the rules, for --op replace')
+    parser.add_argument('--if-changed', action='store_true',
+                        help='do nothing if the file exists with the same parameters')
+    args = parser.parse_args()
+
+    if args.count <= 0 or args.masks <= 0:
+        parser.error('count and masks must be positive')
+    if args.ratio < 0 or args.ratio > 1:
+        parser.error('ratio must be between 0 and 1')
+
+    if args.output == '-':
+        generate(args, sys.stdout)
+        return
+
+    params_file = args.output + '.params'
+    if args.if_changed and os.path.exists(args.output):
+        try:
+            if open(params_file).read() == params(args):
+                print('%s is up to date.' % args.output)
+                return
+        except OSError:
+            pass
+
+    fp = open(args.output, 'w', buffering=1 << 20)
+    generate(args, fp)
+    fp.close()
+    fp = open(params_file, 'w')
+    fp.write(params(args))
+    fp.close()
+
+
+if __name__ == '__main__':
+    main()
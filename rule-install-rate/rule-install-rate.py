@@ -15,13 +15,41 @@
 # in order to capture flower updates when running such tc command.
 #   This step will clear all probes on group flower, and re-insert them.
 # One probe at beginning of the function, one at its return, and 3 other
-# probes on specific code lines.
+# probes on specific code lines, and probes on fl_delete() and on
+# fl_hw_destroy_filter() within it. The lines are looked up in a listing of
+# fl_change(), which is slow with big debuginfos, so they are cached at
+# ~/.cache/perf-flower/probe-lines.json per kernel release and build-ids, and
+# looked up again if a cached line doesn't take the probe anymore.
 #
 #   Second step is to parse this captured data, which can be done on another
 # system. Simply:
 #   # ./perf-flower.py parse
 # and it will parse the perf.data file and produce the gnuplot output at
-# file 'fl_change.png'.
+# file 'fl_change.png'. With 'parse -b', the data is written in the binary
+# columnar format, at fl_change.col, which is smaller and can be memory mapped
+# by other tools. fl_change.dat can be exported out of it with:
+#   # ../lib/columnar.py fl_change.col -o fl_change.dat
+# Each curve is plotted out of fl_change-lod.dat, reduced to a few thousand
+# points that keep the spikes, unless 'parse -F' is used. With 'parse -N', the
+# outputs and gnuplot scripts are written but gnuplot is not run.
+#
+#   The same outputs, along with the ones of rate-monitor and ct-monitor,
+# come out of a single pass over perf.data with ../analyze.py.
+#
+#   With 'capture -s', sched_switch and sched_wakeup are captured too, and
+# ../lib/offcpu.py (or ../analyze.py) tells how much of each phase, and of
+# the time between fl_change() calls, was spent on CPU, waiting for a CPU or
+# blocked, such as on rtnl_lock.
+#
+#   perf.data is read by lib/perfdata.py, without perf, unless it's something
+# only perf script can read, such as a pipe mode capture. What was decoded
+# is kept in perf.data.cache, so parsing it again, say with -F, is quick.
+#
+#   Alternatively, rates and fl_change latency per phase can be followed live,
+# averaged over the last 5 seconds (-w) and without a perf.data file, with:
+#   # ./perf-flower.py live -- tc -b tc-rules.batch
+# Other events, such as the probes from rate-monitor, can be added with
+# '-e probe:*'. A perf script --ns output can be replayed with '-i <file>'.
 #
 # What the curves mean:
 #  tc flower cumulative: it is simply the total amount of time spent. It
@@ -37,247 +65,38 @@
 #     of fl_change() is considered. That is, how much depends on flower when
 #     compared to 'tc flower cumulative' and the socket/rtnl stuff.
 #
+# Replaces (fl_change() with an existing filter, told by the 'fold' variable)
+# get the same curves at fl_replace.png, and deletes at fl_delete.png, where
+# the sw part goes up to fl_hw_destroy_filter() and the hw part is that call.
+# When there are any of these, fl_churn.png has the completed inserts,
+# replaces and deletes per second.
+#
+# Along with the accumulated rate, which hides slowdowns once there are many
+# rules, the graphs have the rate per window (parse -w, 1s) and its EWMA
+# (parse -a, 5s). Windows where a rate drops below half its median (parse -T)
+# are printed, and listed in fl_stalls.dat.
+#
 # Author: Marcelo Ricardo Leitner
 # License: GPLv3
 #
 
+import json
 import os
 import os.path
+import struct
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'lib'))
+import flower
+from flower import Probe
+
 #
-# perf script parsing and output generation
+# perf script handlers, see lib/flower.py for the parsing and the outputs
 #
 
-class Probe():
-    def __init__(self):
-        description = "tc flower"
-        self.first_ts = 0.0
-        self.xy = [ [], [], [], [] ]
-        self.write_gnuplot_cfg(description)
-        self.cpu = []
-
-    def write_gnuplot_cfg_simple(self, description):
-        fp = open('fl_change.plt', 'w')
-        fp.write("""
-        set terminal pngcairo size 1024,768 dashed
-        set output "fl_change.png"
-        set title "Flower rule install performance\\nTime consumed and install rate"
-        set xlabel "Datapath flows"
-        set ylabel "Time (s)"
-        set y2label "Insert rate (flows/s)"
-        set ytics nomirror
-        set y2tics
-
-        plot \
-             'fl_change.dat' index 0 using 1:2 title "Time" with lines, \
-             'fl_change.dat' index 0 every ::1 using 1:($1/$2 < 500000 ? $1/$2 : 0) \
-                title "{0} acc insert rate" axes x1y2 with lines
-        """.format(description))
-        fp.close()
-
-    def write_gnuplot_cfg_complete(self, description):
-        fp = open('fl_change.plt', 'w')
-        fp.write("""
-        set terminal pngcairo size 1024,768 dashed
-        set output "fl_change.png"
-        set title "Flower rule install performance\\nTime consumed per rule install and install rate"
-        set xlabel "Time (s)"
-        set ylabel "Datapath flows"
-        set y2label "Insert rate"
-        set ytics nomirror
-        set y2tics
-
-        plot \
-             'fl_change.dat' index 0 using 1:2 title "{0} cumulative" with lines, \
-             'fl_change.dat' index 1 using 1:2 title "{0} sw part" with lines, \
-             'fl_change.dat' index 2 using 1:2 title "{0} hw part" with lines, \
-             'fl_change.dat' index 3 using 1:2 title "{0} just flower" with lines, \
-             'fl_change.dat' index 0 every ::1 using 1:($2/$1) \
-                title "{0} acc insert rate" axes x1y2 with lines
-        """.format(description))
-        fp.close()
-
-    def write_gnuplot_cfg(self, description):
-        if simple:
-            self.write_gnuplot_cfg_simple(description)
-        else:
-            self.write_gnuplot_cfg_complete(description)
-
-    def add_cpu(self, cpu):
-        for i in range(cpu - len(self.cpu) + 1):
-            self.cpu.append({ })
-
-    def reset_ts(self, cpu):
-        if self.has_ts(cpu, 'change_entry'):
-            last_entry = self.get_ts(cpu, 'change_entry')
-        elif self.has_ts(cpu, 'last_entry'):
-            last_entry = self.get_ts(cpu, 'last_entry')
-        else:
-            last_entry = None
-
-        self.cpu[cpu] = { }
-
-        if last_entry != None:
-            self.set_ts(cpu, 'last_entry', last_entry)
-
-    def set_ts(self, cpu, ts, value):
-        self.cpu[cpu][ts] = value
-
-    def has_ts(self, cpu, ts):
-        return ts in self.cpu[cpu].keys()
-
-    def get_ts(self, cpu, ts):
-        return self.cpu[cpu][ts]
-
-    def probe_match(self, probe, wanted, cpu, ts):
-        return probe.startswith(wanted) and not self.has_ts(cpu, ts)
-
-    def add_point(self, ts, probe, cpu):
-        if simple:
-            cpu = 0
-        self.add_cpu(cpu)
-
-        if self.probe_match(probe, 'flower__fl_change_entry', cpu, 'change_entry'):
-            self.reset_ts(cpu)
-            self.set_ts(cpu, 'change_entry', ts)
-            if self.first_ts == 0.0:
-                self.first_ts = ts
-            if simple:
-                self.finish_point(cpu)
-                self.reset_ts(cpu)
-        if simple:
-            return
-
-        if self.probe_match(probe, 'flower__fl_change_sw', cpu, 'change_sw'):
-            self.set_ts(cpu, 'change_sw', ts)
-        elif self.probe_match(probe, 'flower__fl_change_hw', cpu, 'change_hw'):
-            self.set_ts(cpu, 'change_hw', ts)
-        elif self.probe_match(probe, 'flower__fl_change_fold', cpu, 'change_fold'):
-            self.set_ts(cpu, 'change_fold', ts)
-        elif self.probe_match(probe, 'flower__fl_change_ret', cpu, 'change_ret'):
-            self.set_ts(cpu, 'change_ret', ts)
-            self.finish_point(cpu)
-            self.reset_ts(cpu)
-
-    def finish_point_simple(self):
-#             'fl_change.dat' index 0 using 1:2 title "Time" with lines, \
-#             'fl_change.dat' index 0 every ::1 using 1:($1/$2) \
-        cpu = 0
-
-        if not self.has_ts(cpu, 'change_entry'):
-            print('Skipping point: missing data')
-            return
-
-        # Populate the first table
-        if len(self.xy[0]):
-            count = self.xy[0][-1][0]
-            last = self.xy[0][-1][1]
-        else:
-            count = 0
-            last = 0
-        count += 1
-        delta = self.get_ts(cpu, 'change_entry') - self.first_ts
-        self.xy[0].append((count, delta))
-
-
-    def finish_point_complete(self, cpu):
-#             'fl_change.dat' index 0 using 1:2 title "{0} cumulative" with lines, \
-#             'fl_change.dat' index 1 using 1:2 title "{0} sw part" with lines, \
-#             'fl_change.dat' index 2 using 1:2 title "{0} hw part" with lines, \
-#             'fl_change.dat' index 3 using 1:2 title "{0} just flower" with lines, \
-
-        # Sanity check. After rtnl_lock removal, it's rescheduling and we can't
-        # track that properly.
-        if not self.has_ts(cpu, 'change_entry') or \
-           not self.has_ts(cpu, 'change_sw') or \
-           not self.has_ts(cpu, 'change_fold') or \
-           not self.has_ts(cpu, 'change_ret'):
-            print('Skipping point: missing data')
-            return
-
-        if self.get_ts(cpu, 'change_entry') > self.get_ts(cpu, 'change_sw') or \
-           self.get_ts(cpu, 'change_sw') > self.get_ts(cpu, 'change_fold') or \
-           self.get_ts(cpu, 'change_fold') > self.get_ts(cpu, 'change_ret'):
-            print('Skipping point: invalid stamp')
-            return
-
-        # Populate the first table
-        if len(self.xy[0]):
-            count = self.xy[0][-1][1]
-            last = self.xy[0][-1][0]
-        else:
-            count = 0
-            last = 0
-        count += 1
-        if self.has_ts(cpu, 'last_entry'):
-            delta = self.get_ts(cpu, 'change_entry') - self.get_ts(cpu, 'last_entry')
-            if delta > 0.01:
-                print(delta, self.get_ts(cpu, 'change_entry'), self.get_ts(cpu, 'last_entry'), self.first_ts)
-        else:
-            delta = self.get_ts(cpu, 'change_entry') - self.first_ts
-            if delta > 0.01:
-                print(delta, self.get_ts(cpu, 'change_entry'), self.first_ts)
-        self.xy[0].append((delta + last, count))
-
-        # Populate the second table
-        if self.has_ts(cpu, 'change_hw'):
-            delta = self.get_ts(cpu, 'change_hw') - self.get_ts(cpu, 'change_sw')
-            if delta < 0:
-                print("Warning: negative point: %f", delta)
-            if not len(self.xy[1]):
-                new_entry = (delta, 1)
-            else:
-                new_entry = (delta + self.xy[1][-1][0], self.xy[1][-1][1] + 1)
-            self.xy[1].append(new_entry)
-        else:
-            # skip_hw was used and we have to use the next point instead
-            delta = self.get_ts(cpu, 'change_fold') - self.get_ts(cpu, 'change_sw')
-            if not len(self.xy[1]):
-                new_entry = (delta, 1)
-            else:
-                new_entry = (delta + self.xy[1][-1][0], self.xy[1][-1][1] + 1)
-            self.xy[1].append(new_entry)
-
-        # Populate the third table
-        if self.has_ts(cpu, 'change_hw'):
-            delta = self.get_ts(cpu, 'change_fold') - self.get_ts(cpu, 'change_hw')
-            if delta < 0:
-                print("Warning2: negative point: %f", delta)
-            if not len(self.xy[2]):
-                new_entry = (delta, 1)
-            else:
-                new_entry = (delta + self.xy[2][-1][0], self.xy[2][-1][1] + 1)
-            self.xy[2].append(new_entry)
-
-        # Populate the fourth table
-        delta = self.get_ts(cpu, 'change_ret') - self.get_ts(cpu, 'change_entry')
-        if delta < 0:
-            print("Warning3: negative point: %f", delta)
-        if not len(self.xy[3]):
-            new_entry = (delta, 1)
-        else:
-            new_entry = (delta + self.xy[3][-1][0], self.xy[3][-1][1] + 1)
-        self.xy[3].append(new_entry)
-
-    def finish_point(self, cpu):
-        if simple:
-            self.finish_point_simple()
-        else:
-            self.finish_point_complete(cpu)
-
-    def save(self):
-        fp = open('fl_change.dat', 'w')
-        for idx in self.xy:
-            if len(idx):
-                for ts, count in idx:
-                    fp.write('%f %f\n' % (ts, count))
-            else:
-                # So gnuplot sees this block.
-                fp.write('0 0\n')
-            fp.write('\n\n')
-        fp.close()
-
+# Whether trace_end() runs gnuplot on the outputs
+plot = True
 
 def trace_begin():
     global p
@@ -285,14 +104,17 @@ def trace_begin():
     p = Probe()
 
 def trace_end():
-    p.save()
-    os.system("gnuplot fl_change.plt")
+    p.finish()
+    for name in p.save():
+        if plot:
+            os.system("gnuplot %s" % name)
     print("in trace_end")
 
 def trace_unhandled(event_name, context, event_fields_dict, perf_sample_dict={}):
     ts = event_fields_dict['common_s'] + event_fields_dict['common_ns']/1000000000.0
     try:
-        p.add_point(ts, event_name, perf_sample_dict['sample']['cpu'])
+        p.add_point(ts, event_name, perf_sample_dict['sample']['tid'],
+                    event_fields_dict.get('fold'))
     except:
         print("Failed to handle point!")
         raise
@@ -300,6 +122,14 @@ def trace_unhandled(event_name, context, event_fields_dict, perf_sample_dict={})
 #
 # Do the data capture
 #
+
+# Where the lines of the code line probes are cached
+PROBE_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                           os.path.expanduser('~/.cache'),
+                           'perf-flower', 'probe-lines.json')
+
+NT_GNU_BUILD_ID = 3
+
 def clear_perf_probes():
     os.system('perf probe -d flower:* >& /dev/null')
 
@@ -319,6 +149,31 @@ def get_kernel_version():
 
     return version
 
+def read_build_id(path):
+    """GNU build-id out of a file with ELF notes, such as /sys/kernel/notes,
+    or '' if there is none."""
+    try:
+        data = open(path, 'rb').read()
+    except OSError:
+        return ''
+
+    i = 0
+    while i + 12 <= len(data):
+        namesz, descsz, kind = struct.unpack_from('=III', data, i)
+        i += 12
+        name = data[i:i + namesz]
+        i += (namesz + 3) & ~3
+        desc = data[i:i + descsz]
+        i += (descsz + 3) & ~3
+        if kind == NT_GNU_BUILD_ID and name.rstrip(b'\0') == b'GNU':
+            return desc.hex()
+    return ''
+
+def probe_cache_key():
+    return ' '.join([get_kernel_version(),
+                     read_build_id('/sys/kernel/notes'),
+                     read_build_id('/sys/module/cls_flower/notes/.note.gnu.build-id')])
+
 def perf_probe_setup():
     """Perf can't locate the source for a kernel build with 'make pkg-rpm', so
     we need to specify the source dir."""
@@ -358,39 +213,103 @@ def install_ret_probe():
     if ret:
         sys.exit(ret)
 
-def install_probe_codeline(probe, code):
-    # Find at which line we should install the probe
-    output = check_output(["/bin/sh", "-c",
-        "perf probe %s -m cls_flower -L fl_change | grep -F '%s'" % (perf_probe_args, code)])
-    output = output.decode()
-    line = int(output.strip().split(' ')[0])
-
-    # Install the probe
-    check_call(["/bin/sh", "-c",
-        "perf probe -m cls_flower -a flower:%s=fl_change:%d" % (probe, line)])
-
-def install_sw_probe():
-    try:
-        # After 1f17f7742eeb ("net: sched: flower: insert filter to ht before offloading it to hw")
-        install_probe_codeline('fl_change_sw', 'err = fl_ht_insert_unique(fnew, fold, &in_ht);')
-        return
-    except:
-        pass
+class ProbeLines():
+    """Lines of fl_change() where the code line probes go, as probe ->
+    [ code, line ]. Looking them up means listing fl_change() with perf,
+    which takes long with big debuginfos, so the listing is done at most once
+    and the lines are cached on disk, per kernel and cls_flower build."""
+
+    def __init__(self, path=PROBE_CACHE):
+        self.path = path
+        self.key = probe_cache_key()
+        self.listing = None
+        self.lines = { }
+        try:
+            self.lines = json.load(open(path)).get(self.key, { })
+        except (OSError, ValueError):
+            pass
+
+    def list_fl_change(self):
+        if self.listing is None:
+            output = check_output(["/bin/sh", "-c",
+                "perf probe %s -m cls_flower -L fl_change" % perf_probe_args])
+            self.listing = output.decode(errors='replace').splitlines()
+        return self.listing
+
+    def find(self, probe, codes, fresh=False):
+        """Returns the line of the first of codes found in fl_change(), and
+        whether it came from the cache."""
+        cached = self.lines.get(probe)
+        if not fresh and cached and cached[0] in codes:
+            return cached[1], True
+
+        for code in codes:
+            for text in self.list_fl_change():
+                fields = text.split()
+                # Only the lines with a number take probes
+                if code in text and fields and fields[0].isdigit():
+                    line = int(fields[0])
+                    self.lines[probe] = [code, line]
+                    return line, False
+        raise CalledProcessError(1, "perf probe -L fl_change | grep -F '%s'" %
+                                 codes[-1])
 
-    try:
-        install_probe_codeline('fl_change_sw', 'if (!fold && __fl_lookup(fnew->mask, &fnew->mkey))')
-        return
-    except:
-        pass
+    def save(self):
+        try:
+            cache = json.load(open(self.path))
+        except (OSError, ValueError):
+            cache = { }
+        cache[self.key] = self.lines
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.%d' % os.getpid()
+            fp = open(tmp, 'w')
+            json.dump(cache, fp, indent=1, sort_keys=True)
+            fp.close()
+            os.rename(tmp, self.path)
+        except OSError as err:
+            print('Couldn\'t save the probe lines cache: %s' % err)
 
+def install_probe_at(probe, line, fetches):
+    """Installs probe at line of fl_change(), with the first of fetches that
+    works, and returns it."""
+    cmd = "perf probe -m cls_flower -a 'flower:%s=fl_change:%d %s'"
+    for fetch in fetches[:-1]:
+        try:
+            check_call(["/bin/sh", "-c", cmd % (probe, line, fetch)])
+            return fetch
+        except CalledProcessError:
+            pass
+    check_call(["/bin/sh", "-c", cmd % (probe, line, fetches[-1])])
+    return fetches[-1]
+
+def install_probe_codeline(probe, codes, fetches=('',)):
+    """Installs probe at the line of the first of codes (a string or a list
+    of alternatives) found in fl_change(), fetching the first of fetches that
+    can be fetched there, and returns it. The line is only looked up again if
+    it came from the cache and the probe doesn't go there even without
+    fetching anything."""
+    if isinstance(codes, str):
+        codes = [ codes ]
+    line, cached = probe_lines.find(probe, codes)
     try:
-        install_probe_codeline('fl_change_sw', 'if (!fold && fl_lookup(head, &fnew->mkey))')
-        return
-    except:
-        pass
+        return install_probe_at(probe, line, fetches)
+    except CalledProcessError:
+        if not cached:
+            raise
+    print('Cached line %d for %s is stale, looking it up again.' %
+          (line, probe))
+    line, cached = probe_lines.find(probe, codes, fresh=True)
+    return install_probe_at(probe, line, fetches)
 
-    # Last attempt. If it also fails, abort everything.
-    install_probe_codeline('fl_change_sw', 'if (!fold && fl_lookup(fnew->mask, &fnew->mkey))')
+def install_sw_probe():
+    install_probe_codeline('fl_change_sw', [
+        # After 1f17f7742eeb ("net: sched: flower: insert filter to ht before offloading it to hw")
+        'err = fl_ht_insert_unique(fnew, fold, &in_ht);',
+        'if (!fold && __fl_lookup(fnew->mask, &fnew->mkey))',
+        'if (!fold && fl_lookup(head, &fnew->mkey))',
+        'if (!fold && fl_lookup(fnew->mask, &fnew->mkey))',
+    ])
 
 def install_hw_probe():
     ret = os.system('perf probe -m cls_flower -a flower:fl_change_hw=fl_hw_replace_filter')
@@ -401,59 +320,227 @@ def install_hw_probe():
 
 def install_fold_probe():
     # FIXME: Validate throughout versions
-    install_probe_codeline('fl_change_fold', 'if (!tc_in_hw(fnew->flags))')
+    code = 'if (!tc_in_hw(fnew->flags))'
+    # fold tells replaces from inserts
+    if not install_probe_codeline('fl_change_fold', code, ('fold', '')):
+        print('WARNING: can\'t fetch fold, replaces will count as inserts.')
+
+def install_delete_probes():
+    ret = os.system('perf probe -m cls_flower -a flower:fl_delete_entry=fl_delete')
+    ret = ret or os.system('perf probe -m cls_flower -a flower:fl_delete_ret=fl_delete%return')
+    if ret:
+        sys.exit(ret)
 
-def capture():
-    global check_output, check_call
+    # The hw part of a delete. It may have been inlined.
+    ret = os.system('perf probe -m cls_flower -a flower:fl_hw_destroy_entry=fl_hw_destroy_filter')
+    ret = ret or os.system('perf probe -m cls_flower -a flower:fl_hw_destroy_ret=fl_hw_destroy_filter%return')
+    if ret:
+        print('WARNING: no fl_hw_destroy_filter probes, deletes won\'t have a hw part.')
+
+def install_probes():
+    global check_output, check_call, CalledProcessError, probe_lines
     from subprocess import check_output, check_call, CalledProcessError
 
     clear_perf_probes()
     load_module()
     perf_probe_setup()
+    probe_lines = ProbeLines()
     try:
         install_entry_probe()
         install_ret_probe()
         install_sw_probe()
         install_hw_probe()
         install_fold_probe()
+        install_delete_probes()
     except CalledProcessError as err:
         print('ERROR: Flower code has changed and we couldn\'t install a probe.')
         raise
 
+    probe_lines.save()
     print('Excellent, all probes were installed.')
+
+# Scheduler events for the on CPU, runnable and blocked time, see
+# lib/offcpu.py
+SCHED_EVENTS = ('sched:sched_switch', 'sched:sched_wakeup')
+
+def capture():
+    args = sys.argv[2:]
+    command = args[args.index('--') + 1:] if '--' in args else []
+    if not command:
+        sys.exit('Missing command to run.')
+    install_probes()
     print('Executing perf record.')
-    cmd = ['perf', 'record', '-e', 'flower:*', '-aR', '--' ]
-    cmd.extend(sys.argv[3:])
+    cmd = ['perf', 'record', '-e', 'flower:*']
+    if '-s' in args[:args.index('--')]:
+        for event in SCHED_EVENTS:
+            cmd.extend(['-e', event])
+    cmd.extend(['-aR', '--'])
+    cmd.extend(command)
     print(cmd)
     os.execvp('perf', cmd)
 
+#
+# Live mode: rates while the command runs, without a perf.data
+#
+def live():
+    from subprocess import Popen, PIPE
+    import probeset
+    from live import LiveRates
+
+    args = sys.argv[2:]
+    command = []
+    if '--' in args:
+        command = args[args.index('--') + 1:]
+        args = args[:args.index('--')]
+
+    window = 5
+    source = None
+    probe_set = probeset.DEFAULT
+    events = ['flower:*']
+    while args:
+        opt = args.pop(0)
+        if opt == '-w' and args:
+            window = int(args.pop(0))
+        elif opt == '-i' and args:
+            source = args.pop(0)
+        elif opt == '-e' and args:
+            events.append(args.pop(0))
+        elif opt == '-s' and args:
+            probe_set = args.pop(0)
+        else:
+            sys.exit('Invalid argument \'%s\'.' % opt)
+
+    try:
+        probes = probeset.load(probe_set)
+    except probeset.ProbeSetError as err:
+        sys.exit(err)
+    monitor = LiveRates(probes, window=window)
+    if source is not None:
+        # Replay a perf script --ns output
+        fp = sys.stdin if source == '-' else open(source, 'r')
+        monitor.feed(fp)
+        monitor.finish()
+        return
+
+    if not command:
+        sys.exit('Missing command to run.')
+    install_probes()
+    cmd = ['perf', 'record', '-aR', '-o', '-']
+    for event in events:
+        cmd.extend(['-e', event])
+    cmd.append('--')
+    cmd.extend(command)
+    print(cmd)
+    record = Popen(cmd, stdout=PIPE)
+    script = Popen(['perf', 'script', '--ns', '-i', '-'], stdin=record.stdout,
+                   stdout=PIPE, universal_newlines=True, errors='replace')
+    record.stdout.close()
+    monitor.feed_pipe(script.stdout.fileno())
+    monitor.finish()
+    record.wait()
+    script.wait()
+
+def replay(samples):
+    trace_begin()
+    for sample in samples:
+        # As perf names them for the handlers
+        probe = sample[3].replace(':', '__', 1)
+        p.add_point(sample[2], probe, sample[0], flower.parse_fold(sample[4]))
+    trace_end()
+
+def replay_text(source):
+    from perfscript import parse_line
+
+    fp = sys.stdin if source == '-' else open(source, 'r')
+    replay(filter(None, map(parse_line, fp)))
+
 #
 # application mode handling
 #
 if len(sys.argv) == 1:
     print("""Usage:
-{0} capture -- <command>    capture flower stats during <command> execution
-{0} parse                   parse a perf.data sample and produce outputs""".format(sys.argv[0]))
+{0} capture [-s] -- <command>
+                            capture flower stats during <command> execution
+                            -s: with scheduler events, for ../lib/offcpu.py
+{0} parse [-b] [-F] [-N] [-i perf.data | -t file] [-w secs] [-a secs]
+          [-T fraction]
+                            parse a perf.data sample and produce outputs
+                            -b: write fl_change.col instead of fl_change.dat
+                            -F: plot all points, not a reduced set
+                            -N: don't run gnuplot, just write its scripts
+                            -i: the perf.data file, perf.data by default
+                            -t: parse a perf script --ns output instead
+                            -w: call rate window, 1s by default
+                            -a: time constant of the rate EWMA, 5s
+                            -T: rate below which, as a fraction of its
+                                median, a window is a stall, 0.5
+{0} live [-w secs] [-s probe set] [-e event] -- <command>
+                            print rates every second while <command> runs,
+                            with the driver calls of the probe set, mlx5
+                            by default, as perf-probes.sh -s was given
+{0} live [-w secs] [-s probe set] -i <file|->
+                            ditto, out of a perf script --ns output""".format(sys.argv[0]))
     sys.exit(0)
 elif sys.argv[1] == 'capture':
     # Capture mode
     capture()
+elif sys.argv[1] == 'live':
+    live()
 elif sys.argv[1] == 'parse':
     # parse requested. Re-execute through perf
-    if len(sys.argv) > 2:
-        simple = sys.argv[2]
+    args = sys.argv[2:]
+    fmt = 'text'
+    if '-b' in args:
+        args.remove('-b')
+        fmt = 'binary'
+    resolution = 'lod'
+    if '-F' in args:
+        args.remove('-F')
+        resolution = 'full'
+    if '-N' in args:
+        args.remove('-N')
+        plot = False
+    source = None
+    if '-t' in args[:-1]:
+        i = args.index('-t')
+        source = args[i + 1]
+        del args[i:i + 2]
+    data = 'perf.data'
+    if '-i' in args[:-1]:
+        i = args.index('-i')
+        data = args[i + 1]
+        del args[i:i + 2]
+    for opt, name in (('-w', 'rate_window'), ('-a', 'rate_ewma'),
+                      ('-T', 'stall_threshold')):
+        if opt in args[:-1]:
+            i = args.index(opt)
+            setattr(flower, name, float(args[i + 1]))
+            del args[i:i + 2]
+    if args:
+        simple = args[0]
     else:
         simple = '0'
-    os.execvp('perf', ('perf', 'script', '-s', sys.argv[0], '+parse', simple))
+    flower.simple = simple == '1'
+    flower.binary = fmt == 'binary'
+    flower.full = resolution == 'full'
+    if source is not None:
+        # Replay a perf script --ns output, no perf needed
+        replay_text(source)
+        sys.exit(0)
+
+    # Read perf.data natively, unless it's something only perf can read, or
+    # out of what was decoded last time
+    import eventcache
+    replay(eventcache.samples(data)[0])
 elif sys.argv[1] == '+parse':
     # called from within perf script environment
     sys.path.append(os.environ['PERF_EXEC_PATH'] + \
             '/scripts/python/Perf-Trace-Util/lib/Perf/Trace')
 
-    if len(sys.argv) > 2 and sys.argv[2] == '1':
-        simple = True
-    else:
-        simple = False
+    flower.simple = len(sys.argv) > 2 and sys.argv[2] == '1'
+    flower.binary = len(sys.argv) > 3 and sys.argv[3] == 'binary'
+    flower.full = len(sys.argv) > 4 and sys.argv[4] == 'full'
+    plot = not (len(sys.argv) > 5 and sys.argv[5] == 'noplot')
 
     from perf_trace_context import *
     from Core import *
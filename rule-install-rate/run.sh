@@ -10,13 +10,48 @@ iface=
 rules=40000
 skip=""   # skip_hw / skip_sw   (place holder, neither are supported :)
 batchfile=tc-rules.batch
+workers=1        # list of concurrent tc -b instances to test, like 1,2,4,8
+placement=same   # where each worker inserts: same / prio / chain
+masks=1          # distinct flower masks among the rules
+prefixes=        # ip prefix lengths to build the masks from, like 32,24,16
+seed=            # if set, keys are scrambled with this seed
+actions=drop     # actions, with optional weights, like drop:9,pass:1
+parse_opts=      # -F to plot all points
+capture_opts=    # -s to capture scheduler events too
+sweep=           # set if masks or rules are lists
+workload=add     # add / delete / replace / mixed
+ratio=0.5        # deletes per add, for the mixed workload
+testbatch=$batchfile
 
 usage()
 {
-	echo "Usage: $0 -i <interface> [-n count] [-f skip_flag]"
-	echo "where count must be 0 < count < 100000,"
+	echo "Usage: $0 -i <interface> [-n count] [-f skip_flag] [-j workers] [-p placement]"
+	echo "          [-m masks] [-P prefixes] [-s seed] [-a actions] [-F]"
+	echo "          [-w add|delete|replace|mixed[:ratio]] [-S]"
+	echo "where count must be greater than 0, or a comma separated list of"
+	echo "      counts, like 10000,100000, which, as a list of masks does,"
+	echo "      sweeps over every combination of both lists. Each run is kept"
+	echo "      under sweep-m<masks>-n<count>, and the insert cost of each is"
+	echo "      in sweep.dat and sweep.png."
 	echo "      if specified, skip_flag = <skip_sw|skip_hw>"
 	echo "      although neither flags are supported by the perf probes yet."
+	echo "      workers is a comma separated list of how many tc -b instances"
+	echo "      to run at once, each one pinned to its own CPU, like 1,2,4,8."
+	echo "      placement = <same|prio|chain>, whether all workers insert on"
+	echo "      the same prio, or one prio or chain per worker (default: same)."
+	echo "      masks is how many distinct flower masks the rules use, built"
+	echo "      from the ip prefixes list, like 32,24,16 or 32-16, or a list"
+	echo "      of counts, like 1,4,16,64, to sweep over."
+	echo "      seed scrambles the keys, and actions is a weighted list like"
+	echo "      drop:9,pass:1. See gen-rules.py for details."
+	echo "      -F plots all points instead of a reduced set."
+	echo "      workload is what is measured: adding the rules (default),"
+	echo "      deleting or replacing them after they were all added, or"
+	echo "      adding them while deleting, after each add with probability"
+	echo "      ratio (default 0.5), one of the rules added so far."
+	echo "      Only add supports more than one worker."
+	echo "      -S captures scheduler events too, and breaks the time of the"
+	echo "      calls down into on CPU, runnable and blocked, at offcpu.png."
 	exit 1
 }
 
@@ -40,7 +75,7 @@ parse_cmdline()
 		-n)
 			rules="$1"
 			shift
-			if [ "$rules" -le 0 -o "$rules" -gt 100000 ]; then
+			if ! [[ "$rules" =~ ^[1-9][0-9]*(,[1-9][0-9]*)*$ ]]; then
 				echo "Invalid count of rules '$rules'."
 				usage
 			fi
@@ -53,6 +88,63 @@ parse_cmdline()
 				usage
 			fi
 			;;
+		-j)
+			workers="$1"
+			shift
+			if ! [[ "$workers" =~ ^[1-9][0-9]*(,[1-9][0-9]*)*$ ]]; then
+				echo "Invalid list of workers '$workers'."
+				usage
+			fi
+			;;
+		-p)
+			placement="$1"
+			shift
+			if [ "$placement" != same -a "$placement" != prio -a \
+			     "$placement" != chain ]; then
+				echo "Invalid placement '$placement'."
+				usage
+			fi
+			;;
+		-m)
+			masks="$1"
+			shift
+			if ! [[ "$masks" =~ ^[1-9][0-9]*(,[1-9][0-9]*)*$ ]]; then
+				echo "Invalid count of masks '$masks'."
+				usage
+			fi
+			;;
+		-P)
+			prefixes="$1"
+			shift
+			;;
+		-s)
+			seed="$1"
+			shift
+			;;
+		-a)
+			actions="$1"
+			shift
+			;;
+		-F)
+			parse_opts=-F
+			;;
+		-S)
+			capture_opts=-s
+			;;
+		-w)
+			workload="${1%%:*}"
+			if [ "$workload" != "$1" ]; then
+				ratio="${1#*:}"
+			fi
+			shift
+			case "$workload" in
+			add|delete|replace|mixed)
+				;;
+			*)
+				echo "Invalid workload '$workload'."
+				usage
+			esac
+			;;
 		-h)
 			usage
 			;;
@@ -66,6 +158,17 @@ parse_cmdline()
 		echo "You must specify one interface."
 		usage
 	fi
+	if [ "$workload" != add -a "$workers" != 1 ]; then
+		echo "The $workload workload only runs with one worker."
+		usage
+	fi
+	if [[ "$masks$rules" == *,* ]]; then
+		sweep=1
+		if [ "$workload" != add -o "$workers" != 1 ]; then
+			echo "Sweeps only run the add workload, with one worker."
+			usage
+		fi
+	fi
 }
 
 
@@ -105,39 +208,29 @@ check_system()
 	check_perf
 }
 
-#
-# Load as much as possible
-#
-generate_batch()
+gen_rules()
 {
-	s=$(date +%s)
-	echo "Generating $batchfile..."
-	python3 > $batchfile <<EOF
-for i in range($rules):
-	a=i & 0xff
-	b=(i & 0xff00) >> 8
-	c=(i & 0xff0000) >> 16
-	print("filter add dev $iface parent ffff: protocol ip prio 1 flower $skip \
-	       src_mac ec:13:db:%02X:%02X:%02X dst_mac ec:14:c2:%02X:%02X:%02X \
-	       src_ip 56.%d.%d.%d dst_ip 55.%d.%d.%d \
-	       action drop" % (a, b, c, c, b, a, a, b, c, c, b, a))
-EOF
-	e=$(date +%s)
-	echo "Generated $rules rules in $((e-s)) seconds."
+	./gen-rules.py --if-changed -i $iface -n $rules \
+		${skip:+-f $skip} -m $masks ${prefixes:+--prefixes $prefixes} \
+		${seed:+-s $seed} -a $actions "$@"
 }
 
+#
+# Load as much as possible
+# The batch is only generated again if any of its parameters changed. Other
+# than add, workloads get their own batch, and delete and replace are run on
+# top of the rules from the add one.
+#
 prep_batch()
 {
-	if [ ! -f $batchfile ]; then
-		[ ! -e $batchfile ] || rm -f $batchfile
-		generate_batch
-	fi
-
-	lines=$(wc -l $batchfile)
-	lines=${lines/ *}
-	if [ $lines != $rules ]; then
-		generate_batch
+	s=$(date +%s)
+	gen_rules -o $batchfile
+	if [ "$workload" != add ]; then
+		testbatch=$batchfile.$workload
+		gen_rules -o $testbatch --op $workload --ratio $ratio
 	fi
+	e=$(date +%s)
+	echo "Prepared $rules rules in $((e-s)) seconds."
 }
 
 cleanup()
@@ -147,27 +240,276 @@ cleanup()
 	tc qdisc del dev $iface ingress || :
 	echo "  adding it back..."
 	tc qdisc add dev $iface ingress
+	if [ "$workload" = delete -o "$workload" = replace ]; then
+		echo "  adding the rules to $workload..."
+		tc -b $batchfile
+	fi
 	echo "Done."
 }
 
+#
+# Split the batch among $1 workers, round robin, and move each share to its
+# own prio or chain if asked to.
+#
+split_batch()
+{
+	n=$1
+
+	rm -f $batchfile.w*
+	split -n r/$n -d -a 3 $testbatch $batchfile.w
+	for ((w = 0; w < n; w++)); do
+		shard=$(printf "%s.w%03d" $batchfile $w)
+		case "$placement" in
+		prio)
+			sed -i "s/ prio 1 / prio $((w+1)) /" $shard
+			;;
+		chain)
+			sed -i "s/ parent ffff: / parent ffff: chain $w /" $shard
+			;;
+		esac
+	done
+}
+
+#
+# Command line running $1 tc -b workers at once, on CPUs 1 to $1 (wrapping
+# around if needed), that fails if any of them fails.
+#
+workers_cmd()
+{
+	n=$1
+	ncpu=$(nproc)
+
+	cmd="ret=0; pids="
+	for ((w = 0; w < n; w++)); do
+		shard=$(printf "%s.w%03d" $batchfile $w)
+		cpu=$(( (w + 1) % ncpu ))
+		cmd+="; taskset -c $cpu tc -b $shard & pids+=\" \$!\""
+	done
+	cmd+="; for p in \$pids; do wait \$p || ret=1; done; exit \$ret"
+	echo "$cmd"
+}
+
 do_test()
 {
-	./rule-install-rate.py capture -- taskset -c 1 tc -b $batchfile
+	n=$1
+
+	if [ $n = 1 -a $placement = same ]; then
+		./rule-install-rate.py capture $capture_opts -- \
+			taskset -c 1 tc -b $testbatch
+		return
+	fi
+
+	split_batch $n
+	./rule-install-rate.py capture $capture_opts -- \
+		bash -c "$(workers_cmd $n)"
 }
 
 generate_report()
 {
-	./rule-install-rate.py parse
+	./rule-install-rate.py parse $parse_opts
+	if [ -n "$capture_opts" ]; then
+		../lib/offcpu.py -i perf.data && gnuplot offcpu.plt
+	fi
+}
+
+#
+# Add the results with $1 workers to the scaling curve
+#
+add_scaling_point()
+{
+	n=$1
+
+	awk -v n=$n '
+		!/^#/ {
+			calls += $2
+			if (first == "" || $3 < first) first = $3
+			if ($4 > last) last = $4
+			rate += $5
+			if (min == "" || $5 < min) min = $5
+			if ($5 > max) max = $5
+			workers++
+		}
+		END {
+			if (last > first)
+				aggr = calls / (last - first)
+			printf "%d\t%d\t%f\t%f\t%f\t%f\n", n, calls, aggr,
+				rate / workers, min, max
+		}' fl_change-workers.dat >> scaling.dat
+}
+
+#
+# Add the insert cost of the run with $masks masks and $rules rules to the
+# sweep, out of the insert line of fl_change-split.dat
+#
+add_sweep_point()
+{
+	if [ ! -f fl_change-split.dat ]; then
+		echo "No fl_change-split.dat, leaving $masks masks x $rules rules out."
+		return
+	fi
+	sed -n "s/^insert	/$masks	$rules	/p" fl_change-split.dat >> sweep.dat
+}
+
+#
+# gnuplot tics for the comma separated list $1, at 0, 1, 2...
+#
+tics()
+{
+	i=0
+	sep=
+	echo -n "("
+	for v in ${1//,/ }; do
+		echo -n "$sep\"$v\" $i"
+		sep=", "
+		i=$((i+1))
+	done
+	echo ")"
+}
+
+#
+# gnuplot function $1(v) mapping the values of the comma separated list $2 to
+# 0, 1, 2..., and the others to NaN
+#
+tic_index()
+{
+	i=0
+	echo -n "$1(v) = "
+	for v in ${2//,/ }; do
+		echo -n "v == $v ? $i : "
+		i=$((i+1))
+	done
+	echo "NaN"
+}
+
+#
+# Move everything a run wrote to $1
+#
+keep_run()
+{
+	mkdir -p $1
+	for f in perf.data perf.data.cache fl_* offcpu.*; do
+		if [ -e "$f" ]; then
+			rm -rf "$1/$f"
+			mv -f "$f" $1/
+		fi
+	done
+}
+
+#
+# Heatmap of the sw part per rule, masks x rules, with how much it grew from
+# the first 10% of the rules to the last 10%
+#
+plot_sweep()
+{
+	nm=$(wc -w <<< "${masks//,/ }")
+	nr=$(wc -w <<< "${rules//,/ }")
+
+	cat > sweep.plt <<-_EOF_
+	set terminal pngcairo size 1024,768 dashed
+	set output "sweep.png"
+	set title "Flower rule install performance\\nsw part per rule (us), and last 10% over first 10% of the rules"
+	set xlabel "Flower masks"
+	set ylabel "Rules"
+	set cblabel "sw part per rule (us)"
+	set xtics $(tics $masks)
+	set ytics $(tics $rules)
+	set xrange [-0.5:$nm-0.5]
+	set yrange [-0.5:$nr-0.5]
+	set palette rgbformulae 22,13,-31
+	set style fill solid
+	$(tic_index mi $masks)
+	$(tic_index ri $rules)
+
+	plot \\
+	     'sweep.dat' using (mi(\$1)):(ri(\$2)):(0.5):(0.5):4 notitle with boxxyerror lc palette, \\
+	     'sweep.dat' using (mi(\$1)):(ri(\$2)):(sprintf("%.1f\\nx%.2f", \$4, \$8 > 0 ? \$9/\$8 : 0)) notitle with labels
+	_EOF_
+
+	gnuplot sweep.plt
+}
+
+#
+# Every combination of the mask counts and rule counts given, masks first
+#
+sweep()
+{
+	all_masks=$masks
+	all_rules=$rules
+
+	echo -e "#masks\trules\tcalls\tsw_us\thw_us\tother_us\ttotal_us\tsw_first_us\tsw_last_us" > sweep.dat
+	for masks in ${all_masks//,/ }; do
+		for rules in ${all_rules//,/ }; do
+			echo "Testing $rules rules over $masks masks."
+			prep_batch
+			cleanup
+			do_test 1
+			generate_report
+			add_sweep_point
+
+			keep_run sweep-m$masks-n$rules
+		done
+	done
+	masks=$all_masks
+	rules=$all_rules
+
+	column -t sweep.dat
+	plot_sweep
+}
+
+plot_scaling()
+{
+	cat > scaling.plt <<-_EOF_
+	set terminal pngcairo size 1024,768 dashed
+	set output "scaling.png"
+	set title "Flower rule install performance\\nInsert rate x concurrent installers ($placement)"
+	set xlabel "Workers"
+	set ylabel "Aggregate insert rate (flows/s)"
+	set y2label "Per worker insert rate (flows/s)"
+	set ytics nomirror
+	set y2tics
+	set xtics 1
+
+	plot \\
+	     'scaling.dat' using 1:3 title "aggregate" with linespoints, \\
+	     'scaling.dat' using 1:4:5:6 title "per worker (avg, min, max)" axes x1y2 with yerrorlines
+	_EOF_
+
+	gnuplot scaling.plt
 }
 
 main()
 {
 	parse_cmdline "$@"
 	check_system
-	cleanup
+
+	if [ -n "$sweep" ]; then
+		sweep
+		return
+	fi
+
 	prep_batch
-	do_test
-	generate_report
+
+	if [ "$workers" = 1 ]; then
+		cleanup
+		do_test 1
+		generate_report
+		return
+	fi
+
+	echo -e "#workers\tcalls\taggregate\tavg\tmin\tmax" > scaling.dat
+	for n in ${workers//,/ }; do
+		echo "Testing with $n workers."
+		cleanup
+		do_test $n
+		generate_report
+		add_scaling_point $n
+
+		keep_run workers-$n
+	done
+	rm -f $batchfile.w*
+
+	column -t scaling.dat
+	plot_scaling
 }
 
 main "$@"
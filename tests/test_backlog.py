@@ -0,0 +1,108 @@
+#
+# lib/backlog.py: depth, bursts and dispatch delay out of a hand-made
+# sequence of requests and executions.
+#
+# License: GPLv3
+#
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'lib'))
+from backlog import Backlog
+
+
+class Table():
+    def __init__(self):
+        self.rows = []
+
+    def append(self, *row):
+        self.rows.append(row)
+
+
+class TestBacklog(unittest.TestCase):
+    def backlog(self):
+        """add: 2 requests, executed a second apart, an execution of a request
+        from before the capture, then a request executed right away."""
+        table = Table()
+        backlog = Backlog(('add', 'del'), window=1.0, burst_min=2,
+                          table=table)
+        backlog.request(0, 0.0)
+        backlog.request(0, 1.0)
+        backlog.handler(7, 1.999998)
+        backlog.execute(0, 2.0, 7)
+        backlog.handler(7, 2.999999)
+        backlog.execute(0, 3.0, 7)
+        backlog.execute(0, 3.5)
+        backlog.request(0, 4.0)
+        # Another kworker runs two items, the first one not probed
+        backlog.handler(8, 4.5)
+        backlog.handler(8, 4.9)
+        backlog.execute(0, 5.0)
+        backlog.finish()
+        return backlog, table
+
+    def test_depth(self):
+        backlog, table = self.backlog()
+        self.assertEqual(table.rows, [(0.0, 1, 0), (1.0, 2, 0), (2.0, 1, 0),
+                                      (3.0, 0, 0), (4.0, 1, 0), (5.0, 0, 0)])
+        q = backlog.queues[0]
+        self.assertEqual((q.depth, q.peak, q.peak_ts), (0, 2, 1.0))
+        self.assertEqual((q.requests, q.executions, q.untracked), (3, 4, 1))
+        self.assertAlmostEqual(q.busy, 4.0)
+        self.assertAlmostEqual(q.area, 5.0)
+
+    def test_summary(self):
+        backlog, table = self.backlog()
+        self.assertAlmostEqual(backlog.span(), 5.0)
+        (name, requests, executions, peak, peak_ts, mean, busy, arrival,
+         service, util, bursts, drain) = backlog.summary()[0]
+        self.assertEqual((name, requests, executions, peak, peak_ts),
+                         ('add', 3, 4, 2, 1.0))
+        self.assertAlmostEqual(mean, 1.0)
+        self.assertAlmostEqual(busy, 4.0)
+        self.assertAlmostEqual(arrival, 0.6)
+        self.assertAlmostEqual(service, 1.0)
+        self.assertAlmostEqual(util, 0.6)
+        # The second one never got 2 deep
+        self.assertEqual(bursts, 1)
+        self.assertAlmostEqual(drain, 2.0)
+        self.assertEqual(backlog.queues[0].bursts, [[0.0, 2, 1.0, 3.0]])
+        self.assertEqual(backlog.summary()[1][1:4], (0, 0, 0))
+
+    def test_throughput(self):
+        # The peak of a window is at least the depth it starts with
+        backlog, table = self.backlog()
+        self.assertEqual([(start, wins[0]) for start, wins in backlog.rows],
+                         [(0.0, [1, 0, 1]), (1.0, [1, 0, 2]),
+                          (2.0, [0, 1, 2]), (3.0, [0, 2, 1]),
+                          (4.0, [1, 0, 1]), (5.0, [0, 1, 1])])
+
+    def test_report(self):
+        backlog, table = self.backlog()
+        lines = backlog.report()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('add workqueue: peak backlog 2 '
+                                            'at 1.000000, mean 1.00, 0 left'))
+        self.assertTrue(lines[0].endswith('drained in 2.000000s at most'))
+        self.assertEqual(lines[1], 'flow_offload_work_handler: 4 items on 2 '
+                         'kworkers, 1 of them not add, del nor stats, '
+                         '1.500 us mean and 2.000 us max until the item was '
+                         'told apart')
+
+    def test_files(self):
+        backlog, table = self.backlog()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'bursts.dat')
+        backlog.write_bursts(path)
+        self.assertEqual(open(path).read().splitlines()[1:],
+                         ['add\t0.000000\t1.000000\t2\t3.000000\t2.000000'
+                          '\t1.000000'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#
+# lib/columnar.py: tables written whole or row by row read back as they
+# were, and export as the text .dat files do.
+#
+# License: GPLv3
+#
+
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from array import array
+
+TOP = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, os.path.join(TOP, 'lib'))
+import columnar
+
+ROWS = columnar.CHUNK + 100
+
+
+def export(table):
+    out = io.StringIO()
+    table.export(out)
+    return out.getvalue()
+
+
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.path = os.path.join(self.dir, 'test.col')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        ts = array('d', [i * 0.25 for i in range(ROWS)])
+        count = array('q', [i * 3 - 7 for i in range(ROWS)])
+        writer = columnar.Writer(self.path)
+        writer.add('whole', [('ts', ts), ('count', count)],
+                   '#ts\tcount\n', '%f\t%d\n', end='\n\n')
+        spooled = writer.table('rows', [('n', 'q'), ('x', 'd')], '#n\tx\n')
+        for i in range(ROWS):
+            spooled.append(i, i / 8.0)
+        writer.close()
+
+        whole, rows = columnar.load(self.path)
+        self.assertEqual((whole.name, whole.rows), ('whole', ROWS))
+        self.assertEqual(list(whole['ts']), list(ts))
+        self.assertEqual(list(whole['count']), list(count))
+        self.assertEqual((rows.name, rows.rows, rows.names),
+                         ('rows', ROWS, ['n', 'x']))
+        self.assertEqual(list(rows['n']), list(range(ROWS)))
+        self.assertEqual(list(rows['x']), [i / 8.0 for i in range(ROWS)])
+
+        self.assertEqual(export(whole),
+                         '#ts\tcount\n' +
+                         ''.join(['%f\t%d\n' % r for r in zip(ts, count)]) +
+                         '\n\n')
+        # With the default format, out of the column types
+        self.assertEqual(export(rows),
+                         '#n\tx\n' + ''.join(['%d\t%f\n' % (i, i / 8.0)
+                                              for i in range(ROWS)]))
+
+    def test_extend(self):
+        writer = columnar.Writer(self.path)
+        table = writer.table('t', [('a', 'q'), ('b', 'd')])
+        for start in range(0, ROWS, 1000):
+            n = min(1000, ROWS - start)
+            table.extend([array('q', range(start, start + n)),
+                          array('d', [0.5] * n)])
+        writer.close()
+        t = columnar.load(self.path)[0]
+        self.assertEqual(list(t['a']), list(range(ROWS)))
+        self.assertEqual(list(t['b']), [0.5] * ROWS)
+
+    def test_empty(self):
+        writer = columnar.Writer(self.path)
+        writer.add('whole', [('ts', array('d'))], '#ts\n', '%f\n',
+                   empty='0\n', end='\n')
+        writer.table('rows', [('n', 'q')], '#n\n', empty='0\n')
+        writer.close()
+        tables = columnar.load(self.path)
+        self.assertEqual([(t.name, t.rows, len(t.columns[0]))
+                          for t in tables], [('whole', 0, 0), ('rows', 0, 0)])
+        self.assertEqual([export(t) for t in tables],
+                         ['#ts\n0\n\n', '#n\n0\n'])
+
+    def test_bad_types(self):
+        writer = columnar.Writer(self.path)
+        self.assertRaises(ValueError, writer.table, 't', [('a', 'i')])
+        self.assertRaises(ValueError, writer.add, 't',
+                          [('a', array('d', [1.0])), ('b', array('d'))])
+        writer.close()
+        open(self.path, 'wb').write(b'\0' * 32)
+        self.assertRaises(ValueError, columnar.load, self.path)
+
+    def test_flower_export(self):
+        text = os.path.join(self.dir, 'f.txt')
+        subprocess.check_call([sys.executable,
+                               os.path.join(TOP, 'bench', 'gen-events.py'),
+                               '-w', 'flower', '-n', '20000', '-o', text])
+        script = os.path.join(TOP, 'rule-install-rate', 'rule-install-rate.py')
+        for fmt in ('dat', 'col'):
+            cwd = os.path.join(self.dir, fmt)
+            os.mkdir(cwd)
+            subprocess.check_call([sys.executable, script, 'parse', '-N'] +
+                                  (['-b'] if fmt == 'col' else []) +
+                                  ['-t', text], cwd=cwd,
+                                  stdout=subprocess.DEVNULL)
+        for name in ('fl_change', 'fl_replace', 'fl_delete'):
+            out = io.StringIO()
+            for table in columnar.load(os.path.join(self.dir, 'col',
+                                                    name + '.col')):
+                table.export(out)
+            self.assertEqual(out.getvalue(),
+                             open(os.path.join(self.dir, 'dat',
+                                               name + '.dat')).read(), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
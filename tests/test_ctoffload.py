@@ -0,0 +1,44 @@
+#
+# lib/ctoffload.py: memory stays bounded by the requests in flight.
+#
+# License: GPLv3
+#
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'lib'))
+from ctoffload import CTOffload
+
+
+class TestReorder(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_stale_request_of_another_event(self):
+        # A del that is never executed, and no del after it
+        offloads = CTOffload(ttl=1.0, out=open(os.devnull, 'w'))
+        offloads.open()
+        offloads.request('del', 1, 0.0)
+        for n in range(200000):
+            ts = 0.001 + n * 0.0001
+            offloads.request('add', n, ts)
+            offloads.execute('add', n, ts + 0.00005)
+            # Requests within the last ttl at most
+            self.assertLessEqual(len(offloads.reorder), 10001)
+        offloads.finish()
+        self.assertEqual(offloads.counters['del']['evicted'], 1)
+        self.assertEqual(offloads.counters['add']['matched'], 200000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#
+# lib/eventcache.py: the cache of a perf.data written by bench/gen-events.py
+# is used while it's there, and replaced when the capture or the decoder
+# changes.
+#
+# License: GPLv3
+#
+
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+
+TOP = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, os.path.join(TOP, 'lib'))
+import eventcache
+from perfdata import PerfData
+
+
+class TestEventCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data = os.path.join(self.tmp.name, 'perf.data')
+        self.cache = self.data + '.cache'
+        subprocess.check_call([sys.executable,
+                               os.path.join(TOP, 'bench', 'gen-events.py'),
+                               '-w', 'flower', '-n', '2000', '-f',
+                               'perf.data', '-o', self.data])
+        self.decoder_version = eventcache.decoder_version
+        self.perf_data = eventcache.PerfData
+
+    def tearDown(self):
+        eventcache.decoder_version = self.decoder_version
+        eventcache.PerfData = self.perf_data
+        self.tmp.cleanup()
+
+    def entries(self):
+        return sorted([name for name in os.listdir(self.cache)
+                       if name != 'capture.json'])
+
+    def decode(self):
+        return list(eventcache.samples(self.data)[0])
+
+    def test_hit(self):
+        decoded = self.decode()
+        self.assertEqual(len(decoded), 2000)
+        key = eventcache.Entry(self.data).key
+        self.assertEqual(self.entries(), [key])
+
+        def not_decoded(path):
+            raise AssertionError('decoded again')
+        eventcache.PerfData = not_decoded
+        self.assertEqual(self.decode(), decoded)
+        self.assertEqual(self.entries(), [key])
+
+    def test_contents_changed(self):
+        self.decode()
+        old = eventcache.Entry(self.data).key
+
+        # The comm of the first thread, with the same size
+        st = os.stat(self.data)
+        fp = open(self.data, 'r+b')
+        data_off, = struct.unpack_from('<Q', fp.read(104), 40)
+        fp.seek(data_off + 16)
+        self.assertEqual(fp.read(2), b'tc')
+        fp.seek(data_off + 16)
+        fp.write(b'TC')
+        fp.close()
+        os.utime(self.data, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+        self.assertEqual(os.stat(self.data).st_size, st.st_size)
+
+        new = eventcache.Entry(self.data).key
+        self.assertNotEqual(new, old)
+        self.decode()
+        self.assertEqual(self.entries(), [new])
+
+    def test_decoder_changed(self):
+        self.decode()
+        old = eventcache.Entry(self.data).key
+        eventcache.decoder_version = lambda: '0123456789abcdef'
+        new = eventcache.Entry(self.data).key
+        self.assertNotEqual(new, old)
+        self.assertFalse(eventcache.Entry(self.data).exists())
+        self.decode()
+        self.assertEqual(self.entries(), [new])
+
+    def test_not_all_read(self):
+        entry = eventcache.Entry(self.data)
+        perf = PerfData(self.data)
+        stored = entry.store(perf.samples(), perf.meta)
+        for i in range(100):
+            next(stored)
+        stored.close()
+        self.assertFalse(entry.exists())
+        self.assertEqual(self.entries(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#
+# lib/flower.py: a fl_change() call is a replace only out of its own fold
+# probe.
+#
+# License: GPLv3
+#
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'lib'))
+from flower import Probe
+
+
+def change(probe, tid, ts, fold, ret=True):
+    """A fl_change() call from ts on, fold being what its fold probe
+    fetched, None if it couldn't."""
+    probe.add_point(ts, 'flower__fl_change_entry', tid)
+    probe.add_point(ts + 0.001, 'flower__fl_change_sw', tid)
+    probe.add_point(ts + 0.002, 'flower__fl_change_hw', tid)
+    probe.add_point(ts + 0.003, 'flower__fl_change_fold', tid, fold)
+    if ret:
+        probe.add_point(ts + 0.004, 'flower__fl_change_ret', tid)
+
+
+class TestReplace(unittest.TestCase):
+    def counts(self, probe):
+        return [len(probe.phases[op].xy[0]) for op in ('insert', 'replace')]
+
+    def test_replace(self):
+        probe = Probe()
+        change(probe, 1, 1.0, 0)
+        change(probe, 1, 1.1, 0xffff888123450000)
+        change(probe, 1, 1.2, None)
+        self.assertEqual(self.counts(probe), [2, 1])
+
+    def test_return_lost(self):
+        probe = Probe()
+        change(probe, 1, 1.0, 0xffff888123450000, ret=False)
+        change(probe, 1, 1.1, None)
+        change(probe, 2, 1.2, 0)
+        self.assertEqual(self.counts(probe), [2, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#
+# lib/intervals.py: entry/return matching per thread.
+#
+# License: GPLv3
+#
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'lib'))
+from intervals import Matcher, split_probe, FRAME_FUNC, FRAME_ENTRY, \
+    FRAME_CHILDREN, FRAME_MARKS
+
+
+class TestMatcher(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.matcher = Matcher(self.done, ('sw', 'hw'))
+
+    def done(self, tid, frame, ret, stack):
+        self.calls.append((tid, list(frame), ret,
+                           [f[FRAME_FUNC] for f in stack]))
+
+    def counters(self, func):
+        return self.matcher.counters[func]
+
+    def test_split_probe(self):
+        self.assertEqual(split_probe('probe:fl_change__return'),
+                         ('fl_change', True))
+        self.assertEqual(split_probe('probe:fl_change'), ('fl_change', False))
+        self.assertEqual(split_probe('fl_delete'), ('fl_delete', False))
+
+    def test_nesting(self):
+        m = self.matcher
+        m.entry(1, 'tc_new_tfilter', 1.0)
+        m.entry(1, 'fl_change', 1.1)
+        m.entry(1, 'mlx5e_configure_flower', 1.2)
+        m.exit(1, 'mlx5e_configure_flower', 1.5)
+        m.exit(1, 'fl_change', 1.6)
+        m.exit(1, 'tc_new_tfilter', 2.0)
+        self.assertEqual([c[1][FRAME_FUNC] for c in self.calls],
+                         ['mlx5e_configure_flower', 'fl_change',
+                          'tc_new_tfilter'])
+        self.assertEqual(self.calls[0][3], ['tc_new_tfilter', 'fl_change'])
+        self.assertEqual(self.calls[2][3], [])
+        # Time in tracked children
+        self.assertAlmostEqual(self.calls[1][1][FRAME_CHILDREN], 0.3)
+        self.assertAlmostEqual(self.calls[2][1][FRAME_CHILDREN], 0.5)
+        self.assertEqual(m.threads, { })
+        self.assertEqual(m.report(), [
+            'fl_change: 1 matched, 1 nested, 0 orphaned '
+            '(0 entries, 0 returns)',
+            'mlx5e_configure_flower: 1 matched, 1 nested, 0 orphaned '
+            '(0 entries, 0 returns)',
+            'tc_new_tfilter: 1 matched, 0 nested, 0 orphaned '
+            '(0 entries, 0 returns)'])
+
+    def test_orphans(self):
+        m = self.matcher
+        # A return without its entry
+        m.exit(1, 'fl_change', 1.0)
+        # A call whose return was lost, inside one that returns
+        m.entry(1, 'tc_new_tfilter', 1.1)
+        m.entry(1, 'fl_change', 1.2)
+        m.exit(1, 'tc_new_tfilter', 1.5)
+        # A call that never returns
+        m.entry(1, 'fl_delete', 2.0)
+        m.finish()
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(m.report(), [
+            'fl_change: 0 matched, 0 nested, 2 orphaned '
+            '(1 entries, 1 returns)',
+            'fl_delete: 0 matched, 0 nested, 1 orphaned '
+            '(1 entries, 0 returns)',
+            'tc_new_tfilter: 1 matched, 0 nested, 0 orphaned '
+            '(0 entries, 0 returns)'])
+
+    def test_interleaved_threads(self):
+        m = self.matcher
+        m.entry(1, 'fl_change', 1.0)
+        m.entry(2, 'fl_change', 1.1)
+        m.exit(1, 'fl_change', 1.2)
+        m.entry(1, 'fl_change', 1.3)
+        m.exit(2, 'fl_change', 1.4)
+        m.exit(1, 'fl_change', 1.5)
+        self.assertEqual([(tid, frame[FRAME_ENTRY], ret)
+                          for tid, frame, ret, stack in self.calls],
+                         [(1, 1.0, 1.2), (2, 1.1, 1.4), (1, 1.3, 1.5)])
+        self.assertEqual(self.counters('fl_change'), [3, 0, 0, 0])
+
+    def test_marks(self):
+        m = self.matcher
+        self.assertFalse(m.mark(1, 'fl_change', 'sw', 0.5))
+        m.entry(1, 'fl_change', 1.0)
+        m.entry(1, 'mlx5e_configure_flower', 1.1)
+        m.entry(2, 'fl_change', 1.15)
+        # On the open fl_change of thread 1, under the driver call
+        self.assertTrue(m.mark(1, 'fl_change', 'sw', 1.2))
+        # Only the first hit counts
+        self.assertFalse(m.mark(1, 'fl_change', 'sw', 1.25))
+        self.assertTrue(m.mark(2, 'fl_change', 'hw', 1.3))
+        self.assertFalse(m.mark(1, 'fl_delete', 'hw', 1.3))
+        m.exit(1, 'mlx5e_configure_flower', 1.4)
+        m.exit(1, 'fl_change', 1.5)
+        m.exit(2, 'fl_change', 1.6)
+        frames = [frame for tid, frame, ret, stack in self.calls]
+        self.assertEqual(frames[0][FRAME_MARKS:], [0.0, 0.0])
+        self.assertEqual(frames[1][FRAME_MARKS:], [1.2, 0.0])
+        self.assertEqual(frames[2][FRAME_MARKS:], [0.0, 1.3])
+
+    def test_max_depth(self):
+        m = Matcher(self.done, max_depth=4)
+        # Returns lost: the outermost calls go
+        for i in range(6):
+            m.entry(1, 'f%d' % i, float(i))
+        self.assertEqual([f[FRAME_FUNC] for f in m.threads[1]],
+                         ['f2', 'f3', 'f4', 'f5'])
+        m.exit(1, 'f2', 10.0)
+        self.assertEqual(m.report(), [
+            'f0: 0 matched, 0 nested, 1 orphaned (1 entries, 0 returns)',
+            'f1: 0 matched, 0 nested, 1 orphaned (1 entries, 0 returns)',
+            'f2: 1 matched, 0 nested, 0 orphaned (0 entries, 0 returns)',
+            'f3: 0 matched, 0 nested, 1 orphaned (1 entries, 0 returns)',
+            'f4: 0 matched, 0 nested, 1 orphaned (1 entries, 0 returns)',
+            'f5: 0 matched, 0 nested, 1 orphaned (1 entries, 0 returns)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
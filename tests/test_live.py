@@ -0,0 +1,62 @@
+#
+# lib/live.py: calls probed twice count once, and seconds are reported as
+# the wall clock goes.
+#
+# License: GPLv3
+#
+
+import io
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'lib'))
+from live import LiveRates
+
+LINE = '  tc 100 [001] %.9f: %s: (ffffffffc0001000)\n'
+
+
+def calls(start, n):
+    """n fl_change() calls from start on, probed by rate-monitor and by
+    rule-install-rate.py."""
+    lines = []
+    for i in range(n):
+        ts = start + i * 0.001
+        lines += [LINE % (ts, 'probe:fl_change'),
+                  LINE % (ts + 0.00001, 'flower:fl_change_entry'),
+                  LINE % (ts + 0.00002, 'flower:fl_change_ret'),
+                  LINE % (ts + 0.00003, 'probe:fl_change__return')]
+    return lines
+
+
+class TestLiveRates(unittest.TestCase):
+    def test_counted_once(self):
+        out = io.StringIO()
+        live = LiveRates(window=1, out=out)
+        live.feed(calls(100.0, 500))
+        live.finish()
+        self.assertIn('100: insert 500/s', out.getvalue())
+        self.assertIn('fl_change: 500 matched, 0 nested', out.getvalue())
+
+    def test_reported_without_events(self):
+        out = io.StringIO()
+        live = LiveRates(window=1, out=out)
+        r, w = os.pipe()
+        if not os.fork():
+            os.close(r)
+            os.write(w, ''.join(calls(100.0, 10)).encode())
+            time.sleep(2.5)
+            os._exit(0)
+        os.close(w)
+        live.feed_pipe(r)
+        live.finish()
+        os.wait()
+        # The seconds of the stall, with no calls
+        self.assertIn('101: insert 0/s', out.getvalue())
+        self.assertIn('102: insert 0/s', out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
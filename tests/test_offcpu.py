@@ -0,0 +1,115 @@
+#
+# lib/offcpu.py: a fl_change() call blocked, woken up, migrated and
+# preempted, out of sched_switch lines in each of the formats perf prints.
+#
+# License: GPLv3
+#
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'lib'))
+from offcpu import SchedLatency, parse_switch
+
+LINE = '%16s %6d [%03d] %.9f: %s: %s\n'
+
+# sched_switch args, switching out prev with its state, as perf prints them
+# out of the fields, as lib/perfdata.py does with prev_state as a number,
+# and as old perf versions do
+FIELDS = 'prev_comm=%s prev_pid=%d prev_prio=120 prev_state=%s ==> ' \
+         'next_comm=%s next_pid=%d next_prio=120'
+SWITCH = {
+    'fields': FIELDS,
+    'numeric': FIELDS,
+    'old': '%s:%d [120] %s ==> %s:%d [120]',
+}
+STATES = {
+    'fields': {'running': 'R', 'blocked': 'D'},
+    'numeric': {'running': '0', 'blocked': '2'},
+    'old': {'running': 'R', 'blocked': 'D'},
+}
+
+
+def switch(fmt, ts, cpu, prev, state, next):
+    comm = lambda pid: 'tc' if pid else 'swapper/%d' % cpu
+    args = SWITCH[fmt] % (comm(prev), prev, STATES[fmt][state], comm(next),
+                          next)
+    return LINE % (comm(prev), prev, cpu, ts, 'sched:sched_switch', args)
+
+
+def call(fmt):
+    """tc, pid 100, in fl_change() from 1.1 to 2.0: on CPU 1 up to 1.2,
+    blocked up to 1.5, runnable up to 1.6, on CPU 2 up to 1.7, preempted up
+    to 1.8, and on CPU 2 again up to the return."""
+    return [
+        switch(fmt, 1.0, 1, 0, 'running', 100),
+        LINE % ('tc', 100, 1, 1.1, 'probe:fl_change', '(ffffffffc0a14e70)'),
+        switch(fmt, 1.2, 1, 100, 'blocked', 0),
+        LINE % ('swapper/3', 0, 3, 1.5, 'sched:sched_wakeup',
+                'comm=tc pid=100 prio=120 target_cpu=001'),
+        switch(fmt, 1.6, 2, 0, 'running', 100),
+        switch(fmt, 1.7, 2, 100, 'running', 0),
+        switch(fmt, 1.8, 2, 0, 'running', 100),
+        LINE % ('tc', 100, 2, 2.0, 'probe:fl_change__return',
+                '(ffffffffc0a14e70 <- ffffffff8c553f20)'),
+    ]
+
+
+class TestParseSwitch(unittest.TestCase):
+    def test_formats(self):
+        for fmt in SWITCH:
+            for state, runnable in (('running', True), ('blocked', False)):
+                line = switch(fmt, 1.0, 1, 100, state, 0)
+                self.assertEqual(parse_switch(line), (100, runnable, 0), fmt)
+
+    def test_preempted(self):
+        # TASK_REPORT_MAX, as in R+
+        self.assertEqual(parse_switch('prev_comm=tc prev_pid=100 '
+                                      'prev_prio=120 prev_state=256 ==> '
+                                      'next_comm=a next_pid=7 '
+                                      'next_prio=120'), (100, True, 7))
+        self.assertEqual(parse_switch('prev_comm=tc prev_pid=100 '
+                                      'prev_prio=120 prev_state=R+ ==> '
+                                      'next_comm=a next_pid=7 '
+                                      'next_prio=120'), (100, True, 7))
+
+    def test_not_a_switch(self):
+        self.assertIsNone(parse_switch('comm=tc pid=100 prio=120'))
+
+
+class TestSchedLatency(unittest.TestCase):
+    def check(self, fmt):
+        sched = SchedLatency()
+        sched.feed(call(fmt))
+        calls, total, on, runnable, blocked, switches, migrations = \
+            sched.rows['fl_change']
+        self.assertEqual(calls, 1)
+        self.assertAlmostEqual(total, 0.9)
+        self.assertAlmostEqual(on, 0.4)
+        self.assertAlmostEqual(runnable, 0.2)
+        self.assertAlmostEqual(blocked, 0.3)
+        self.assertEqual(switches, 2)
+        self.assertEqual(migrations, 1)
+        self.assertEqual(sched.names(), ['fl_change'])
+        self.assertEqual(sched.switches, 5)
+
+    def test_fields(self):
+        self.check('fields')
+
+    def test_numeric(self):
+        self.check('numeric')
+
+    def test_old(self):
+        self.check('old')
+
+    def test_no_switches(self):
+        # Calls before the first sched_switch are not looked at
+        sched = SchedLatency()
+        sched.feed(call('fields')[1:2] + call('fields')[-1:])
+        self.assertEqual(sched.rows, { })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#
+# lib/perfdata.py: perf.data files written by bench/gen-events.py read as
+# perf script prints them, and what the reader doesn't support.
+#
+# License: GPLv3
+#
+
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+
+TOP = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, os.path.join(TOP, 'lib'))
+from perfdata import PerfData, PerfDataError, MAGIC, SAMPLE_READ
+from perfscript import parse_line
+
+GEN = os.path.join(TOP, 'bench', 'gen-events.py')
+
+
+def generate(path, workload, fmt, events=3000):
+    subprocess.check_call([sys.executable, GEN, '-w', workload, '-n',
+                           str(events), '-f', fmt, '-o', path])
+
+
+class TestPerfData(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def check_workload(self, workload):
+        text = self.path(workload + '.txt')
+        data = self.path(workload + '.data')
+        generate(text, workload, 'text')
+        generate(data, workload, 'perf.data')
+
+        expected = [s[:4] for s in map(parse_line, open(text)) if s]
+        got = [s[:4] for s in PerfData(data).samples()]
+        self.assertEqual(len(got), 3000)
+        self.assertEqual(got, expected)
+
+    def test_flower(self):
+        self.check_workload('flower')
+
+    def test_flower_sched(self):
+        self.check_workload('flower-sched')
+
+    def test_ct(self):
+        self.check_workload('ct')
+
+    def test_args(self):
+        data = self.path('ct.data')
+        generate(data, 'ct', 'perf.data', 100)
+        for tid, cpu, ts, name, args in PerfData(data).samples():
+            if name.endswith('_work_handler'):
+                self.assertEqual(args, '')
+            else:
+                self.assertRegex(args, r'^offload=0xffff8881[0-9a-f]{8}$')
+
+    def test_read(self):
+        data = self.path('ct.data')
+        generate(data, 'ct', 'perf.data', 100)
+        samples = list(PerfData(data).samples())
+        for keep_args in (False, True):
+            events = PerfData(data).read(keep_args)
+            self.assertEqual(list(zip(events.tid, events.cpu, events.ts,
+                                      [events.names[e]
+                                       for e in events.event])),
+                             [s[:4] for s in samples])
+            self.assertEqual(events.args, [s[4] for s in samples]
+                             if keep_args else None)
+
+    def test_pipe_mode(self):
+        path = self.path('pipe.data')
+        open(path, 'wb').write(MAGIC + struct.pack('<QQ', 16, 128) +
+                               b'\0' * 80)
+        with self.assertRaisesRegex(PerfDataError, 'pipe mode'):
+            PerfData(path)
+
+    def test_bad_magic(self):
+        path = self.path('bad.data')
+        open(path, 'wb').write(b'PERFFILE' + b'\0' * 96)
+        with self.assertRaisesRegex(PerfDataError, 'not a perf.data'):
+            PerfData(path)
+
+    def test_sample_read(self):
+        path = self.path('read.data')
+        generate(path, 'flower', 'perf.data', 100)
+        data = bytearray(open(path, 'rb').read())
+        attrs_off, = struct.unpack_from('<Q', data, 24)
+        # perf_event_attr.sample_type, after type, size, config and period
+        sample_type, = struct.unpack_from('<Q', data, attrs_off + 24)
+        struct.pack_into('<Q', data, attrs_off + 24,
+                         sample_type | SAMPLE_READ)
+        open(path, 'wb').write(data)
+        with self.assertRaisesRegex(PerfDataError, 'PERF_SAMPLE_READ'):
+            PerfData(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
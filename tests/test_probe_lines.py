@@ -0,0 +1,117 @@
+#
+# rule-install-rate.py capture: the probe lines cache, with a stand-in perf
+# on PATH that takes probes only at the numbered lines of its listing.
+#
+# License: GPLv3
+#
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+TOP = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+SCRIPT = os.path.join(TOP, 'rule-install-rate', 'rule-install-rate.py')
+
+# perf probe -L fl_change, as the stand-in lists it: {0} is added to the line
+# numbers, so that the cached ones go stale
+LISTING = '''<fl_change@net/sched/cls_flower.c:0>
+      0  static int fl_change(struct net *net, struct sk_buff *in_skb,
+                /* err = fl_ht_insert_unique(fnew, fold, &in_ht); below */
+     {1}          err = fl_ht_insert_unique(fnew, fold, &in_ht);
+     {2}          err = fl_hw_replace_filter(tp, fnew, rtnl_held, extack);
+     {3}          if (!tc_in_hw(fnew->flags))
+'''
+
+PERF = '''#!%s
+import os, re, sys
+log = open(os.environ['STUB_LOG'], 'a')
+args = sys.argv[1:]
+listing = open(os.environ['STUB_LISTING']).read()
+lines = [l.split()[0] for l in listing.splitlines()
+         if l.split() and l.split()[0].isdigit()]
+if '-L' in args:
+    log.write('list\\n')
+    sys.stdout.write(listing)
+elif '-a' in args:
+    spec = args[args.index('-a') + 1]
+    log.write('add %%s\\n' %% spec)
+    m = re.search(r'=fl_change:(\\d+)', spec)
+    if m and m.group(1) not in lines:
+        sys.exit(1)
+    if 'fold' in spec.split() and os.environ.get('STUB_NO_FOLD'):
+        sys.exit(1)
+''' % sys.executable
+
+
+class TestProbeLines(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        bindir = os.path.join(self.dir, 'bin')
+        os.mkdir(bindir)
+        for name, text in (('perf', PERF), ('modprobe', '#!/bin/sh\n')):
+            path = os.path.join(bindir, name)
+            open(path, 'w').write(text)
+            os.chmod(path, 0o755)
+        self.log = os.path.join(self.dir, 'log')
+        self.listing = os.path.join(self.dir, 'listing')
+        self.env = dict(os.environ, PATH=bindir + ':' + os.environ['PATH'],
+                        XDG_CACHE_HOME=os.path.join(self.dir, 'cache'),
+                        STUB_LOG=self.log, STUB_LISTING=self.listing)
+        self.list_at(0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def list_at(self, offset):
+        open(self.listing, 'w').write(LISTING.format(
+            *[str(n + offset) for n in (0, 20, 30, 40)]))
+
+    def capture(self, **env):
+        open(self.log, 'w').close()
+        out = subprocess.run([sys.executable, SCRIPT, 'capture', '--',
+                              'true'], cwd=self.dir, env=dict(self.env, **env),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             universal_newlines=True)
+        self.assertEqual(out.returncode, 0, out.stdout)
+        return out.stdout, open(self.log).read().splitlines()
+
+    def cached(self):
+        cache = json.load(open(os.path.join(self.dir, 'cache', 'perf-flower',
+                                            'probe-lines.json')))
+        return list(cache.values())[0]
+
+    def test_miss_then_hit(self):
+        out, log = self.capture()
+        self.assertEqual(log.count('list'), 1)
+        # Not the line without a number, where the code shows up first
+        self.assertEqual(self.cached()['fl_change_sw'][1], 20)
+        self.assertEqual(self.cached()['fl_change_fold'][1], 40)
+
+        out, log = self.capture()
+        self.assertEqual(log.count('list'), 0)
+        self.assertNotIn('stale', out)
+
+    def test_all_stale(self):
+        self.capture()
+        self.list_at(5)
+        out, log = self.capture()
+        # Looked up once, for all of them
+        self.assertEqual(log.count('list'), 1)
+        self.assertIn('stale', out)
+        self.assertEqual(self.cached()['fl_change_sw'][1], 25)
+        self.assertEqual(self.cached()['fl_change_fold'][1], 45)
+
+    def test_fold_not_fetched(self):
+        self.capture(STUB_NO_FOLD='1')
+        out, log = self.capture(STUB_NO_FOLD='1')
+        self.assertEqual(log.count('list'), 0)
+        self.assertNotIn('stale', out)
+        self.assertIn('can\'t fetch fold', out)
+
+
+if __name__ == '__main__':
+    unittest.main()
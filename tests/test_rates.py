@@ -0,0 +1,86 @@
+#
+# lib/rates.py: a known gap in a steady call stream is a stall, whatever the
+# window, and the EWMA follows the same time constant.
+#
+# License: GPLv3
+#
+
+import math
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'lib'))
+from rates import Rates, window_counts, ewma, find_stalls
+
+# 100 calls/s for 10s, but none from 4s to 6s
+CALLS = [k + j / 100.0 + 0.005 for k in range(10) if k not in (4, 5)
+         for j in range(100)]
+
+
+class TestRates(unittest.TestCase):
+    def rates(self, window):
+        rates = Rates(window, tau=5.0, threshold=0.5)
+        rates.add('insert', CALLS)
+        self.assertTrue(rates.compute(0.0, 9.999))
+        return rates
+
+    def test_window_counts(self):
+        self.assertEqual(window_counts([0.5, 1.5, 1.7, -1.0, 9.0], 0.0, 1.0,
+                                       3), [2, 2, 1])
+
+    def test_ewma(self):
+        self.assertEqual(ewma([], 0.5), [])
+        self.assertEqual(ewma([4.0, 0.0, 0.0], 0.5), [4.0, 2.0, 1.0])
+
+    def test_find_stalls(self):
+        self.assertEqual(find_stalls([0, 9, 1, 2, 9, 0, 9, 0], 5, 1, 6),
+                         [[2, 3, 1], [5, 5, 0]])
+
+    def check_gap(self, window):
+        rates = self.rates(window)
+        s = rates.series[0]
+        per_second = int(round(1 / window))
+        self.assertEqual(rates.n, 10 * per_second)
+        self.assertAlmostEqual(s.median, 100.0)
+        self.assertEqual(s.stalls, [[4 * per_second, 6 * per_second - 1,
+                                     0.0]])
+        # Calls so far, up to the end of each window
+        self.assertEqual(s.calls[4 * per_second - 1], 400)
+        self.assertEqual(s.calls[6 * per_second - 1], 400)
+        self.assertEqual(s.calls[-1], 800)
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'stalls.dat')
+        rates.write_stalls(path)
+        self.assertEqual(open(path).read().splitlines()[1:],
+                         ['insert\t4.000000\t6.000000\t0.000000\t'
+                          '100.000000\t400'])
+        self.assertEqual(rates.report(), [
+            'insert: median 100.0 calls/s per %gs window, %d windows below '
+            '50%% of it' % (window, 2 * per_second),
+            '  4.000-6.000s: 0.0 calls/s at the lowest'])
+
+    def test_gap(self):
+        self.check_gap(1.0)
+
+    def test_gap_short_windows(self):
+        self.check_gap(0.1)
+
+    def test_time_constant(self):
+        # A second into the gap, the EWMA went down by exp(-1 / tau), with
+        # 1s windows as well as with 0.1s ones
+        for window in (1.0, 0.1):
+            s = self.rates(window).series[0]
+            k = int(round(5 / window)) - 1
+            self.assertAlmostEqual(s.ewma[k], 100.0 * math.exp(-1 / 5.0))
+        self.assertAlmostEqual(Rates(0.1, 5.0).alpha,
+                               1 - math.exp(-0.02))
+        self.assertEqual(Rates(0.1, 0).alpha, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()